@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Introspection views, registered when configs.debug is on.
+'''
+
+from aiohttp import web
+
+import executor, orm, querylog, search, tracing
+from coroweb import get
+
+@get('/__routes__')
+async def routes(request):
+	router = request.app.router
+	if hasattr(router, 'describe'):
+		return dict(router=type(router).__name__, stats=router.stats(), routes=router.describe())
+	# aiohttp默认路由没有命中统计
+	items = [dict(method=r.method, path=r.resource.canonical if r.resource else '', handler=repr(r.handler))
+		for r in router.routes()]
+	return dict(router=type(router).__name__, routes=items)
+
+@get('/__executors__')
+async def executors(request):
+	return executor.stats()
+
+@get('/__metrics__')
+async def metrics(request):
+	''' latency histograms per route and per span, orm pools, caches and executors '''
+	result = tracing.metrics()
+	result.update(orm=orm.pool_stats(), sql_cache=orm.sql_cache_info(), executors=executor.stats())
+	result.update(search=dict((name, index.stats()) for name, index in search.indexes.items()),
+		write_behind=orm.write_behind_stats())
+	for name in ('__page_cache__', '__static__'):
+		if name in request.app:
+			result[name.strip('_')] = request.app[name].stats()
+	return result
+
+@get('/__traces__')
+async def traces(request):
+	''' the most recent sampled traces with their spans '''
+	return dict(traces=tracing.recent())
+
+@get('/__profile__')
+async def profile(*, seconds: float = 10, interval: float = 0.005):
+	''' sample the event loop thread for seconds, return folded stacks (flamegraph.pl input) '''
+	try:
+		folded = await tracing.profiler.run(seconds, interval)
+	except RuntimeError as e:
+		return web.HTTPConflict(text=str(e))
+	return web.Response(text=folded, content_type='text/plain')
+
+@get('/__queries__')
+async def queries(*, sort='total', reset=''):
+	''' orm statements aggregated by shape, with EXPLAIN plans and index advice of slow ones '''
+	if sort not in ('total', 'count', 'max', 'slow', 'rows'):
+		return web.HTTPBadRequest(text='invalid sort: %s' % sort)
+	result = querylog.snapshot(sort)
+	if reset:
+		querylog.reset()
+	return result
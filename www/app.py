@@ -5,12 +5,16 @@
 async web application.
 '''
 import logging; logging.basicConfig(level=logging.DEBUG)
-import asyncio, os, json, time
+import asyncio, os, json, time, tempfile
 from datetime import datetime
 from aiohttp import web
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 
-import orm
+import orm, serializers, compress, executor, querylog, search, tracing
+from config import configs
+from compress import compress_factory
+from pagecache import cache_factory, init_page_cache
+from router import RadixRouter
 from coroweb import add_routes, add_static
 
 
@@ -26,8 +30,10 @@ def init_jinja2(app, **kw):
         # 变量的开始、结束标志  
 		variable_start_string = kw.get('variable_start_string', '{{'),  
 		variable_end_string = kw.get('variable_end_string', '}}'),  
-        # 自动加载修改后的模板文件  
-		auto_reload = kw.get('auto_reload', True)  
+        # 自动加载修改后的模板文件，只在debug时打开
+		auto_reload = kw.get('auto_reload', configs.debug),
+		# 异步模板：generate_async逐段输出，渲染大页面时不阻塞事件循环
+		enable_async = kw.get('enable_async', False)
     )      # 配置options参数  
 
 	# 获取模板文件夹路径 
@@ -36,6 +42,16 @@ def init_jinja2(app, **kw):
 		# os.path.abspath(__file__)获取当前运行脚本的绝对路径
 		path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 
+	# 编译后的模板字节码缓存到文件，worker启动时不必重新编译
+	bytecode_cache = kw.get('bytecode_cache', None)
+	if bytecode_cache is not None:
+		if not bytecode_cache:
+			bytecode_cache = os.path.join(tempfile.gettempdir(), 'awesome-jinja2-cache')
+		os.makedirs(bytecode_cache, exist_ok=True)
+		# 同步和异步模式编译出的代码不同，分开缓存
+		pattern = '__jinja2_async_%s.cache' if options['enable_async'] else '__jinja2_%s.cache'
+		options['bytecode_cache'] = FileSystemBytecodeCache(bytecode_cache, pattern)
+
 	env = Environment(loader = FileSystemLoader(path), **options)
 	
 	# filters是Environment类的属性：过滤器处理字典
@@ -44,9 +60,58 @@ def init_jinja2(app, **kw):
 		for name, f in filters.items():
 			env.filters[name] = f
 
+	# 启动时预编译templates/下的全部模板
+	if kw.get('precompile', False):
+		precompile_templates(env)
+
 	# 所有的模板和过滤器都给app全局保存
 	app['__template__'] = env
 
+def precompile_templates(env):
+	''' load every template once so it is compiled (and written to the bytecode cache) before serving '''
+	start = time.time()
+	names = env.list_templates()
+	for name in names:
+		env.get_template(name)
+	logging.info('precompiled %s templates in %.3fs' % (len(names), time.time() - start))
+	return names
+
+# 渲染模板：异步模板分段写出（StreamResponse），否则一次渲染成完整页面
+# 页面缓存要求完整响应体时（request['__buffered__']），异步模板也一次渲染完
+async def render_template(app, request, template, r):
+	env = app['__template__']
+	tmpl = env.get_template(template)
+	if not env.is_async or request.get('__buffered__', False):
+		# 调用Template对象的render()方法，传入r渲染模板，返回unicode格式字符串，将其用utf-8编码
+		with tracing.span('template', template=template):
+			body = tmpl.render(**r) if not env.is_async else await tmpl.render_async(**r)
+		resp = web.Response(body=body.encode('utf-8'))
+		resp.content_type = 'text/html;charset=utf-8'
+		return resp
+	resp = web.StreamResponse()
+	resp.content_type = 'text/html'
+	resp.charset = 'utf-8'
+	resp.enable_chunked_encoding()
+	# 流式响应不经过compress_factory，由aiohttp边写边压缩
+	if compress.enabled():
+		resp.enable_compression()
+	await resp.prepare(request)
+	buf = []
+	size = 0
+	with tracing.span('template', template=template, stream=True):
+		async for s in tmpl.generate_async(**r):
+			buf.append(s)
+			size += len(s)
+			# 攒够一段再发送，避免每个模板片段一次write
+			if size >= 8192:
+				await resp.write(''.join(buf).encode('utf-8'))
+				buf = []
+				size = 0
+		if buf:
+			await resp.write(''.join(buf).encode('utf-8'))
+	await resp.write_eof()
+	return resp
+
 
 # 编写用于输出日志的middleware
 # app, handler 由中间件框架传入:
@@ -54,17 +119,33 @@ def init_jinja2(app, **kw):
 # request是aiohttp传给path视图函数的RequestHandler的请求体
 async def logger_factory(app, handler):
 	async def logger(request):
-		logging.info('logger_factory handler: %s %s' % (request.method, request.path))
+		# 只在DEBUG级别输出；请求耗时统计见tracing.trace_factory
+		logging.debug('request: %s %s', request.method, request.path)
 		return await handler(request)
 	return logger
 
+# 请求范围的orm状态：同一个事件循环tick里的Model.find合并为一次find_many，写过主库后读也走主库
+async def orm_factory(app, handler):
+	async def orm_scope(request):
+		with orm.request_scope():
+			return await handler(request)
+	return orm_scope
+
 # 处理视图函数返回值，制作response的middleware，构造出真正的web.Response对象 
 async def response_factory(app, handler):
 	async def response(request):
-		logging.info('response_factory handler...')
 		# RequestHandler处理之后的切面
-		r = await handler(request)
-		logging.info('response result = %s' % str(r))
+		try:
+			r = await handler(request)
+		except orm.PoolOverloadError as e:
+			# 数据库连接池耗尽，返回503而不是无限排队
+			logging.warn('database overloaded: %s' % e)
+			return web.HTTPServiceUnavailable(text=str(e))
+		except executor.ExecutorOverloadError as e:
+			# 线程/进程池已满
+			logging.warn('executor overloaded: %s' % e)
+			return web.HTTPServiceUnavailable(text=str(e), headers={'Retry-After': '1'})
+		logging.debug('response result = %s', r)
 		if isinstance(r, web.StreamResponse):
 			# StreamResponse是所有WebResponse的父类
 			return r
@@ -84,17 +165,25 @@ async def response_factory(app, handler):
 			# 在后续构造视图函数返回值时，会加入__template__值，用以选择渲染的模板 
 			template = r.get('__template__', None)
 			if template is None: # 不带模板信息，返回json对象
-				# ensure_ascii：默认True，仅能输出ascii格式数据。故设置为False。  
-				# default：r对象会先被传入default中的函数进行处理，然后才被序列化为json对象  
-				# __dict__：以dict形式返回对象属性和值的映射  
-				resp = web.Response(body=json.dumps(r, ensure_ascii=False, default=lambda obj: obj.__dict__).encode('utf-8'))
+				# serializers直接输出utf-8 bytes（有orjson/ujson时优先使用）
+				# 含有超长列表时分块流式输出，不在内存里拼出整个json
+				if serializers.should_stream(r) and not request.get('__buffered__', False):
+					resp = web.StreamResponse()
+					resp.content_type = 'application/json'
+					resp.charset = 'utf-8'
+					resp.enable_chunked_encoding()
+					if compress.enabled():
+						resp.enable_compression()
+					await resp.prepare(request)
+					for chunk in serializers.iter_dumps(r):
+						await resp.write(chunk)
+					await resp.write_eof()
+					return resp
+				resp = web.Response(body=serializers.dumps(r))
 				resp.content_type = 'application/json;charset=utf-8'
 				return resp
 			else: # 带模板信息，渲染模板
-				# 调用Template对象的render()方法，传入r渲染模板，返回unicode格式字符串，将其用utf-8编码
-				resp = web.Response(body=app['__template__'].get_template(template).render(**r))
-				resp.content_type = 'text/html;charset=utf-8'
-				return resp
+				return await render_template(app, request, template, r)
 
 		# 返回响应码
 		if isinstance(r, int) and (600>r>=100): 
@@ -127,16 +216,53 @@ def datetime_filter(t):
 	dt = datetime.fromtimestamp(t)
 	return u'%s年%s月%s日' % (dt.year, dt.month, dt.day)
 
+async def create_app(loop, workers=1):
+	'''
+	orm pool, middlewares, templates and routes from configs; used by __main__ and each
+	server.py worker, workers being the number of worker processes serving the port.
+	'''
+	logging.getLogger().setLevel(configs.log_level)
+	await orm.create_pool(loop=loop, **configs.db)
+	executor.configure(**configs.executor)
+	tracing.configure(**configs.tracing)
+	querylog.configure(**configs.queries)
+	# configs.router.radix: 用前缀树解析路由
+	router = RadixRouter() if configs.router.get('radix', False) else None
+	# trace_factory在最外层，其余中间件各记录一个span
+	middlewares = [tracing.traced(m) for m in (logger_factory, compress_factory, cache_factory, orm_factory, response_factory)]
+	app = web.Application(router=router, middlewares=[tracing.trace_factory] + middlewares)
+	init_page_cache(app, **configs.page_cache)
+
+	init_jinja2(app, filters=dict(datetime = datetime_filter), **configs.jinja2)
+	serializers.configure(**configs.json)
+	compress.configure(**configs.compress)
+	add_routes(app, 'test_view')
+	if configs.debug:
+		add_routes(app, 'admin_view')
+	add_static(app, **configs.static)
+	# 视图模块导入了声明__cache__/__search__/__write_behind__的model之后
+	backend = configs.model_cache.backend
+	if backend == 'auto':
+		# 多个worker共享redis, 一个worker的失效对所有worker生效
+		backend = 'redis' if workers > 1 else None
+	if backend:
+		orm.configure_cache(backend, **configs.model_cache.get(backend, {}))
+		# 启动时发现缓存不可用, 而不是在每次查询时
+		for cls in orm.models():
+			if cls.__cache__ is not None:
+				await cls.__cache__.check()
+	await orm.configure_write_behind(configs.write_behind)
+	await orm.start_write_behind()
+	await search.init_search(app, **configs.search)
+	return app
+
+# 单进程运行；多进程见server.py
 if __name__ == '__main__':
 
 	async def init(loop):
-		app = web.Application(loop = loop, middlewares=[logger_factory, response_factory])
-
-		init_jinja2(app, filters=dict(datetime = datetime_filter))
-		add_routes(app, 'test_view')
-		add_static(app)
-		srv = await loop.create_server(app.make_handler(), 'localhost', 9000)
-		logging.info('server started at http://127.0.0.1:9000...')
+		app = await create_app(loop)
+		srv = await loop.create_server(app.make_handler(), configs.server.host, configs.server.port)
+		logging.info('server started at http://%s:%s...' % (configs.server.host, configs.server.port))
 		return srv
 
 	loop = asyncio.get_event_loop()
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmarks, run from the www directory, e.g.:
+
+	python -m bench.rows
+
+bench.e2e runs the whole application against bench.fakedb, a simulated aiomysql, so
+none of them needs a mysql server.
+'''
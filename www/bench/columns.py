@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Analytics benchmark: row based aggregation vs columnar (numpy) results.
+
+Both paths start from what the cursor returns (dict rows for findAll, tuple rows
+for rows='columns') and compute comments per user and activity per day, e.g.:
+
+	python -m bench.columns --rows 1000000
+'''
+
+import argparse, collections, logging, time
+
+logging.disable(logging.INFO)
+
+import numpy
+import orm
+from models import Comment, next_id
+
+DAY = 86400
+
+def source_rows(n, users):
+	columns = [Comment.__primary_key__] + Comment.__fields__
+	start = time.time() - 90 * DAY
+	t = lambda i: start + i * 90.0 * DAY / n
+	tuples = [(next_id(), 'b%d' % (i % 1000), 'u%d' % (i % users), 'user', 'about:blank', 'content', t(i), t(i)) for i in range(n)]
+	dicts = [dict(zip(columns, t)) for t in tuples]
+	return columns, dicts, tuples
+
+def rows_path(dicts):
+	rows = [Comment(**r) for r in dicts]
+	per_user = collections.Counter(r.user_id for r in rows)
+	per_day = collections.Counter(int(r.created_at // DAY) for r in rows)
+	return len(per_user), len(per_day)
+
+def columns_path(columns, tuples):
+	cols = orm.rows_to_columns(tuples, columns, Comment.dtypes())
+	users, user_counts = numpy.unique(cols['user_id'], return_counts=True)
+	days = (cols['created_at'] // DAY).astype('int64')
+	per_day = numpy.bincount(days - days.min())
+	return len(users), int(numpy.count_nonzero(per_day))
+
+def columns_chunked_path(columns, tuples, chunk_size):
+	# 模拟iter_columns分块流式转换再合并
+	parts = [orm.rows_to_columns(tuples[i:i + chunk_size], columns, Comment.dtypes()) for i in range(0, len(tuples), chunk_size)]
+	cols = dict((c, numpy.concatenate([p[c] for p in parts])) for c in columns)
+	users = numpy.unique(cols['user_id'])
+	days = numpy.unique((cols['created_at'] // DAY).astype('int64'))
+	return len(users), len(days)
+
+def timed(fn, *args):
+	start = time.perf_counter()
+	r = fn(*args)
+	return r, time.perf_counter() - start
+
+def main():
+	parser = argparse.ArgumentParser(description='row vs columnar aggregation benchmark')
+	parser.add_argument('--rows', type=int, default=1000000)
+	parser.add_argument('--users', type=int, default=5000)
+	parser.add_argument('--chunk-size', type=int, default=10000)
+	opts = parser.parse_args()
+	columns, dicts, tuples = source_rows(opts.rows, opts.users)
+	print('%-18s %10s %14s %s' % ('mode', 'seconds', 'rows/s', 'result'))
+	for name, fn, args in (('rows', rows_path, (dicts,)),
+			('columns', columns_path, (columns, tuples)),
+			('columns chunked', columns_chunked_path, (columns, tuples, opts.chunk_size))):
+		r, t = timed(fn, *args)
+		print('%-18s %10.3f %14.0f %s' % (name, t, opts.rows / t, r))
+
+if __name__ == '__main__':
+	main()
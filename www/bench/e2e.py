@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+End-to-end benchmark: the application built by app.create_app (middlewares, coroweb
+handlers, orm, jinja) served on a local port, the database replaced by bench.fakedb,
+driven by an async load generator. Reports throughput and p50/p99 latency per route and
+per orm operation; --output stores the results as json, --compare prints the change
+against an earlier run, --queries prints the querylog report with EXPLAIN plans and
+index advice, e.g.:
+
+	python -m bench.e2e --duration 10 --concurrency 32 --latency 0.002 --output e2e.json
+	python -m bench.e2e --duration 10 --concurrency 32 --latency 0.002 --compare e2e.json
+'''
+
+import argparse, asyncio, collections, functools, json, logging, os, platform, random, socket, sys, time
+
+logging.disable(logging.WARNING)
+
+import aiohttp
+from aiohttp import web
+from jinja2 import ChoiceLoader, FileSystemLoader
+
+import orm, querylog
+from bench import fakedb
+orm.aiomysql = fakedb
+
+import app as app_module
+from coroweb import add_routes
+
+# (名称, 方法, 权重, i => (url, post数据))
+ROUTES = [
+	('GET /', 'GET', 2, lambda i: ('/', None)),
+	('GET /bench/blogs', 'GET', 4, lambda i: ('/bench/blogs?page=%d' % (i % 5 + 1), None)),
+	('GET /bench/blog/{id}', 'GET', 4, lambda i: ('/bench/blog/blogs-%d' % (i % 100), None)),
+	('GET /bench/api/users', 'GET', 3, lambda i: ('/bench/api/users?page=%d' % (i % 5 + 1), None)),
+	('POST /bench/api/blogs/{id}/comments', 'POST', 1,
+		lambda i: ('/bench/api/blogs/blogs-%d/comments' % (i % 100), dict(content='comment %d' % i))),
+]
+
+ORM_CLASSMETHODS = ('findAll', 'find', 'find_many', 'findNumber')
+ORM_METHODS = ('save', 'update', 'remove')
+
+def percentile(values, q):
+	if not values:
+		return 0.0
+	return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(samples, duration):
+	values = sorted(samples)
+	return dict(count=len(values), rps=len(values) / duration if duration else 0.0,
+		mean=sum(values) / len(values) if values else 0.0,
+		p50=percentile(values, 0.5), p99=percentile(values, 0.99), max=values[-1] if values else 0.0)
+
+def instrument_orm(samples):
+	''' time every call of the Model query methods into samples[name] '''
+	def timed(name, fn):
+		@functools.wraps(fn)
+		async def wrapper(*args, **kw):
+			start = time.perf_counter()
+			try:
+				return await fn(*args, **kw)
+			finally:
+				samples[name].append(time.perf_counter() - start)
+		return wrapper
+	for name in ORM_CLASSMETHODS:
+		fn = orm.Model.__dict__[name].__func__
+		setattr(orm.Model, name, classmethod(timed(name, fn)))
+	for name in ORM_METHODS:
+		setattr(orm.Model, name, timed(name, orm.Model.__dict__[name]))
+
+async def start_server(loop, write_behind=False):
+	app_module.configs.write_behind.comments.enabled = write_behind
+	app = await app_module.create_app(loop)
+	env = app['__template__']
+	env.loader = ChoiceLoader([FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')), env.loader])
+	add_routes(app, 'bench.views')
+	runner = web.AppRunner(app)
+	await runner.setup()
+	sock = socket.socket()
+	sock.bind(('127.0.0.1', 0))
+	site = web.SockSite(runner, sock)
+	await site.start()
+	return runner, 'http://127.0.0.1:%d' % sock.getsockname()[1]
+
+async def worker(n, session, base, deadline, remaining, results, errors):
+	rnd = random.Random(n)
+	weights = [r[2] for r in ROUTES]
+	i = n
+	while time.perf_counter() < deadline and remaining[0] != 0:
+		remaining[0] -= 1
+		name, method, weight, make = rnd.choices(ROUTES, weights)[0]
+		url, data = make(i)
+		i += 1
+		start = time.perf_counter()
+		try:
+			async with session.request(method, base + url, data=data) as resp:
+				await resp.read()
+				ok = resp.status < 400
+		except aiohttp.ClientError:
+			ok = False
+		if ok:
+			results[name].append(time.perf_counter() - start)
+		else:
+			errors[name] += 1
+
+async def run(opts):
+	fakedb.configure(latency=opts.latency, write_latency=opts.write_latency, jitter=opts.jitter,
+		rows=opts.rows, content_size=opts.content_size)
+	orm_samples = collections.defaultdict(list)
+	instrument_orm(orm_samples)
+	loop = asyncio.get_event_loop()
+	runner, base = await start_server(loop, opts.write_behind)
+	if opts.queries:
+		querylog.configure(slow_threshold=opts.slow_query, explain_interval=3600)
+	results = collections.defaultdict(list)
+	errors = collections.Counter()
+	connector = aiohttp.TCPConnector(limit=opts.concurrency)
+	async with aiohttp.ClientSession(connector=connector) as session:
+		# 预热：模板编译、缓存填充
+		warm = time.perf_counter() + opts.warmup
+		await asyncio.gather(*[worker(n, session, base, warm, [-1], collections.defaultdict(list), collections.Counter())
+			for n in range(opts.concurrency)])
+		for samples in orm_samples.values():
+			del samples[:]
+		start = time.perf_counter()
+		remaining = [opts.requests or -1]
+		await asyncio.gather(*[worker(n, session, base, start + opts.duration, remaining, results, errors)
+			for n in range(opts.concurrency)])
+		elapsed = time.perf_counter() - start
+	await runner.cleanup()
+	await orm.close_pool()
+	total = sum(len(v) for v in results.values())
+	return dict(
+		meta=dict(time=time.strftime('%Y-%m-%d %H:%M:%S'), python=platform.python_version(),
+			aiohttp=aiohttp.__version__, options=vars(opts), elapsed=elapsed),
+		total=dict(requests=total, errors=sum(errors.values()), rps=total / elapsed),
+		routes=dict((name, dict(summarize(results[name], elapsed), errors=errors[name])) for name, m, w, f in ROUTES),
+		orm=dict((name, summarize(v, elapsed)) for name, v in sorted(orm_samples.items())),
+		queries=dict(fakedb.stats), shapes=querylog.snapshot()['shapes'])
+
+def change(new, old):
+	if not old:
+		return ''
+	return '%+.1f%%' % ((new - old) * 100.0 / old)
+
+def report(result, baseline=None):
+	base_routes = baseline['routes'] if baseline else dict()
+	base_orm = baseline['orm'] if baseline else dict()
+	print('%-40s %8s %6s %10s %9s %9s %9s %9s' % ('route', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'req/s', 'p99'))
+	for name, r in result['routes'].items():
+		b = base_routes.get(name, dict())
+		print('%-40s %8d %6d %10.1f %9.2f %9.2f %9s %9s' % (name, r['count'], r['errors'], r['rps'],
+			r['p50'] * 1000, r['p99'] * 1000, change(r['rps'], b.get('rps')), change(r['p99'], b.get('p99'))))
+	print()
+	print('%-40s %8s %6s %10s %9s %9s %9s %9s' % ('orm operation', 'calls', '', 'calls/s', 'p50 ms', 'p99 ms', 'calls/s', 'p99'))
+	for name, r in result['orm'].items():
+		b = base_orm.get(name, dict())
+		print('%-40s %8d %6s %10.1f %9.2f %9.2f %9s %9s' % (name, r['count'], '', r['rps'],
+			r['p50'] * 1000, r['p99'] * 1000, change(r['rps'], b.get('rps')), change(r['p99'], b.get('p99'))))
+	print()
+	total = result['total']
+	print('total: %d requests, %d errors, %.1f req/s %s' % (total['requests'], total['errors'], total['rps'],
+		change(total['rps'], baseline['total']['rps']) if baseline else ''))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='end-to-end benchmark against a simulated database')
+	parser.add_argument('--duration', type=float, default=10.0, help='seconds of measured load')
+	parser.add_argument('--requests', type=int, default=0, help='stop after this many requests (0: duration only)')
+	parser.add_argument('--warmup', type=float, default=1.0)
+	parser.add_argument('--concurrency', type=int, default=32)
+	parser.add_argument('--latency', type=float, default=0.002, help='seconds per select')
+	parser.add_argument('--write-latency', type=float, default=None, help='seconds per write (default: --latency)')
+	parser.add_argument('--jitter', type=float, default=0.0)
+	parser.add_argument('--rows', type=int, default=20, help='rows returned by list queries')
+	parser.add_argument('--content-size', type=int, default=1000)
+	parser.add_argument('--write-behind', action='store_true', help='buffer comment inserts (configs.write_behind)')
+	parser.add_argument('--queries', action='store_true', help='print the query report (includes the warmup)')
+	parser.add_argument('--slow-query', type=float, default=0.0, help='with --queries: explain statements slower than this')
+	parser.add_argument('--output', help='write the results to this json file')
+	parser.add_argument('--compare', help='json file of an earlier run to compare with')
+	opts = parser.parse_args()
+	baseline = None
+	if opts.compare:
+		with open(opts.compare) as f:
+			baseline = json.load(f)
+	result = asyncio.get_event_loop().run_until_complete(run(opts))
+	report(result, baseline)
+	if opts.queries:
+		print()
+		print(querylog.report(dict(shapes=result['shapes']), limit=10))
+	if opts.output:
+		with open(opts.output, 'w') as f:
+			json.dump(result, f, indent=2)
+		print('results written to %s' % opts.output)
+	# 有失败的请求时结果没有参考价值
+	if result['total']['errors']:
+		print('%d requests failed' % result['total']['errors'], file=sys.stderr)
+		sys.exit(1)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Stand-in for the parts of aiomysql the orm uses: create_pool(), Pool.acquire/release,
+connection cursors (Cursor, DictCursor, SSCursor, SSDictCursor), begin/commit/rollback
+and ping. Nothing is stored; selects return generated rows shaped by the sql:
+
+	where `id`=?        one row with that id
+	where `id` in (..)  one row per id
+	limit ? / limit ?,? at most that many rows
+	count(...) _num_    one row with table_rows
+	information_schema  table_rows as the estimate of any table
+	otherwise           `rows` rows
+
+explain <select> returns a plan using the keys declared in schema.sql: const/range on
+the primary key, ref on the first column of a key (filesort unless the order by column is
+the second one), an index scan for order by the first column of a key, otherwise a full scan.
+
+Every statement sleeps `latency` (+ up to `jitter`) seconds, writes `write_latency`.
+Use it by replacing the module the orm talks to:
+
+	import orm
+	from bench import fakedb
+	orm.aiomysql = fakedb
+	fakedb.configure(latency=0.002, rows=20)
+'''
+
+import asyncio, collections, os, random, re
+
+class Cursor(object):
+	_dict = False
+
+class DictCursor(Cursor):
+	_dict = True
+
+class SSCursor(Cursor):
+	pass
+
+class SSDictCursor(SSCursor):
+	_dict = True
+
+_options = dict(latency=0.001, write_latency=None, jitter=0.0, rows=20, table_rows=10000, content_size=1000)
+stats = collections.Counter()
+
+def configure(latency=0.001, write_latency=None, jitter=0.0, rows=20, table_rows=10000, content_size=1000):
+	'''
+	latency / write_latency: seconds per select / per insert, update or delete (default latency).
+	rows: result size of unrestricted selects; table_rows: what count(...) returns;
+	content_size: length of generated text columns (content, summary).
+	'''
+	_options.update(latency=latency, write_latency=write_latency, jitter=jitter, rows=rows,
+		table_rows=table_rows, content_size=content_size)
+	stats.clear()
+
+_SELECT_RE = re.compile(r'^\s*select (?P<cols>.+?) from `(?P<table>\w+)`(?P<rest>.*)$', re.S | re.I)
+_WRITE_RE = re.compile(r'^\s*(?P<op>insert|update|delete|replace)\b', re.I)
+
+def _columns(cols):
+	# 'count(id) _num_' 取别名，'`name`' 去掉反引号
+	return [c.strip().split(' ')[-1].strip('`') for c in cols.split(',')]
+
+def _value(table, column, key, i):
+	if column == 'id':
+		return key
+	if column.endswith('_id'):
+		return '%s-%d' % (column[:-3], i % 100)
+	if column in ('created_at', 'updated_at'):
+		return 1500000000.0 + i
+	if column == 'admin':
+		return False
+	if column in ('content', 'summary'):
+		return ('%s %s ' % (table, key) * (_options['content_size'] // 16 + 1))[:_options['content_size']]
+	if column == 'email':
+		return '%s@example.com' % key
+	if column in ('image', 'user_image'):
+		return 'about:blank'
+	return '%s %s' % (column, i)
+
+def _rows(table, columns, keys, as_dict):
+	rows = []
+	for i, key in enumerate(keys):
+		values = [_value(table, c, key, i) for c in columns]
+		rows.append(dict(zip(columns, values)) if as_dict else tuple(values))
+	return rows
+
+_EXPLAIN_COLUMNS = ('id', 'select_type', 'table', 'type', 'possible_keys', 'key', 'rows', 'Extra')
+_SCHEMA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema.sql')
+_indexes = None
+
+def indexes():
+	''' table => {first column: (key name, columns)} of the keys in schema.sql '''
+	global _indexes
+	if _indexes is None:
+		_indexes = collections.defaultdict(dict)
+		with open(_SCHEMA, encoding='utf-8') as f:
+			schema = f.read()
+		for table, body in re.findall(r'create table (\w+) \((.*?)\) engine', schema, re.S):
+			for primary, name, cols in re.findall(r'(primary )?key (?:`(\w+)` )?\(([^)]*)\)', body):
+				cols = re.findall(r'`(\w+)`', cols)
+				_indexes[table][cols[0]] = ('PRIMARY' if primary else name, cols)
+	return _indexes
+
+def _explain(sql, as_dict):
+	m = _SELECT_RE.match(sql)
+	if m is None:
+		return [], 0, None
+	table, rest = m.group('table'), m.group('rest')
+	keys = indexes().get(table, dict())
+	where = re.search(r'where `?(\w+)`?\s*(=|in \()', rest)
+	order = re.search(r'order by `?(\w+)`?', rest)
+	rows = _options['table_rows']
+	extra = ['Using where'] if 'where' in rest else []
+	if where and where.group(1) in keys:
+		column = where.group(1)
+		key, columns = keys[column]
+		if key == 'PRIMARY':
+			plan = ('const', key, key, 1) if where.group(2) == '=' else ('range', key, key, rest.count('%s'))
+		else:
+			plan = ('ref', key, key, max(1, rows // 100))
+		if order and order.group(1) not in columns[:2]:
+			extra.append('Using filesort')
+	elif not where and order and order.group(1) in keys:
+		key = keys[order.group(1)][0]
+		plan = ('index', None, key, rows)
+	else:
+		plan = ('ALL', None, None, rows)
+		if order:
+			extra.append('Using filesort')
+	values = (1, 'SIMPLE', table) + plan + ('; '.join(extra) or None,)
+	row = dict(zip(_EXPLAIN_COLUMNS, values)) if as_dict else values
+	return [row], 1, [(c,) for c in _EXPLAIN_COLUMNS]
+
+def respond(sql, args, as_dict):
+	''' (rows, rowcount, description) of a statement '''
+	args = list(args or ())
+	if sql.startswith('explain '):
+		return _explain(sql[8:], as_dict)
+	if 'information_schema.tables' in sql:
+		row = {'_num_': _options['table_rows']}
+		return [row if as_dict else (row['_num_'],)], 1, [('_num_',)]
+	m = _SELECT_RE.match(sql)
+	if m is None:
+		w = _WRITE_RE.match(sql)
+		if w is None:
+			# savepoint等
+			return [], 0, None
+		op = w.group('op').lower()
+		if op in ('insert', 'replace'):
+			per_row = sql.count('%s', 0, sql.index(')', sql.index('values')) + 1) if 'values' in sql else 1
+			return [], max(1, len(args) // max(per_row, 1)), None
+		return [], 1, None
+	table, rest = m.group('table'), m.group('rest')
+	columns = _columns(m.group('cols'))
+	if columns == ['_num_']:
+		row = {'_num_': _options['table_rows']}
+		return [row if as_dict else (row['_num_'],)], 1, [('_num_',)]
+	if re.search(r'where `\w+`=%s', rest) and 'limit' not in rest:
+		keys = [args[0]]
+	elif ' in (' in rest:
+		keys = [a for a in args if a is not None]
+	else:
+		n = _options['rows']
+		if rest.rstrip().endswith('limit %s, %s'):
+			n = min(n, int(args[-1]))
+		elif rest.rstrip().endswith('limit %s'):
+			n = min(n, int(args[-1]))
+		keys = ['%s-%d' % (table, i) for i in range(n)]
+	rows = _rows(table, columns, keys, as_dict)
+	return rows, len(rows), [(c,) for c in columns]
+
+class FakeCursor(object):
+
+	def __init__(self, conn, cursor_class):
+		self.conn = conn
+		self._dict = getattr(cursor_class, '_dict', False)
+		self.rowcount = 0
+		self.description = None
+		self._rows = []
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *args):
+		await self.close()
+
+	async def execute(self, sql, args=None):
+		write = _WRITE_RE.match(sql) is not None
+		latency = _options['write_latency'] if write and _options['write_latency'] is not None else _options['latency']
+		if _options['jitter']:
+			latency += random.uniform(0, _options['jitter'])
+		if latency:
+			await asyncio.sleep(latency)
+		stats['writes' if write else 'queries'] += 1
+		self._rows, self.rowcount, self.description = respond(sql, args, self._dict)
+		return self.rowcount
+
+	async def executemany(self, sql, args):
+		n = 0
+		for a in args:
+			n += await self.execute(sql, a)
+		self.rowcount = n
+		return n
+
+	async def fetchall(self):
+		rows, self._rows = self._rows, []
+		return rows
+
+	async def fetchmany(self, size=None):
+		size = size or 1
+		rows, self._rows = self._rows[:size], self._rows[size:]
+		return rows
+
+	async def fetchone(self):
+		rows = await self.fetchmany(1)
+		return rows[0] if rows else None
+
+	async def close(self):
+		self._rows = []
+
+class _CursorContext(object):
+	''' conn.cursor(cls) works both awaited and as async context manager, like aiomysql '''
+	def __init__(self, cursor):
+		self._cursor = cursor
+
+	def __await__(self):
+		async def get():
+			return self._cursor
+		return get().__await__()
+
+	async def __aenter__(self):
+		return self._cursor
+
+	async def __aexit__(self, *args):
+		await self._cursor.close()
+
+class Connection(object):
+
+	def __init__(self, pool):
+		self.pool = pool
+		self.closed = False
+
+	def cursor(self, cursor_class=Cursor):
+		return _CursorContext(FakeCursor(self, cursor_class))
+
+	async def begin(self):
+		stats['begin'] += 1
+
+	async def commit(self):
+		stats['commit'] += 1
+
+	async def rollback(self):
+		stats['rollback'] += 1
+
+	async def ping(self, reconnect=True):
+		stats['ping'] += 1
+
+	def close(self):
+		self.closed = True
+
+class Pool(object):
+
+	def __init__(self, minsize=1, maxsize=10):
+		self.minsize = minsize
+		self.maxsize = maxsize
+		self._free = collections.deque(Connection(self) for i in range(minsize))
+		self._used = set()
+		self._cond = None
+
+	@property
+	def size(self):
+		return len(self._free) + len(self._used)
+
+	@property
+	def freesize(self):
+		return len(self._free)
+
+	async def acquire(self):
+		if self._cond is None:
+			self._cond = asyncio.Condition()
+		async with self._cond:
+			while not self._free and self.size >= self.maxsize:
+				await self._cond.wait()
+			conn = self._free.popleft() if self._free else Connection(self)
+			self._used.add(conn)
+			return conn
+
+	def release(self, conn):
+		self._used.discard(conn)
+		if not conn.closed:
+			self._free.append(conn)
+		if self._cond is not None:
+			asyncio.ensure_future(self._notify())
+
+	async def _notify(self):
+		async with self._cond:
+			self._cond.notify()
+
+	def close(self):
+		self._free.clear()
+
+	async def wait_closed(self):
+		pass
+
+async def create_pool(minsize=1, maxsize=10, **kw):
+	''' same signature as aiomysql.create_pool, connection arguments are ignored '''
+	return Pool(minsize, maxsize)
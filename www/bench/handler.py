@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+RequestHandler benchmark: requests/sec through coroweb.RequestHandler for the
+test_view routes, with the precompiled binder vs the previous per-request
+argument building (LegacyRequestHandler below, kept only for comparison), e.g.:
+
+	python -m bench.handler --requests 100000
+'''
+
+import argparse, asyncio, logging, time
+from urllib import parse
+
+logging.disable(logging.CRITICAL)
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from apis import APIError
+from coroweb import get, RequestHandler, has_request_arg, has_var_kw_arg, has_named_kw_args, get_named_kw_args, get_required_kw_args
+import test_view
+
+@get('/api/items')
+async def api_items(*, page: int = 1, size: int = 20, q=''):
+	return dict(page=page, size=size, q=q)
+
+class LegacyRequestHandler(RequestHandler):
+	'''
+	RequestHandler.__call__ before the binder was precompiled.
+	'''
+	def __init__(self, app, fn):
+		super(LegacyRequestHandler, self).__init__(app, fn)
+		self._has_request_arg = has_request_arg(fn)
+		self._has_var_kw_arg = has_var_kw_arg(fn)
+		self._has_named_kw_args = has_named_kw_args(fn)
+		self._named_kw_args = get_named_kw_args(fn)
+		self._required_kw_args = get_required_kw_args(fn)
+
+	async def __call__(self, request):
+		logging.info('RequestHandler __call__ route: %s ' % self._func.__route__)
+		kw = None
+		if self._has_request_arg or self._has_named_kw_args or self._has_var_kw_arg:
+			if request.method == 'POST':
+				if not request.content_type:
+					return web.HTTPBadRequest(text='Missing content_type.')
+				ct = request.content_type.lower()
+				if ct.startswith('application/json'):
+					params = await request.json()
+					if not isinstance(params, dict):
+						return web.HTTPBadRequest(text='Json body must be object.')
+					kw = params
+				elif ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
+					params = await request.post()
+					kw = dict(**params)
+				else:
+					return web.HTTPBadRequest(text='Unsupported content_type: %s ' % request.content_type)
+			if request.method == 'GET':
+				qs = request.query_string
+				if qs:
+					kw = dict()
+					for k, v in parse.parse_qs(qs, True).items():
+						kw[k] = v[0]
+		if kw is None:
+			kw = dict(**request.match_info)
+		else:
+			if self._has_named_kw_args and (not self._has_var_kw_arg):
+				copy = dict()
+				for name in self._named_kw_args:
+					if name in kw:
+						copy[name] = kw[name]
+				kw = copy
+			for k, v in request.match_info.items():
+				if k in kw:
+					logging.warn('Duplicat arg name in named arg and kw args: %s ' % k)
+				kw[k] = v
+		if self._has_request_arg:
+			kw['request'] = request
+		if self._required_kw_args:
+			for name in self._required_kw_args:
+				if not name in kw:
+					return web.HTTPBadRequest(text='Missing argument: %s ' % name)
+		logging.info('call with args: %s ' % str(kw))
+		try:
+			r = await self._func(**kw)
+			return r
+		except APIError as e:
+			logging.error('Exception: %s' % e)
+			return dict(error=e.error, data=e.data, message=e.message)
+
+ROUTES = [
+	(test_view.index, '/', {}),
+	(test_view.hello, '/hello/michael', {'name': 'michael'}),
+	(api_items, '/api/items?page=2&size=50&q=python', {}),
+]
+
+async def run(handler_class, fn, path, match_info, n):
+	handler = handler_class(None, fn)
+	requests = [make_mocked_request('GET', path, match_info=match_info) for i in range(100)]
+	start = time.perf_counter()
+	for i in range(n):
+		await handler(requests[i % 100])
+	return n / (time.perf_counter() - start)
+
+async def main(n, logs):
+	if logs:
+		# 与默认配置一样打开DEBUG日志, 输出丢弃
+		logging.disable(logging.NOTSET)
+		logging.getLogger().handlers = [logging.NullHandler()]
+		logging.getLogger().setLevel(logging.DEBUG)
+	print('%-24s %14s %14s %8s' % ('route', 'before req/s', 'after req/s', 'speedup'))
+	for fn, path, match_info in ROUTES:
+		before = await run(LegacyRequestHandler, fn, path, match_info, n)
+		after = await run(RequestHandler, fn, path, match_info, n)
+		print('%-24s %14.0f %14.0f %7.2fx' % (fn.__route__, before, after, after / before))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='RequestHandler argument binding benchmark')
+	parser.add_argument('--requests', type=int, default=100000)
+	parser.add_argument('--logs', action='store_true', help='keep DEBUG logging enabled (to a null handler)')
+	opts = parser.parse_args()
+	asyncio.get_event_loop().run_until_complete(main(opts.requests, opts.logs))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+JSON response encoding benchmark: dict(blogs=[Blog, ...]) payloads of 10, 1k and 100k rows,
+encoded the old way (json.dumps with the __dict__ default, then encode) vs the serializers
+backends and the chunked iter_dumps used for streamed responses, e.g.:
+
+	python -m bench.json_encode
+'''
+
+import argparse, json, logging, time
+
+logging.disable(logging.INFO)
+
+import serializers
+from models import Blog, next_id
+
+def payload(n):
+	now = time.time()
+	return dict(page=1, blogs=[Blog(id=next_id(), user_id='u%d' % (i % 100), user_name='用户', user_image='about:blank',
+		name='blog %d' % i, summary='摘要 summary', content='正文 content ' * 20, created_at=now + i) for i in range(n)])
+
+def old_dumps(obj):
+	return json.dumps(obj, ensure_ascii=False, default=lambda obj: obj.__dict__).encode('utf-8')
+
+def timed(fn, obj, repeat):
+	start = time.perf_counter()
+	for i in range(repeat):
+		fn(obj)
+	return (time.perf_counter() - start) / repeat
+
+def main():
+	parser = argparse.ArgumentParser(description='json response encoding benchmark')
+	parser.add_argument('--sizes', default='10,1000,100000')
+	opts = parser.parse_args()
+	modes = [('stdlib __dict__ (old)', old_dumps)]
+	for name in ('json', 'ujson', 'orjson'):
+		if name in serializers.backends:
+			modes.append(('serializers %s' % name, serializers.backends[name]))
+	def streamed(obj):
+		for chunk in serializers.iter_dumps(obj):
+			pass
+	modes.append(('iter_dumps (auto)', streamed))
+	print('%-24s %10s %14s %12s' % ('mode', 'rows', 'ms/response', 'MB/s'))
+	for n in [int(s) for s in opts.sizes.split(',')]:
+		obj = payload(n)
+		size = len(old_dumps(obj))
+		repeat = max(1, 20000 // max(n, 1))
+		# 流式阈值低于payload行数时才会分块
+		serializers.configure(stream_threshold=min(n - 1, 5000))
+		for name, fn in modes:
+			t = timed(fn, obj, repeat)
+			print('%-24s %10d %14.3f %12.1f' % (name, n, t * 1000, size / t / 1024 / 1024))
+
+if __name__ == '__main__':
+	main()
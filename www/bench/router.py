@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Router benchmark: url lookups/sec of router.RadixRouter vs aiohttp's UrlDispatcher
+over synthetic routes (static, one and two variable, typed), e.g.:
+
+	python -m bench.router --routes 500 --lookups 200000
+'''
+
+import argparse, asyncio, logging, random, time, warnings
+
+logging.disable(logging.CRITICAL)
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from router import RadixRouter
+
+async def handler(request):
+	return web.Response()
+
+def make_routes(n):
+	''' (pattern, sample path) pairs '''
+	routes = []
+	for i in range(n):
+		kind = i % 4
+		if kind == 0:
+			routes.append(('/api/res%d' % i, '/api/res%d' % i))
+		elif kind == 1:
+			routes.append(('/api/res%d/{id}' % i, '/api/res%d/abc%d' % (i, i)))
+		elif kind == 2:
+			routes.append(('/api/res%d/{id}/items/{item}' % i, '/api/res%d/42/items/7' % i))
+		else:
+			routes.append(('/blog%d/{id:int}' % i, '/blog%d/%d' % (i, i * 7)))
+	return routes
+
+def build(router_class, routes):
+	router = router_class()
+	for pattern, path in routes:
+		if router_class is web.UrlDispatcher:
+			pattern = pattern.replace(':int}', r':\d+}')
+		router.add_route('GET', pattern, handler)
+	return router
+
+async def run(router, requests, n):
+	start = time.perf_counter()
+	for i in range(n):
+		match_info = await router.resolve(requests[i % len(requests)])
+	return n / (time.perf_counter() - start)
+
+async def main(n_routes, n):
+	routes = make_routes(n_routes)
+	random.seed(0)
+	paths = [random.choice(routes)[1] for i in range(1000)]
+	requests = [make_mocked_request('GET', p) for p in paths]
+	print('%-14s %14s' % ('router', 'lookups/s'))
+	results = []
+	for cls in (web.UrlDispatcher, RadixRouter):
+		router = build(cls, routes)
+		# 先确认两个路由解析结果一致
+		for r in requests[:100]:
+			m = await router.resolve(r)
+			assert m.http_exception is None, r.path
+		rate = await run(router, requests, n)
+		results.append(rate)
+		print('%-14s %14.0f' % (cls.__name__, rate))
+	print('speedup %.2fx with %d routes' % (results[1] / results[0], n_routes))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='router lookup benchmark')
+	parser.add_argument('--routes', type=int, default=500)
+	parser.add_argument('--lookups', type=int, default=200000)
+	opts = parser.parse_args()
+	asyncio.get_event_loop().run_until_complete(main(opts.routes, opts.lookups))
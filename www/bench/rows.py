@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Row representation benchmark: dict based Model vs compact Model.__row__.
+
+Measures memory per 100k rows (tracemalloc, retained result list) and
+attribute access throughput over the rows, e.g.:
+
+	python -m bench.rows --rows 100000
+'''
+
+import argparse, gc, logging, time, tracemalloc
+
+logging.disable(logging.INFO)
+
+from models import Blog, next_id
+
+def source_rows(n):
+	# 模拟cursor返回的结果：DictCursor为dict，Cursor为tuple，列顺序同__select__
+	columns = [Blog.__primary_key__] + Blog.__fields__
+	now = time.time()
+	tuples = [(next_id(), 'u%d' % (i % 100), 'user', 'about:blank', 'blog %d' % i, 'summary', 'content %d' % i, now + i, now + i) for i in range(n)]
+	dicts = [dict(zip(columns, t)) for t in tuples]
+	return dicts, tuples
+
+def build_dict(dicts, tuples):
+	return [Blog(**r) for r in dicts]
+
+def build_compact(dicts, tuples):
+	Row = Blog.__row__
+	return [Row(*r) for r in tuples]
+
+def measure_memory(build, dicts, tuples):
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	rows = build(dicts, tuples)
+	after = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return rows, after - before
+
+def measure_access(rows, repeat):
+	start = time.perf_counter()
+	for i in range(repeat):
+		total = 0.0
+		for r in rows:
+			total += r.created_at
+			r.user_id
+			r.name
+	return len(rows) * repeat * 3 / (time.perf_counter() - start)
+
+def main():
+	parser = argparse.ArgumentParser(description='dict Model vs compact row benchmark')
+	parser.add_argument('--rows', type=int, default=100000)
+	parser.add_argument('--repeat', type=int, default=5)
+	opts = parser.parse_args()
+	dicts, tuples = source_rows(opts.rows)
+	print('%-10s %16s %14s %20s' % ('mode', 'build rows/s', 'bytes/row', 'attr reads/s'))
+	for name, build in (('dict', build_dict), ('compact', build_compact)):
+		start = time.perf_counter()
+		build(dicts, tuples)
+		build_rate = opts.rows / (time.perf_counter() - start)
+		rows, size = measure_memory(build, dicts, tuples)
+		print('%-10s %16.0f %14.1f %20.0f' % (name, build_rate, size / opts.rows, measure_access(rows, opts.repeat)))
+		print('%-10s memory per %d rows: %.1f MB' % ('', opts.rows, size / 1024.0 / 1024.0))
+
+if __name__ == '__main__':
+	main()
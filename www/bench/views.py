@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Views used by bench.e2e: typical blog pages and apis over models.User/Blog/Comment.
+'''
+
+import time
+
+from coroweb import get, post
+from models import User, Blog, Comment, next_id
+
+@get('/bench/blogs')
+async def blogs(*, page: int = 1):
+	blogs = await Blog.findAll(orderBy='created_at desc', limit=((page - 1) * 10, 10))
+	return {
+		'__template__': 'bench_blogs.html',
+		'page': page,
+		'blogs': blogs
+	}
+
+@get('/bench/blog/{id}')
+async def blog(id):
+	blog = await Blog.find(id)
+	comments = await Comment.findAll('blog_id=?', [id], orderBy='created_at desc')
+	return {
+		'__template__': 'bench_blog.html',
+		'blog': blog,
+		'comments': comments
+	}
+
+@get('/bench/api/users')
+async def api_users(*, page: int = 1):
+	total = await User.findNumber('count(id)')
+	users = await User.findAll(orderBy='created_at desc', limit=((page - 1) * 20, 20))
+	return dict(total=total, users=users)
+
+@post('/bench/api/blogs/{id}/comments')
+async def api_create_comment(id, *, content):
+	comment = Comment(id=next_id(), blog_id=id, user_id='user-1', user_name='bench', user_image='about:blank',
+		content=content, created_at=time.time())
+	await comment.save()
+	return comment
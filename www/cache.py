@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Cache backends used by the orm model cache (Model.__cache__).
+
+Every backend has the same async interface: get(key), set(key, value, ttl=None), delete(key),
+check() raising when the backend is unusable, and a sync stats(). values are row dicts.
+'''
+
+import asyncio, collections, json, logging, time
+
+class MemoryCache(object):
+	'''
+	In-process LRU cache with per entry TTL.
+	'''
+	def __init__(self, maxsize=1000, ttl=60, **kw):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._data = collections.OrderedDict()
+
+	async def get(self, key):
+		try:
+			expires, value = self._data[key]
+		except KeyError:
+			self.misses += 1
+			return None
+		if expires < time.time():
+			del self._data[key]
+			self.misses += 1
+			return None
+		self._data.move_to_end(key)
+		self.hits += 1
+		return value
+
+	async def set(self, key, value, ttl=None):
+		self._data[key] = (time.time() + (ttl or self.ttl), value)
+		self._data.move_to_end(key)
+		while len(self._data) > self.maxsize:
+			self._data.popitem(last=False)
+			self.evictions += 1
+
+	async def delete(self, key):
+		self._data.pop(key, None)
+
+	def clear(self):
+		self._data.clear()
+
+	async def check(self):
+		pass
+
+	def stats(self):
+		total = self.hits + self.misses
+		return dict(backend='memory', hits=self.hits, misses=self.misses, evictions=self.evictions,
+			size=len(self._data), maxsize=self.maxsize, hit_rate=(self.hits / total if total else 0.0))
+
+class RedisCache(object):
+	'''
+	Minimal client of the redis protocol (RESP) for GET/SET EX/DEL, values stored as json.
+	Any server speaking RESP works, e.g. redis itself or a local stand-in for development.
+	Commands run on up to maxconn connections at once, idle connections are reused.
+	Connection errors are logged and treated as cache misses, reads then fall through to mysql.
+	After an error the cache is skipped for retry_delay seconds, doubling on every further
+	error up to max_retry_delay, so an unreachable server costs neither a connect per lookup
+	nor a log line per request. check() raises if the server can not be reached at all.
+	'''
+	def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, ttl=60, prefix='', timeout=1.0,
+		maxconn=8, retry_delay=0.5, max_retry_delay=30.0, **kw):
+		self.host = host
+		self.port = port
+		self.db = db
+		self.password = password
+		self.ttl = ttl
+		self.prefix = prefix
+		self.timeout = timeout
+		self.maxconn = maxconn
+		self.retry_delay = retry_delay
+		self.max_retry_delay = max_retry_delay
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.errors = 0
+		self.skipped = 0
+		# 空闲连接: [(reader, writer)]
+		self._idle = []
+		self._slots = None
+		# 连续失败次数和下次重试的时间
+		self._failures = 0
+		self._retry_at = 0.0
+
+	async def _connect(self):
+		conn = await asyncio.open_connection(self.host, self.port)
+		if self.password:
+			await self._send(conn, 'AUTH', self.password)
+		if self.db:
+			await self._send(conn, 'SELECT', str(self.db))
+		return conn
+
+	def _close_idle(self):
+		for reader, writer in self._idle:
+			writer.close()
+		del self._idle[:]
+
+	async def _send(self, conn, *args):
+		buf = [b'*%d\r\n' % len(args)]
+		for a in args:
+			if not isinstance(a, bytes):
+				a = str(a).encode('utf-8')
+			buf.append(b'$%d\r\n%s\r\n' % (len(a), a))
+		conn[1].write(b''.join(buf))
+		return await self._read(conn[0])
+
+	async def _read(self, reader):
+		line = await reader.readline()
+		if not line:
+			raise ConnectionError('redis connection closed')
+		t, data = line[:1], line[1:-2]
+		if t == b'+':
+			return data
+		if t == b'-':
+			raise RuntimeError(data.decode('utf-8'))
+		if t == b':':
+			return int(data)
+		if t == b'$':
+			n = int(data)
+			if n < 0:
+				return None
+			return (await reader.readexactly(n + 2))[:-2]
+		if t == b'*':
+			return [await self._read(reader) for i in range(int(data))]
+		raise ConnectionError('bad redis reply: %r' % line)
+
+	async def _command(self, *args):
+		if self._failures and time.time() < self._retry_at:
+			self.skipped += 1
+			return None
+		if self._slots is None:
+			self._slots = asyncio.Semaphore(self.maxconn)
+		async with self._slots:
+			conn = self._idle.pop() if self._idle else None
+			try:
+				if conn is None:
+					conn = await asyncio.wait_for(self._connect(), self.timeout)
+				result = await asyncio.wait_for(self._send(conn, *args), self.timeout)
+			except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+				if conn is not None:
+					conn[1].close()
+				# 服务器重启后空闲连接都已失效
+				self._close_idle()
+				self.errors += 1
+				self._failures += 1
+				delay = min(self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay)
+				self._retry_at = time.time() + delay
+				logging.warning('redis cache %s:%s error: %s, skipping the cache for %.1fs' % (self.host, self.port, e, delay))
+				return None
+			self._idle.append(conn)
+			if self._failures:
+				logging.info('redis cache %s:%s is back' % (self.host, self.port))
+				self._failures = 0
+			return result
+
+	async def check(self):
+		''' raise ConnectionError unless the server answers PING '''
+		try:
+			conn = await asyncio.wait_for(self._connect(), self.timeout)
+			await asyncio.wait_for(self._send(conn, 'PING'), self.timeout)
+		except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+			raise ConnectionError('redis cache %s:%s unavailable: %s' % (self.host, self.port, e))
+		self._idle.append(conn)
+
+	async def get(self, key):
+		data = await self._command('GET', self.prefix + key)
+		if data is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		return json.loads(data.decode('utf-8'))
+
+	async def set(self, key, value, ttl=None):
+		await self._command('SET', self.prefix + key, json.dumps(value, ensure_ascii=False), 'EX', int(ttl or self.ttl))
+
+	async def delete(self, key):
+		await self._command('DEL', self.prefix + key)
+
+	def clear(self):
+		pass
+
+	def stats(self):
+		# 服务端的淘汰次数见redis INFO stats的evicted_keys
+		total = self.hits + self.misses
+		return dict(backend='redis', hits=self.hits, misses=self.misses, evictions=self.evictions,
+			errors=self.errors, skipped=self.skipped, connections=len(self._idle), hit_rate=(self.hits / total if total else 0.0))
+
+backends = {
+	'memory': MemoryCache,
+	'redis': RedisCache
+}
+
+def create_cache(backend='memory', **kw):
+	''' create cache from model __cache__ dict, e.g. dict(backend='memory', maxsize=1000, ttl=60) '''
+	try:
+		factory = backends[backend]
+	except KeyError:
+		raise ValueError('Invalid cache backend: %s' % backend)
+	return factory(**kw)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Response compression.
+
+compress_factory compresses html/json/text responses with brotli (when the brotli
+package is installed) or gzip, whichever the client accepts. bodies larger than
+executor_threshold are compressed in the default thread pool so the event loop keeps
+serving. Responses carrying an ETag (page cache hits) are compressed once per encoding.
+
+Static files are compressed ahead of time, run from www:
+
+	python compress.py [static dir]
+
+writes name.gz / name.br next to every compressible file, static.py serves them.
+'''
+
+import asyncio, collections, gzip, logging, os, sys
+from aiohttp import web
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+	'image/svg+xml', 'application/x-javascript')
+STATIC_EXTENSIONS = ('.html', '.htm', '.css', '.js', '.json', '.svg', '.txt', '.xml', '.map', '.md')
+
+def _gzip(body, level):
+	return gzip.compress(body, compresslevel=level)
+
+def _brotli(body, level):
+	return brotli.compress(body, quality=level)
+
+# 按优先顺序排列：客户端同时接受时优先brotli
+encoders = collections.OrderedDict()
+if brotli is not None:
+	encoders['br'] = _brotli
+encoders['gzip'] = _gzip
+
+# 文件扩展名 => 编码
+extensions = dict(br='.br', gzip='.gz')
+
+_options = dict(enabled=True, threshold=1024, executor_threshold=64 * 1024,
+	levels=dict(gzip=6, br=5), etag_cache_size=256)
+
+def configure(enabled=True, threshold=1024, executor_threshold=64 * 1024, gzip_level=6, brotli_level=5, etag_cache_size=256):
+	'''
+	threshold: bodies smaller than this are sent as is.
+	executor_threshold: bodies larger than this are compressed in a thread.
+	'''
+	_options.update(enabled=enabled, threshold=threshold, executor_threshold=executor_threshold,
+		levels=dict(gzip=gzip_level, br=brotli_level), etag_cache_size=etag_cache_size)
+	logging.info('compression: %s' % (', '.join(encoders) if enabled else 'off'))
+
+def enabled():
+	return _options['enabled']
+
+def accepted_encodings(accept_encoding):
+	''' encodings accepted by an Accept-Encoding header value, q=0 excluded '''
+	accepted = set()
+	for part in accept_encoding.lower().split(','):
+		name, _, params = part.strip().partition(';')
+		params = params.replace(' ', '')
+		if params.startswith('q='):
+			try:
+				if float(params[2:]) == 0:
+					continue
+			except ValueError:
+				continue
+		accepted.add(name.strip())
+	return accepted
+
+def choose_encoding(accept_encoding, available=None):
+	''' best encoding from encoders (or available) accepted by the client, None for identity '''
+	if not accept_encoding:
+		return None
+	accepted = accepted_encodings(accept_encoding)
+	for name in (encoders if available is None else available):
+		if name in accepted or '*' in accepted:
+			return name
+	return None
+
+def is_compressible(content_type):
+	return content_type.startswith(COMPRESSIBLE_TYPES)
+
+def strip_encoding(etag):
+	''' the ETag before compress_factory appended the encoding, "<tag>-gzip" => "<tag>" '''
+	for name in extensions:
+		suffix = '-%s"' % name
+		if etag.endswith(suffix):
+			return etag[:-len(suffix)] + '"'
+	return etag
+
+def add_vary(headers, name='Accept-Encoding'):
+	vary = headers.get('Vary', None)
+	if not vary:
+		headers['Vary'] = name
+	elif name.lower() not in vary.lower():
+		headers['Vary'] = vary + ', ' + name
+
+async def compress(body, encoding):
+	level = _options['levels'][encoding]
+	fn = encoders[encoding]
+	if len(body) >= _options['executor_threshold']:
+		return await asyncio.get_event_loop().run_in_executor(None, fn, body, level)
+	return fn(body, level)
+
+# 压缩中间件：放在页面缓存之外，缓存里保存未压缩的页面，按ETag缓存压缩结果
+async def compress_factory(app, handler):
+	etag_cache = collections.OrderedDict()
+	async def compression(request):
+		resp = await handler(request)
+		if not _options['enabled'] or type(resp) is not web.Response or resp.prepared:
+			return resp
+		# 206等部分内容的Content-Range是未压缩字节的范围, 不能再压缩
+		if resp.status != 200 or 'Content-Range' in resp.headers:
+			return resp
+		body = resp.body
+		if not isinstance(body, bytes) or len(body) < _options['threshold']:
+			return resp
+		if resp.headers.get('Content-Encoding', None) or not is_compressible(resp.content_type):
+			return resp
+		add_vary(resp.headers)
+		encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+		if encoding is None:
+			return resp
+		etag = resp.headers.get('ETag', None)
+		key = (etag, encoding)
+		data = etag_cache.get(key, None) if etag else None
+		if data is None:
+			data = await compress(body, encoding)
+			if etag:
+				etag_cache[key] = data
+				while len(etag_cache) > _options['etag_cache_size']:
+					etag_cache.popitem(last=False)
+		else:
+			etag_cache.move_to_end(key)
+		if len(data) >= len(body):
+			return resp
+		resp.body = data
+		resp.headers['Content-Encoding'] = encoding
+		if etag and not etag.startswith('W/'):
+			# 压缩后的内容与原ETag对应的字节不同
+			resp.headers['ETag'] = '%s-%s"' % (etag[:-1], encoding)
+		return resp
+	return compression
+
+def precompress_file(path, threshold=1024):
+	''' write path.gz (and path.br) unless up to date; returns the files written '''
+	st = os.stat(path)
+	if st.st_size < threshold:
+		return []
+	with open(path, 'rb') as f:
+		body = f.read()
+	written = []
+	for encoding, fn in encoders.items():
+		target = path + extensions[encoding]
+		if os.path.exists(target) and os.stat(target).st_mtime >= st.st_mtime:
+			continue
+		data = fn(body, 9 if encoding == 'gzip' else 11)
+		if len(data) >= len(body):
+			continue
+		with open(target, 'wb') as f:
+			f.write(data)
+		os.utime(target, (st.st_atime, st.st_mtime))
+		written.append(target)
+	return written
+
+def precompress(root, threshold=1024):
+	''' precompress every static file under root, returns the number of files written '''
+	n = 0
+	for dirpath, dirnames, filenames in os.walk(root):
+		for name in filenames:
+			if name.endswith(STATIC_EXTENSIONS):
+				written = precompress_file(os.path.join(dirpath, name), threshold)
+				for target in written:
+					logging.info('precompressed %s' % target)
+				n += len(written)
+	return n
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.INFO)
+	root = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+	print('%s files written (%s)' % (precompress(root), ', '.join(encoders)))
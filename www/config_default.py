@@ -7,12 +7,132 @@ Default configurations.
 
 configs = {
 	'debug': True,
+	# 根logger级别；请求路径上的日志都在DEBUG级别
+	'log_level': 'INFO',
+	'server': {
+		'host': '127.0.0.1',
+		'port': 9000,
+		# server.py的worker进程数，0为CPU核数；每个worker有自己的数据库连接池
+		'workers': 0,
+		# True: 每个worker各自绑定端口（SO_REUSEPORT，由内核分配连接）；False: master预先绑定，worker共享
+		'reuse_port': False,
+		'backlog': 128,
+		# 安装了uvloop时使用
+		'uvloop': True,
+		# 停止/重载时等待进行中请求的秒数
+		'shutdown_timeout': 10
+	},
 	'db': {
 		'host': '127.0.0.1',
 		'port': 3306,
 		'user': 'www-data',
 		'password': 'www-data',
-		'db': 'awesome'
+		'db': 'awesome',
+		# 连接池：按需在minsize~maxsize之间增长
+		'minsize': 1,
+		'maxsize': 10,
+		# 连接存活超过该秒数后重建
+		'pool_recycle': 3600,
+		# 等待空闲连接的最长秒数，超时抛出orm.PoolOverloadError
+		'acquire_timeout': 5,
+		# 空闲超过该秒数的连接取用前先ping
+		'ping_interval': 30,
+		# 只读从库，每项覆盖主库的同名配置，如 {'name': 'replica0', 'host': '10.0.0.2'}
+		'replicas': [],
+		# 从库负载均衡：round_robin 或 least_busy
+		'balance': 'round_robin',
+		# Model.count缓存的秒数；不带条件的计数在InnoDB估算行数超过count_estimate_above时返回估算值（0总是精确计数）
+		# 缓存在每个进程里，写入只调整本进程的计数：server.py多个worker时，其他worker的计数最多滞后count_ttl秒，
+		# 需要更快一致时调小count_ttl
+		'count_ttl': 60,
+		'count_estimate_above': 100000
+	},
+	'json': {
+		# auto: 优先orjson，其次ujson，最后标准库json
+		'backend': 'auto',
+		# 列表超过该长度时分块流式输出
+		'stream_threshold': 5000,
+		'chunk_size': 1000
+	},
+	'jinja2': {
+		# 异步流式渲染；字节码缓存目录（''为系统临时目录，None不缓存）；启动时预编译全部模板
+		'enable_async': True,
+		'bytecode_cache': '',
+		'precompile': True
+	},
+	'page_cache': {
+		# 页面缓存总字节数上限（LRU淘汰），单个响应超过max_entry_bytes不缓存
+		'max_bytes': 64 * 1024 * 1024,
+		'max_entry_bytes': 1024 * 1024,
+		# 所有缓存路由都参与缓存key的请求头，路由可以用@get(cache=dict(vary=[...]))追加
+		'vary': [],
+		# 过期后继续返回旧页面并在后台刷新的秒数
+		'stale': 30
+	},
+	'compress': {
+		# gzip，安装了brotli包时优先br；小于threshold字节的响应不压缩
+		'enabled': True,
+		'threshold': 1024,
+		# 大于该字节数的响应在线程池里压缩，不阻塞事件循环
+		'executor_threshold': 64 * 1024,
+		'gzip_level': 6,
+		'brotli_level': 5
+	},
+	'static': {
+		# 不超过memory_file_max字节的静态文件缓存在内存中，总量不超过memory_max_bytes；更大的文件用sendfile发送
+		'memory_max_bytes': 16 * 1024 * 1024,
+		'memory_file_max': 256 * 1024
+	},
+	'model_cache': {
+		# models.py里__cache__声明的缓存后端。内存缓存在每个进程里，save/update/remove只失效本进程的副本，
+		# server.py多个worker时其他worker在ttl内仍返回旧行。'redis'改用下面地址的共享redis，启动时连不上则报错；
+		# 'auto'在worker多于1个时使用redis；''保留models.py里的声明
+		'backend': '',
+		'redis': {'host': '127.0.0.1', 'port': 6379, 'db': 0, 'password': None}
+	},
+	'write_behind': {
+		# 表名 => orm.WriteBehind的参数。开启后save()先进缓冲就返回，每max_rows行或max_delay秒批量写入；
+		# 进程崩溃时缓冲中的行丢失，journal='路径前缀'时写入前先记录到本地文件，重启后重放
+		'comments': {'enabled': False, 'max_rows': 200, 'max_delay': 0.2, 'max_pending': 5000, 'max_wait': 5.0,
+			'journal': None, 'fsync': False}
+	},
+	'router': {
+		# True把路由编译成前缀树，见router.py：字面段优先于变量段，变量段按注册顺序匹配；
+		# 树中找不到的url(静态文件、404、405)仍由aiohttp的UrlDispatcher处理
+		'radix': True
+	},
+	'executor': {
+		# @get/@post(executor='thread'|'process')的视图函数在这里执行；max_workers为0时按CPU核数
+		# 执行中加排队的调用达到max_workers + max_queue时返回503
+		'thread': {'max_workers': 0, 'max_queue': 64},
+		'process': {'max_workers': 0, 'max_queue': 32}
+	},
+	'tracing': {
+		# 每个请求都记录路由耗时；sample_rate比例的请求另外记录span（orm查询、模板渲染等）
+		'enabled': True,
+		'sample_rate': 0.1,
+		# 超过该秒数的采样请求输出WARNING日志
+		'slow_threshold': 1.0,
+		# /__traces__保留的最近trace数
+		'keep': 100
+	},
+	'queries': {
+		# orm语句按形状统计耗时；超过slow_threshold秒的语句记录日志并在后台EXPLAIN（同一形状间隔explain_interval秒）
+		'enabled': True,
+		'slow_threshold': 0.1,
+		'explain': True,
+		'explain_interval': 600,
+		# 保留的形状数，超出时丢弃总耗时最少的
+		'max_shapes': 500
+	},
+	'search': {
+		# 声明了__search__的model建全文索引；快照文件保存在path目录（''为系统临时目录）
+		'enabled': True,
+		'path': '',
+		# 后台索引其他进程新写入的行的间隔秒数，保存快照的间隔秒数
+		'refresh_interval': 60,
+		'snapshot_interval': 300,
+		'batch_size': 500
 	},
 	'session': {
 		'secret': 'Awesome'
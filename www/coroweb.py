@@ -2,19 +2,33 @@
 # -*- coding: utf-8 -*-
 
 import logging; logging.basicConfig(level=logging.DEBUG)
-import asyncio, os, inspect, functools
+import os, inspect, functools
 from urllib import parse
 from aiohttp import web
 from apis import APIError
+import executor, static, tracing
 
-def Handler_decorator(path, *, method):
-	''' define decorator @get('/path') '''
+def Handler_decorator(path, *, method, cache=None, executor=None):
+	'''
+	define decorator @get('/path')
+	cache: cache the rendered response for that many seconds, see pagecache.py,
+	e.g. @get('/', cache=60) or @get('/', cache=dict(ttl=60, stale=300, vary=['Cookie']))
+	executor: run a blocking (non-coroutine) view in the 'thread' or 'process' pool, see executor.py
+	'''
 	def decorator(func):
-		@functools.wraps(func)
-		def wrapper(*args, **kw):
-			return func(*args, **kw)
+		# 保持协程函数的性质, executor.wrap等据此区分阻塞视图
+		if inspect.iscoroutinefunction(func):
+			@functools.wraps(func)
+			async def wrapper(*args, **kw):
+				return await func(*args, **kw)
+		else:
+			@functools.wraps(func)
+			def wrapper(*args, **kw):
+				return func(*args, **kw)
 		wrapper.__method__ = method
 		wrapper.__route__ = path
+		wrapper.__cache__ = cache
+		wrapper.__executor__ = executor
 		return wrapper
 	return decorator
 
@@ -69,105 +83,160 @@ def has_request_arg(fn):
 			raise ValueError('request parameter must be the last named parameter in function: %s%s' % (fn.__name__, str(sig)))
 	return found
 
-class RequestHandler(object):
-	"""docstring for RequestHandler"""
-	# 先构造fn进入
-	def __init__(self, app, fn):
-		super(RequestHandler, self).__init__()
-		logging.info('RequestHandler __init__: %s ' % fn.__route__)
-		self._app = app
-		self._func = fn
-		self._has_request_arg = has_request_arg(fn)
-		self._has_var_kw_arg = has_var_kw_arg(fn)
-		self._has_named_kw_args = has_named_kw_args(fn)
-		self._named_kw_args = get_named_kw_args(fn)
-		self._required_kw_args = get_required_kw_args(fn)
+# 参数注解对应的类型转换，只对字符串值生效
+def to_bool(v):
+	v = v.lower()
+	if v in ('1', 'true', 'yes', 'on'):
+		return True
+	if v in ('', '0', 'false', 'no', 'off'):
+		return False
+	raise ValueError('invalid bool: %s' % v)
 
-	# 用预定的fn处理传入的request，注意方法名定义为小写
-	async def __call__(self, request):
-		logging.info('RequestHandler __call__ route: %s ' % self._func.__route__)
-		kw = None
-
-		# 若视图函数有命名关键词或关键词参数 
-		if self._has_request_arg or self._has_named_kw_args or self._has_var_kw_arg:
-			if request.method == 'POST':
-				# json() body , post() form表单
-				if not request.content_type:
-					return web.HTTPBadRequest('Missing content_type.')
-				ct = request.content_type.lower()
-				if ct.startswith('application/json'):
-					params = await request.json
-					if not isinstance(params, dict):
-						return web.HTTPBadRequest('Json body must be object.')
-					kw = params
-				elif ct.startswith('applictaion/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
-					params = await request.post()
-					kw = dict(**params)
-				else:
-					return web.HTTPBadRequest('Unsupported content_type: %s ' % request.content_type)
-			
-			if request.method == 'GET': 
-				# 返回URL查询语句，?后的键值。string形式。
-				qs = request.query_string # 返回URL查询语句，?后的键值。string形式。  
-				if qs:  
-					kw = dict()  
-                    # '''''
-                    # 解析url中?后面的键值对的内容 
-                    # qs = 'first=f,s&second=s' 
-                    # parse.parse_qs(qs, True).items() 
-                    # >>> dict([('first', ['f,s']), ('second', ['s'])]) 
-                    # '''
-					for k, v in parse.parse_qs(qs, True).items():
-						# 返回查询变量和值的映射，True表示不忽略空格。
-						kw[k] = v[0] 
+coercions = {
+	int: int,
+	float: float,
+	bool: to_bool
+}
+
+def get_arg_coercers(fn):
+	coercers = []
+	params = inspect.signature(fn).parameters
+	for name, param in params.items():
+		f = coercions.get(param.annotation, None)
+		if f is not None:
+			coercers.append((name, f))
+	return tuple(coercers)
+
+async def read_post_args(request):
+	# json() body , post() form表单
+	if not request.content_type:
+		raise web.HTTPBadRequest(text='Missing content_type.')
+	ct = request.content_type.lower()
+	if ct.startswith('application/json'):
+		params = await request.json()
+		if not isinstance(params, dict):
+			raise web.HTTPBadRequest(text='Json body must be object.')
+		return params
+	if ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
+		params = await request.post()
+		return dict(**params)
+	raise web.HTTPBadRequest(text='Unsupported content_type: %s ' % request.content_type)
+
+def read_query_args(request):
+	qs = request.query_string # 返回URL查询语句，?后的键值。string形式。
+	if not qs:
+		return None
+	# 解析url中?后面的键值对的内容, True表示不忽略空值
+	# qs = 'first=f,s&second=s' => {'first': 'f,s', 'second': 's'}
+	return dict((k, v[0]) for k, v in parse.parse_qs(qs, True).items())
+
+def make_binder(fn, method):
+	'''
+	compile the argument binder of a view function once at registration:
+	async bind(request) returns the kw for fn(**kw), or raises web.HTTPBadRequest.
+	all branching on the view signature and route method happens here, not per request.
+	'''
+	has_request = has_request_arg(fn)
+	has_var_kw = has_var_kw_arg(fn)
+	has_named = has_named_kw_args(fn)
+	named = get_named_kw_args(fn)
+	required = get_required_kw_args(fn)
+	coercers = get_arg_coercers(fn)
+	# 只有命名参数，没有关键字参数时，只保留命名参数
+	keep = named if (has_named and not has_var_kw) else None
+
+	def finish(kw):
+		# 视图函数中无默认值的命名参数必须已传入
+		for name in required:
+			if not name in kw:
+				raise web.HTTPBadRequest(text='Missing argument: %s ' % name)
+		for name, f in coercers:
+			v = kw.get(name, None)
+			if isinstance(v, str):
+				try:
+					kw[name] = f(v)
+				except ValueError:
+					raise web.HTTPBadRequest(text='Invalid argument: %s ' % name)
+		return kw
 
+	# 视图函数没有request、命名关键词和关键词参数：只传入路径参数
+	if not (has_request or has_named or has_var_kw):
+		if not required and not coercers:
+			async def bind(request):
+				return dict(**request.match_info)
+		else:
+			async def bind(request):
+				return finish(dict(**request.match_info))
+		return bind
+
+	def merge(request, kw):
 		# 整理kw参数和request.match_info路径参数
-		if kw is None:  # 若request中无参数  
-			# 若存在可变路由：/a/{name}/c，可匹配path为：/a/jack/c的request 
-			# {variable}为参数名，传入request请求的path为值 
+		if kw is None:
+			# 若存在可变路由：/a/{name}/c，{variable}为参数名，传入request请求的path为值
 			kw = dict(**request.match_info)
-		else:	# request有参数
-			if self._has_named_kw_args and (not self._has_var_kw_arg):
-				# 只有命名参数，没有关键字参数，需要只保留命名参数即可
-				copy = dict()
-				for name in self._named_kw_args:
-					if name in kw:
-						copy[name] = kw[name]
-				kw = copy
-
+		else:
+			if keep is not None:
+				kw = dict((name, kw[name]) for name in keep if name in kw)
 			# 将request.match_info中的参数传入kw，但要覆盖kw中已有关键字参数
 			for k, v in request.match_info.items():
 				if k in kw:
 					logging.warn('Duplicat arg name in named arg and kw args: %s ' % k)
 				kw[k] = v
-
-		# 整理request参数
-		if self._has_request_arg:
+		if has_request:
 			kw['request'] = request
+		return finish(kw)
 
-		# 整理视图函数中存在无默认值的命名参数，检查是否已传入kw
-		if self._required_kw_args:
-			for name in self._required_kw_args:
-				if not name in kw:
-					return web.HTTPBadRequest('Missing argument: %s ' % name)
+	if method == 'POST':
+		async def bind(request):
+			return merge(request, await read_post_args(request))
+	elif method == 'GET':
+		async def bind(request):
+			return merge(request, read_query_args(request))
+	else:
+		async def bind(request):
+			return merge(request, None)
+	return bind
 
-		# 至此，kw为request带入给视图函数fn真正可调用的全部参数
-		logging.info('call with args: %s ' % str(kw))
+class RequestHandler(object):
+	"""docstring for RequestHandler"""
+	# 先构造fn进入
+	def __init__(self, app, fn):
+		super(RequestHandler, self).__init__()
+		logging.info('RequestHandler __init__: %s ' % fn.__route__)
+		self._app = app
+		self._func = fn
+		# 按视图函数签名和路由方法预先生成参数绑定函数
+		self._bind = make_binder(fn, getattr(fn, '__method__', None))
 
+	# 用预定的fn处理传入的request，注意方法名定义为小写
+	async def __call__(self, request):
+		try:
+			with tracing.span('bind'):
+				kw = await self._bind(request)
+		except web.HTTPBadRequest as e:
+			return e
+		# 至此，kw为request带入给视图函数fn真正可调用的全部参数
+		logging.debug('call %s with args: %s', self._func.__route__, kw)
 		try:
-			r = await self._func(**kw)
+			with tracing.span('handler', view=self._func.__name__):
+				r = self._func(**kw)
+				# 普通函数直接返回结果, 协程函数返回待await的协程
+				if inspect.isawaitable(r):
+					r = await r
 			return r
 		except APIError as e:
 			logging.error('Exception: %s' % e)
 			return dict(error=e.error, data=e.data, message=e.message)
 
 # 添加静态文件，如image，css，javascript等
-def add_static(app):
+# kw为configs.static：内存缓存大小等，见static.StaticFiles
+def add_static(app, **kw):
 	# 拼接static文件目录
 	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
 	# path = os.path.join(os.path.abspath('.'), 'static')
 
-	app.router.add_static('/static/', path)
+	# 带内容指纹的url、内存缓存、预压缩文件和Range请求由static.py处理
+	static.init_static(app, path, '/static/', **kw)
 	logging.info('add static %s => %s' % ('/static/', path))
 
 # 编写一个add_route函数，用来注册一个视图函数  
@@ -176,11 +245,18 @@ def add_route(app, fn):
 	path = getattr(fn, '__route__', None)
 	if method is None or path is None:
 		raise ValueError('@get or @post not defined in %s.' % fn.__name__)
-	# 判断URL处理函数是否协程并且是生成器  
-	if not asyncio.iscoroutinefunction(fn) and not inspect.isgeneratorfunction(fn):
-		fn = asyncio.coroutine(fn)
+	# 声明了executor的阻塞视图函数放到线程/进程池里执行
+	if getattr(fn, '__executor__', None):
+		fn = executor.wrap(fn, fn.__executor__)
 	logging.info('add route %s %s => %s(%s)' % (method, path, fn.__name__, ','.join(inspect.signature(fn).parameters.keys())))  
-	app.router.add_route(method, path, RequestHandler(app, fn))
+	handler = RequestHandler(app, fn)
+	# aiohttp要求handler是协程函数, 不能直接注册RequestHandler实例
+	async def view(request):
+		return await handler(request)
+	view.__name__ = fn.__name__
+	# pagecache和router通过_func读取视图函数上的@get/@post参数
+	view._func = handler._func
+	app.router.add_route(method, path, view)
 
 
 # 导入模块，批量注册视图函数
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Executor pools for blocking view functions.
+
+	@post('/api/users', executor='thread')
+	def api_register_user(*, email, name, passwd):
+		...
+
+add_route runs such views in the named pool instead of on the event loop. 'thread' and
+'process' are configured in configs.executor (more pools can be added with a 'kind');
+process pool views get pickled arguments, so they can not take `request`. When the
+running plus queued calls of a pool reach max_workers + max_queue, new calls raise
+ExecutorOverloadError, which response_factory turns into 503.
+'''
+
+import asyncio, functools, inspect, logging, os, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from metrics import Histogram
+
+class ExecutorOverloadError(Exception):
+	pass
+
+def _call(fn, args, kw):
+	# 在线程/子进程里执行，返回开始时间用于统计排队时间
+	started = time.time()
+	return started, fn(*args, **kw)
+
+class ExecutorPool(object):
+	'''
+	ThreadPoolExecutor / ProcessPoolExecutor with a bounded queue and wait/run histograms.
+	'''
+	def __init__(self, name, kind='thread', max_workers=0, max_queue=64):
+		if kind not in ('thread', 'process'):
+			raise ValueError('Invalid executor kind: %s' % kind)
+		self.name = name
+		self.kind = kind
+		self.max_workers = max_workers or (os.cpu_count() or 1) * (5 if kind == 'thread' else 1)
+		self.max_queue = max_queue
+		self.pending = 0
+		self.completed = 0
+		self.rejected = 0
+		self.failed = 0
+		self.wait = Histogram()
+		self.run = Histogram()
+		self._executor = None
+
+	@property
+	def executor(self):
+		if self._executor is None:
+			if self.kind == 'thread':
+				self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='%s-' % self.name)
+			else:
+				self._executor = ProcessPoolExecutor(self.max_workers)
+		return self._executor
+
+	async def submit(self, fn, *args, **kw):
+		if self.pending >= self.max_workers + self.max_queue:
+			self.rejected += 1
+			raise ExecutorOverloadError('%s executor saturated: %s calls pending' % (self.name, self.pending))
+		self.pending += 1
+		submitted = time.time()
+		try:
+			started, r = await asyncio.get_event_loop().run_in_executor(self.executor, _call, fn, args, kw)
+		except Exception:
+			self.failed += 1
+			raise
+		finally:
+			self.pending -= 1
+		now = time.time()
+		self.wait.observe(max(0.0, started - submitted))
+		self.run.observe(now - started)
+		self.completed += 1
+		return r
+
+	def stats(self):
+		return dict(kind=self.kind, max_workers=self.max_workers, max_queue=self.max_queue,
+			pending=self.pending, queued=max(0, self.pending - self.max_workers),
+			completed=self.completed, failed=self.failed, rejected=self.rejected,
+			wait=self.wait.snapshot(), run=self.run.snapshot())
+
+	def shutdown(self, wait=True):
+		if self._executor is not None:
+			self._executor.shutdown(wait=wait)
+			self._executor = None
+
+_options = dict(thread=dict(kind='thread', max_workers=0, max_queue=64),
+	process=dict(kind='process', max_workers=0, max_queue=32))
+_pools = dict()
+
+def configure(**pools):
+	''' pools from configs.executor: name => dict(kind, max_workers, max_queue) '''
+	shutdown(wait=False)
+	for name, kw in pools.items():
+		kw = dict(kw)
+		kw.setdefault('kind', name)
+		_options[name] = kw
+
+def get_pool(name):
+	pool = _pools.get(name, None)
+	if pool is None:
+		try:
+			kw = _options[name]
+		except KeyError:
+			raise ValueError('Executor not configured: %s' % name)
+		pool = _pools[name] = ExecutorPool(name, **kw)
+		logging.info('executor %s: %s pool of %s workers, queue %s' % (name, pool.kind, pool.max_workers, pool.max_queue))
+	return pool
+
+def wrap(fn, name):
+	''' coroutine function calling the blocking view fn in executor pool name '''
+	# @get/@post等装饰器包装过的视图, 检查最内层的函数
+	if asyncio.iscoroutinefunction(fn) or asyncio.iscoroutinefunction(inspect.unwrap(fn)):
+		raise ValueError('executor=%s needs a plain function: %s' % (name, fn.__name__))
+	if name not in _options:
+		raise ValueError('Executor not configured: %s' % name)
+	if _options[name].get('kind', name) == 'process' and 'request' in inspect.signature(fn).parameters:
+		raise ValueError('process executor views can not take request: %s' % fn.__name__)
+	@functools.wraps(fn)
+	async def run_in_executor(*args, **kw):
+		return await get_pool(name).submit(fn, *args, **kw)
+	return run_in_executor
+
+def stats():
+	return dict((name, pool.stats()) for name, pool in _pools.items())
+
+def shutdown(wait=True):
+	for pool in _pools.values():
+		pool.shutdown(wait=wait)
+	_pools.clear()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+In-process metrics: latency histograms.
+'''
+
+import bisect
+
+class Histogram(object):
+	'''
+	Fixed-bucket histogram of durations in seconds. quantiles are estimated
+	as the upper bound of the bucket they fall in.
+	'''
+	BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+	def __init__(self, buckets=None):
+		self.buckets = tuple(buckets or self.BUCKETS)
+		self.reset()
+
+	def reset(self):
+		# 最后一个桶存放超过最大边界的值
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+		if value > self.max:
+			self.max = value
+
+	def quantile(self, q):
+		if self.count == 0:
+			return 0.0
+		rank = q * self.count
+		n = 0
+		for i, c in enumerate(self.counts):
+			n += c
+			if n >= rank:
+				return self.buckets[i] if i < len(self.buckets) else self.max
+		return self.max
+
+	def snapshot(self):
+		cumulative = []
+		n = 0
+		for le, c in zip(self.buckets, self.counts):
+			n += c
+			cumulative.append((le, n))
+		return dict(count=self.count, sum=self.sum, max=self.max,
+			avg=(self.sum / self.count if self.count else 0.0),
+			p50=self.quantile(0.5), p90=self.quantile(0.9), p99=self.quantile(0.99),
+			buckets=cumulative)
@@ -9,6 +9,8 @@ def next_id():
 
 class User(Model):
 	__table__ = 'users'
+	# 进程内缓存：server.py多个worker时其他worker最多ttl秒后看到修改，configs.model_cache可换成共享的redis
+	__cache__ = dict(backend='memory', maxsize=10000, ttl=60)
 
 	id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
 	email = StringField(ddl='varchar(50)')
@@ -20,6 +22,9 @@ class User(Model):
 
 class Blog(Model):
 	__table__ = 'blogs'
+	__cache__ = dict(backend='memory', maxsize=10000, ttl=60)
+	# 全文搜索的字段和权重，见search.py
+	__search__ = {'name': 3, 'summary': 2, 'content': 1}
 
 	id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
 	user_id = StringField(ddl='varchar(50)')
@@ -29,9 +34,13 @@ class Blog(Model):
 	summary = StringField(ddl='varchar(200)')
 	content = TextField()
 	created_at = FloatField(default=time.time)
+	# update()时由orm更新，搜索索引据此重新索引其他进程修改过的行
+	updated_at = FloatField(default=time.time)
 
 class Comment(Model):
 	__table__ = 'comments'
+	# 评论的写入缓冲在configs.write_behind里开启，见config_default.py
+	__search__ = {'content': 1}
 
 	id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
 	blog_id = StringField(ddl='varchar(50)')
@@ -39,4 +48,5 @@ class Comment(Model):
 	user_name = StringField(ddl='varchar(50)')
 	user_image = StringField(ddl='varchar(500)')
 	content = TextField()
-	created_at = FloatField(default=time.time)
\ No newline at end of file
+	created_at = FloatField(default=time.time)
+	updated_at = FloatField(default=time.time)
\ No newline at end of file
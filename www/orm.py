@@ -2,17 +2,87 @@
 # -*- coding: utf-8 -*-
 
 import logging; logging.basicConfig(level=logging.DEBUG)
-import asyncio
+import asyncio, base64, collections, contextlib, contextvars, glob, itertools, json, os, re, time
 import aiomysql
+import querylog, tracing
+from cache import create_cache
+from metrics import Histogram
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 def log(sql, args=()):
-	logging.info('SQL: %s' % sql)
+	logging.debug('SQL: %s', sql)
 
-async def create_pool(loop, **kw):
-	logging.info('create database connect pool...')
-	#生命pool为全局变量，aiomysql也用pool做协程
-	global __pool
-	__pool = await aiomysql.create_pool(
+class SQLCache(object):
+	'''
+	Bounded LRU cache which maps a query shape to its driver-ready sql text.
+	'''
+	def __init__(self, maxsize=512):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._data = collections.OrderedDict()
+
+	def get(self, key, build):
+		try:
+			sql = self._data[key]
+		except KeyError:
+			self.misses += 1
+			sql = CompiledSQL(build().replace('?', '%s'))
+			self._data[key] = sql
+			if len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+			return sql
+		self.hits += 1
+		self._data.move_to_end(key)
+		return sql
+
+	def resize(self, maxsize):
+		self.maxsize = maxsize
+		while len(self._data) > maxsize:
+			self._data.popitem(last=False)
+
+	def clear(self):
+		self._data.clear()
+		self.hits = self.misses = 0
+
+	def info(self):
+		return dict(hits=self.hits, misses=self.misses, size=len(self._data), maxsize=self.maxsize)
+
+# 已转换为%s占位符的sql, select/execute不再重复转换
+class CompiledSQL(str):
+	pass
+
+_sql_cache = SQLCache()
+
+def compile_sql(sql):
+	''' 把？占位符的sql转换为aiomysql的%s占位符，结果按sql文本缓存 '''
+	if isinstance(sql, CompiledSQL):
+		return sql
+	return _sql_cache.get(sql, lambda: sql)
+
+def sql_cache_info():
+	''' 编译sql缓存的命中/未命中计数，用来调整缓存大小 '''
+	return _sql_cache.info()
+
+class PoolOverloadError(Exception):
+	'''
+	Raised when no database connection could be acquired within acquire_timeout.
+	'''
+	pass
+
+# 命名连接池: 'primary'为主库, 其余为只读从库, 参数来自config.configs.db
+_pools = collections.OrderedDict()
+_replicas = []
+_pool_options = dict(acquire_timeout=10.0, ping_interval=30.0, balance='round_robin')
+_pool_stats = dict()
+_round_robin = itertools.count()
+
+async def _create_pool(loop, kw):
+	return await aiomysql.create_pool(
 		host=kw.get('host', 'localhost'),
 		port=kw.get('port', 3306),
 		user=kw['user'],
@@ -20,45 +90,325 @@ async def create_pool(loop, **kw):
 		db=kw['db'],
 		charset=kw.get('charset', 'utf8'),
 		autocommit=kw.get('autocommit', True),
+		# 连接数在minsize和maxsize之间按需增长
 		maxsize=kw.get('maxsize', 10),
 		minsize=kw.get('minsize', 1),
+		# 连接存活超过pool_recycle秒后在下次取用时重建, -1不回收
+		pool_recycle=kw.get('pool_recycle', -1),
 		loop=loop
 		)
+
+async def create_pool(loop, **kw):
+	'''
+	create the 'primary' pool from kw, plus one read-only pool per item of kw['replicas'].
+	a replica dict overrides the primary settings (host, port, maxsize...) and may set its name,
+	default 'replica0', 'replica1'...
+	'''
+	logging.info('create database connect pool...')
+	#pool为全局变量，aiomysql也用pool做协程
+	replicas = kw.pop('replicas', None) or []
+	_pools['primary'] = await _create_pool(loop, kw)
+	_pool_stats['primary'] = _new_stats()
+	for i, r in enumerate(replicas):
+		conf = dict(kw)
+		conf.update(r)
+		name = conf.pop('name', 'replica%d' % i)
+		_pools[name] = await _create_pool(loop, conf)
+		_pool_stats[name] = _new_stats()
+		_replicas.append(name)
+		logging.info('create replica pool %s: %s:%s' % (name, conf.get('host', 'localhost'), conf.get('port', 3306)))
+	_pool_options['acquire_timeout'] = kw.get('acquire_timeout', 10.0)
+	_pool_options['ping_interval'] = kw.get('ping_interval', 30.0)
+	_pool_options['balance'] = kw.get('balance', 'round_robin')
+	if 'sql_cache_size' in kw:
+		_sql_cache.resize(kw['sql_cache_size'])
+	_count_options['ttl'] = kw.get('count_ttl', 60)
+	_count_options['estimate_above'] = kw.get('count_estimate_above', 100000)
 	logging.info('create database done')
 
 async def close_pool():
 	'''异步关闭连接池'''
+	# 先写入write-behind缓冲中的行
+	for buffer in _write_behind:
+		await buffer.close()
 	logging.info('close database connection pool...')
-	global __pool
-	__pool.close()
-	await __pool.wait_closed()
+	for pool in _pools.values():
+		pool.close()
+		await pool.wait_closed()
+	_pools.clear()
+	del _replicas[:]
+
+def _new_stats():
+	return dict(waiting=0, acquired=0, timeouts=0, pings=0, dead=0, acquire_wait=Histogram(), query=Histogram())
+
+def _in_use(name):
+	pool = _pools[name]
+	return pool.size - pool.freesize + _pool_stats[name]['waiting']
+
+def read_pool():
+	'''
+	name of the pool for a read: a replica picked round robin (or the least busy one with
+	balance='least_busy'), the primary when there are no replicas or when the current
+	request has already written.
+	'''
+	scope = _request.get()
+	if not _replicas or (scope is not None and scope.primary):
+		return 'primary'
+	n = next(_round_robin) % len(_replicas)
+	if _pool_options['balance'] == 'least_busy':
+		# 从轮询位置开始比较, 连接占用相同时依然轮流分配
+		return min(_replicas[n:] + _replicas[:n], key=_in_use)
+	return _replicas[n]
+
+@contextlib.asynccontextmanager
+async def connection(name='primary'):
+	'''
+	acquire a connection of pool name: waits at most acquire_timeout seconds (PoolOverloadError otherwise)
+	and pings connections idle for more than ping_interval seconds before handing them out.
+	'''
+	pool = _pools[name]
+	stats = _pool_stats[name]
+	start = time.time()
+	stats['waiting'] += 1
+	try:
+		with tracing.span('orm.acquire', pool=name):
+			conn = await _acquire(pool, name, stats, start)
+	finally:
+		stats['waiting'] -= 1
+	stats['acquired'] += 1
+	stats['acquire_wait'].observe(time.time() - start)
+	try:
+		yield conn
+	finally:
+		conn._released_at = time.time()
+		pool.release(conn)
+
+# 在acquire_timeout内取得一个可用连接
+async def _acquire(pool, name, stats, start):
+	while True:
+		timeout = _pool_options['acquire_timeout'] - (time.time() - start)
+		try:
+			conn = await asyncio.wait_for(pool.acquire(), max(timeout, 0))
+		except asyncio.TimeoutError:
+			stats['timeouts'] += 1
+			raise PoolOverloadError('no database connection available in %.1fs: %s of %s connections in use (pool %s)' % (_pool_options['acquire_timeout'], pool.size - pool.freesize, pool.maxsize, name))
+		idle = start - getattr(conn, '_released_at', start)
+		if idle <= _pool_options['ping_interval']:
+			break
+		stats['pings'] += 1
+		try:
+			await conn.ping(reconnect=False)
+			break
+		except Exception as e:
+			# 失效连接关闭后归还, 连接池会丢弃它
+			stats['dead'] += 1
+			logging.warn('drop dead connection: %s' % e)
+			conn.close()
+			pool.release(conn)
+	return conn
+
+def pool_stats():
+	''' gauges and histograms of every named pool '''
+	result = dict(_pool_options)
+	result['pools'] = pools = dict()
+	for name, pool in _pools.items():
+		stats = dict(_pool_stats[name])
+		stats.update(size=pool.size, minsize=pool.minsize, maxsize=pool.maxsize, idle=pool.freesize, in_use=pool.size - pool.freesize)
+		stats['acquire_wait'] = stats['acquire_wait'].snapshot()
+		stats['query'] = stats['query'].snapshot()
+		pools[name] = stats
+	return result
+
+# 当前协程所在的事务, 由orm.transaction()设置
+_tx = contextvars.ContextVar('orm_tx', default=None)
+
+class Transaction(object):
+	'''
+	One pinned primary connection shared by all orm calls inside async with orm.transaction().
+	statements of a transaction run on that single connection, so they must not run concurrently.
+	'''
+	def __init__(self, conn):
+		self.conn = conn
+		self.depth = 0
+		self._on_commit = []
+
+	def on_commit(self, fn, *args):
+		''' call coroutine function fn(*args) after the outermost commit, dropped if its savepoint rolls back '''
+		self._on_commit.append((fn, args))
+
+@contextlib.asynccontextmanager
+async def transaction():
+	'''
+	async with orm.transaction() as tx:
+		await blog.save()
+		await comment.save()
+	commits once at the end or rolls back on exception. nested blocks become savepoints.
+	'''
+	tx = _tx.get()
+	if tx is not None:
+		tx.depth += 1
+		name = 'sp_%d' % tx.depth
+		# 回滚到保存点时丢弃保存点内登记的on_commit
+		mark = len(tx._on_commit)
+		async with tx.conn.cursor() as cur:
+			await cur.execute('savepoint %s' % name)
+		try:
+			yield tx
+		except BaseException:
+			del tx._on_commit[mark:]
+			async with tx.conn.cursor() as cur:
+				await cur.execute('rollback to savepoint %s' % name)
+			raise
+		else:
+			async with tx.conn.cursor() as cur:
+				await cur.execute('release savepoint %s' % name)
+		finally:
+			tx.depth -= 1
+		return
+	async with connection('primary') as conn:
+		tx = Transaction(conn)
+		token = _tx.set(tx)
+		await conn.begin()
+		try:
+			yield tx
+		except BaseException:
+			await conn.rollback()
+			raise
+		else:
+			await conn.commit()
+		finally:
+			_tx.reset(token)
+	for fn, args in tx._on_commit:
+		await fn(*args)
+
+@contextlib.asynccontextmanager
+async def _connect(pool):
+	# 事务内所有语句使用事务的连接
+	tx = _tx.get()
+	if tx is not None:
+		yield tx.conn
+	else:
+		async with connection(pool) as conn:
+			yield conn
 
 # 查询方法, sql: 原始的？拼接
-async def select(sql, args, size=None):
+async def select(sql, args, size=None, cursor=None, pool=None):
 	log(sql, args)
-	async with __pool.get() as conn:
-		# 指定返回的cursor类型为aiomysql的DictCursor
+	pool = 'primary' if _tx.get() is not None else pool or read_pool()
+	async with _connect(pool) as conn:
+		start = time.time()
+		with tracing.span('orm.query', sql=sql, pool=pool) as span:
+			# 默认返回的cursor类型为aiomysql的DictCursor, cursor=aiomysql.Cursor时返回tuple
+			async with conn.cursor(cursor or aiomysql.DictCursor) as cur:
+				# 调用和等待pool协程执行
+				await cur.execute(compile_sql(sql), args or ())
+				if size:
+					rs = await cur.fetchmany(size)
+				else:
+					rs = await cur.fetchall()
+			span.set(rows=len(rs))
+		elapsed = time.time() - start
+		_pool_stats[pool]['query'].observe(elapsed)
+		querylog.record(sql, args, elapsed, len(rs), pool)
+		logging.debug('rows returned: %s', len(rs))
+		return rs
+
+async def explain(sql, args, pool=None):
+	''' EXPLAIN of a statement as a list of dicts, on a connection of its own (never the transaction's) '''
+	async with connection(pool or read_pool()) as conn:
 		async with conn.cursor(aiomysql.DictCursor) as cur:
-			# 调用和等待pool协程执行
-			await cur.execute(sql.replace('?', '%s'), args or ())
-			if size:
-				rs = await cur.fetchmany(size)
-			else:
-				rs = await cur.fetchall()
-		logging.info('rows returned: %s' % len(rs))
+			await cur.execute('explain ' + compile_sql(sql), args or ())
+			return await cur.fetchall()
 
-# 增改删方法
-async def execute(sql, args, autocommit=True):
+# 流式查询, 使用不缓冲的SSDictCursor, 逐批fetch, 整个迭代期间占用一个连接
+async def select_iter(sql, args, batch_size=500, cursor=None, pool=None):
 	log(sql, args)
+	pool = pool or read_pool()
+	async with _connect(pool) as conn:
+		async with conn.cursor(cursor or aiomysql.SSDictCursor) as cur:
+			# 流式结果只记录执行语句的时间
+			with tracing.span('orm.query', sql=sql, pool=pool, stream=True):
+				await cur.execute(compile_sql(sql), args or ())
+			while True:
+				rs = await cur.fetchmany(batch_size)
+				if not rs:
+					break
+				for r in rs:
+					yield r
+
+def rows_to_columns(rows, columns, dtypes=None):
+	'''
+	convert tuple rows to a dict of numpy arrays, dtypes maps column name to numpy dtype
+	(missing names are inferred by numpy). columns that can not be converted (e.g. NULL in
+	an int64 column) fall back to dtype object.
+	'''
+	if numpy is None:
+		raise ImportError('numpy is required for columnar query results')
+	dtypes = dtypes or dict()
+	values = list(zip(*rows)) if rows else [()] * len(columns)
+	result = dict()
+	for name, v in zip(columns, values):
+		dtype = dtypes.get(name, None)
+		try:
+			result[name] = numpy.array(v, dtype=dtype)
+		except (TypeError, ValueError):
+			result[name] = numpy.array(v, dtype=object)
+	return result
 
-	async with __pool.get() as conn:
+# 列式流式查询, 每chunk_size行转换为一组numpy数组; empty=True时没有结果也返回一组空数组
+async def iter_columns(sql, args, dtypes=None, chunk_size=10000, pool=None, empty=False):
+	log(sql, args)
+	pool = pool or read_pool()
+	async with _connect(pool) as conn:
+		async with conn.cursor(aiomysql.SSCursor) as cur:
+			with tracing.span('orm.query', sql=sql, pool=pool, stream=True):
+				await cur.execute(compile_sql(sql), args or ())
+			columns = [d[0] for d in cur.description]
+			while True:
+				rs = await cur.fetchmany(chunk_size)
+				if not rs:
+					break
+				empty = False
+				yield rows_to_columns(rs, columns, dtypes)
+			if empty:
+				# 列名取自cur.description, 空结果的各列仍有对应的dtype
+				yield rows_to_columns((), columns, dtypes)
+
+async def select_columns(sql, args, dtypes=None, chunk_size=10000, pool=None):
+	'''
+	select into column-oriented results: dict of column name -> numpy array, empty arrays of
+	the same columns and dtypes when nothing matches. rows are streamed and converted chunk by chunk, only one chunk of tuples is in memory at a time.
+	'''
+	chunks = collections.OrderedDict()
+	async for part in iter_columns(sql, args, dtypes, chunk_size, pool, empty=True):
+		for name, arr in part.items():
+			chunks.setdefault(name, []).append(arr)
+	result = dict((name, numpy.concatenate(arrs)) for name, arrs in chunks.items())
+	logging.debug('columns returned: %s rows', len(next(iter(result.values()))))
+	return result
+
+# 增改删方法
+async def execute(sql, args, autocommit=True, pool='primary'):
+	log(sql, args)
+	# 本次请求写过主库后, 后续的读也走主库, 避免读到从库延迟的旧数据
+	scope = _request.get()
+	if scope is not None:
+		scope.primary = True
+	# 在orm.transaction()内时由外层事务统一提交
+	if _tx.get() is not None:
+		pool = 'primary'
+		autocommit = True
+	async with _connect(pool) as conn:
+		start = time.time()
 		# 手动开启事务处理
 		if not autocommit:
 			await conn.begin()
 		try:
-			async with conn.cursor(aiomysql.DictCursor) as cur:
-				await cur.execute(sql.replace('?', '%s'), args)
-				affected = cur.rowcount
+			with tracing.span('orm.execute', sql=sql, pool=pool) as span:
+				async with conn.cursor(aiomysql.DictCursor) as cur:
+					await cur.execute(compile_sql(sql), args)
+					affected = cur.rowcount
+				span.set(rows=affected)
 			# 手动提交事务
 			if not autocommit:
 				await conn.commit()
@@ -67,6 +417,9 @@ async def execute(sql, args, autocommit=True):
 			if not autocommit:
 				await conn.rollback()
 			raise
+		elapsed = time.time() - start
+		_pool_stats[pool]['query'].observe(elapsed)
+		querylog.record(sql, args, elapsed, affected, pool)
 		return affected
 
 # n个？参数占位语句
@@ -77,8 +430,458 @@ def create_args_string(num):
 	return ', '.join(L)
 
 
+# 请求范围内的orm状态, 由app的orm middleware设置
+_request = contextvars.ContextVar('orm_request', default=None)
+
+class RequestScope(object):
+	'''
+	Per request orm state: the DataLoader batching Model.find, and whether reads
+	stick to the primary because the request has written.
+	'''
+	def __init__(self, loader=True):
+		self.loader = DataLoader() if loader else None
+		self.primary = False
+
+class DataLoader(object):
+	'''
+	Collects Model.find calls made within one event loop tick and loads them as one find_many batch per model.
+	'''
+	def __init__(self):
+		self._queue = dict()
+		self._scheduled = False
+
+	def load(self, cls, pk):
+		futures = self._queue.setdefault(cls, dict())
+		fut = futures.get(pk)
+		if fut is None:
+			loop = asyncio.get_event_loop()
+			fut = loop.create_future()
+			futures[pk] = fut
+			if not self._scheduled:
+				# 当前tick里已就绪的协程都执行完之后再统一发出查询
+				self._scheduled = True
+				loop.call_soon(self._dispatch)
+		return fut
+
+	def _dispatch(self):
+		queue, self._queue = self._queue, dict()
+		self._scheduled = False
+		for cls, futures in queue.items():
+			asyncio.ensure_future(self._load(cls, futures))
+
+	async def _load(self, cls, futures):
+		try:
+			rs = await cls.find_many(list(futures.keys()))
+		except Exception as e:
+			for fut in futures.values():
+				if not fut.done():
+					fut.set_exception(e)
+			return
+		for fut, r in zip(futures.values(), rs):
+			if not fut.done():
+				fut.set_result(r)
+
+@contextlib.contextmanager
+def request_scope(loader=True):
+	''' with orm.request_scope(): Model.find calls inside are batched, reads after a write go to the primary '''
+	token = _request.set(RequestScope(loader))
+	try:
+		yield
+	finally:
+		_request.reset(token)
+
+class Row(object):
+	'''
+	Compact read-only style record of one table row, an alternative to the dict based Model.
+	ModelMetaclass generates one subclass per model (Model.__row__) with __slots__ in the
+	column order of __select__, so rows are built straight from tuple cursor results.
+	'''
+	__slots__ = ()
+	__columns__ = ()
+
+	def __getitem__(self, key):
+		try:
+			return getattr(self, key)
+		except AttributeError:
+			raise KeyError(key)
+
+	def get(self, key, default=None):
+		return getattr(self, key, default)
+
+	def keys(self):
+		return self.__columns__
+
+	def _asdict(self):
+		return dict(zip(self.__columns__, map(self.__getattribute__, self.__columns__)))
+
+	def __eq__(self, other):
+		return type(self) is type(other) and all(getattr(self, k) == getattr(other, k) for k in self.__columns__)
+
+	def __repr__(self):
+		return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%r' % (k, getattr(self, k)) for k in self.__columns__))
+
+def make_row_class(name, columns):
+	# 按列顺序生成位置参数的__init__, 与namedtuple的做法相同
+	ns = dict()
+	exec('def __init__(self, %s):\n%s' % (', '.join(columns), '\n'.join('\tself.%s = %s' % (c, c) for c in columns)), ns)
+	return type(name, (Row,), dict(__slots__=tuple(columns), __columns__=tuple(columns), __init__=ns['__init__']))
+
+# Model.count的缓存: 表名 => {(where, args): [数量, 是否精确, 过期时间]}, 每个进程一份, 不随其他进程的写入调整
+_counts = collections.defaultdict(dict)
+_count_options = dict(ttl=60, estimate_above=100000)
+# 可以按写入的行增减的计数条件: 单个列等值
+_COUNT_EQ_RE = re.compile(r'^\s*`?(\w+)`?\s*=\s*\?\s*$')
+
+# 写入监听, 见add_listener
+_listeners = []
+
+def add_listener(fn):
+	'''
+	call fn(cls, action, row) after every Model save, update and remove (action 'save', 'update',
+	'remove'), and per row of save_many / upsert_many; inside a transaction after the commit.
+	'''
+	_listeners.append(fn)
+
+def remove_listener(fn):
+	_listeners.remove(fn)
+
+def encode_cursor(direction, values):
+	''' opaque pagination cursor: direction 'n' (next) or 'p' (previous) and the seek values '''
+	data = json.dumps([direction] + list(values), separators=(',', ':')).encode('utf-8')
+	return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+	''' (direction, values) of encode_cursor, ValueError for anything else '''
+	try:
+		data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+	except (TypeError, ValueError):
+		raise ValueError('invalid cursor: %s' % cursor)
+	if not isinstance(data, list) or len(data) < 2 or data[0] not in ('n', 'p'):
+		raise ValueError('invalid cursor: %s' % cursor)
+	return data[0], data[1:]
+
+class Page(object):
+	'''
+	One page of Model.paginate: items, the cursors of the next and previous pages (None at
+	either end), total (None when not requested) and whether total is exact.
+	'''
+	__slots__ = ('items', 'next', 'prev', 'total', 'exact', 'limit')
+
+	def __init__(self, items, next, prev, total, exact, limit):
+		self.items = items
+		self.next = next
+		self.prev = prev
+		self.total = total
+		self.exact = exact
+		self.limit = limit
+
+	def _asdict(self):
+		return dict((k, getattr(self, k)) for k in self.__slots__)
+
+class WriteBehindOverloadError(PoolOverloadError):
+	'''
+	Raised when a write-behind buffer stayed full for max_wait seconds.
+	'''
+	pass
+
+# mysql的ER_DUP_ENTRY
+DUP_ENTRY = 1062
+
+def is_duplicate_key(e):
+	''' True for the duplicate key error of mysql '''
+	return bool(getattr(e, 'args', None)) and e.args[0] == DUP_ENTRY
+
+# 所有model的WriteBehind
+_write_behind = []
+
+async def configure_write_behind(tables):
+	'''
+	tables maps a table name to WriteBehind options plus enabled: a model of an enabled table
+	gets a buffer, replacing its __write_behind__ declaration; enabled=False removes it.
+	a replaced buffer is closed first, writing the rows it holds.
+	'''
+	for cls in models():
+		options = tables.get(cls.__table__, None)
+		if options is None:
+			continue
+		options = dict(options)
+		enabled = options.pop('enabled', True)
+		buffer = cls.__dict__.get('__write_behind__', None)
+		if buffer is not None:
+			await buffer.close()
+			_write_behind.remove(buffer)
+		cls.__write_behind__ = WriteBehind(cls, **options) if enabled else None
+
+async def start_write_behind():
+	''' start the flush task of every write-behind model, replaying journals left by dead processes '''
+	for buffer in _write_behind:
+		await buffer.start()
+
+def write_behind_stats():
+	return dict((buffer.model.__table__, buffer.stats()) for buffer in _write_behind)
+
+def _alive(pid):
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+class WriteBehind(object):
+	'''
+	Insert buffer of a model that declares __write_behind__ = dict(...), or of a table enabled
+	in configs.write_behind. Model.save (outside transactions) queues the row and returns; a
+	background task inserts the queue with multi-row inserts once max_rows rows are waiting
+	or every max_delay seconds. A batch failing on a duplicate primary key is inserted again
+	row by row: rows whose key exists are logged and dropped, counts and listeners only see
+	the rows inserted. At most max_pending rows are queued: save then waits for room, up to
+	max_wait seconds, before raising WriteBehindOverloadError. orm.close_pool flushes the queue.
+
+	journal: path prefix of a local file (one per process, prefix.<pid>) where each row is
+	appended, with fsync=True also synced, before save returns. Rows saved while a write is
+	in progress are appended together by the next one (one write and fsync per group), all
+	file work runs in the default executor. After a flush the file is rewritten to hold only
+	the queued rows; journals of processes that died are replayed by start().
+	'''
+	def __init__(self, model, max_rows=500, max_delay=0.5, max_pending=10000, max_wait=5.0, journal=None, fsync=False):
+		self.model = model
+		self.max_rows = max_rows
+		self.max_delay = max_delay
+		self.max_pending = max_pending
+		self.max_wait = max_wait
+		self.journal = journal
+		self.fsync = fsync
+		self.pending = collections.deque()
+		self.flushed = 0
+		self.dropped = 0
+		self.batches = 0
+		self.failures = 0
+		self.waits = 0
+		self._task = None
+		self._wakeup = None
+		self._space = None
+		self._lock = None
+		self._file = None
+		# 等待写入日志的行, 和这些行写入后完成的future
+		self._journal_rows = []
+		self._journal_done = None
+		self._journal_lock = None
+		self._closing = False
+		_write_behind.append(self)
+
+	async def start(self):
+		if self._task is not None:
+			return
+		self._wakeup = asyncio.Event()
+		self._space = asyncio.Event()
+		self._lock = asyncio.Lock()
+		self._journal_lock = asyncio.Lock()
+		if self.journal:
+			await self._replay()
+		self._task = asyncio.ensure_future(self._run())
+
+	async def add(self, row):
+		''' queue the insert args of one row '''
+		if self._task is None:
+			await self.start()
+		if len(self.pending) >= self.max_pending:
+			self.waits += 1
+			self._wakeup.set()
+			deadline = time.time() + self.max_wait
+			while len(self.pending) >= self.max_pending:
+				self._space.clear()
+				try:
+					await asyncio.wait_for(self._space.wait(), max(0, deadline - time.time()))
+				except asyncio.TimeoutError:
+					raise WriteBehindOverloadError('%s write-behind buffer full (%s rows)' % (self.model.__name__, len(self.pending)))
+		self.pending.append(row)
+		if self._file is not None:
+			if self._journal_done is None:
+				# 一组行的第一行启动写入, 其余的行等待同一次写入
+				self._journal_done = asyncio.get_event_loop().create_future()
+				asyncio.ensure_future(self._appendJournal())
+			done = self._journal_done
+			self._journal_rows.append(row)
+			try:
+				await asyncio.shield(done)
+			except Exception:
+				# 没有记入日志的行不进入队列, 除非已经写入了数据库
+				try:
+					self.pending.remove(row)
+				except ValueError:
+					pass
+				raise
+		if len(self.pending) >= self.max_rows:
+			self._wakeup.set()
+
+	async def _appendJournal(self):
+		async with self._journal_lock:
+			rows, done = self._journal_rows, self._journal_done
+			self._journal_rows, self._journal_done = [], None
+			# 这一组已经被_rewrite写入
+			if done is None:
+				return
+			data = ''.join(json.dumps(row) + '\n' for row in rows)
+			try:
+				await asyncio.get_event_loop().run_in_executor(None, self._append, data)
+			except Exception as e:
+				logging.error('write-behind journal of %s: %s' % (self.model.__name__, e))
+				done.set_exception(e)
+				# 等待者各自取到异常, 不再报告未取回
+				done.exception()
+				return
+			done.set_result(None)
+
+	def _append(self, data):
+		self._file.write(data)
+		self._file.flush()
+		if self.fsync:
+			os.fsync(self._file.fileno())
+
+	async def _run(self):
+		# 后台任务不属于创建它的请求或事务
+		_tx.set(None)
+		_request.set(None)
+		tracing._trace.set(None)
+		while True:
+			try:
+				await asyncio.wait_for(self._wakeup.wait(), self.max_delay)
+			except asyncio.TimeoutError:
+				pass
+			self._wakeup.clear()
+			await self.flush()
+			if self._closing:
+				return
+
+	async def flush(self):
+		''' insert the queued rows in batches of max_rows; a failed batch stays queued. returns rows inserted '''
+		if self._lock is None:
+			return 0
+		written = 0
+		async with self._lock:
+			removed = 0
+			while self.pending:
+				chunk = list(itertools.islice(self.pending, self.max_rows))
+				# 按顺序记录处理过的行: True已写入, False主键重复被丢弃
+				handled = []
+				try:
+					await self.model._flushRows(chunk, handled)
+				except Exception as e:
+					self.failures += 1
+					logging.warning('write-behind flush of %s rows of %s failed: %s' % (len(chunk) - len(handled), self.model.__name__, e))
+				# 逐行insert中途失败时, 只保留还没处理的行
+				for ok in handled:
+					self.pending.popleft()
+				inserted = handled.count(True)
+				removed += len(handled)
+				written += inserted
+				self.flushed += inserted
+				self.dropped += len(handled) - inserted
+				if handled:
+					self._space.set()
+				if len(handled) < len(chunk):
+					break
+				self.batches += 1
+			if removed and self._file is not None:
+				await self._rewrite()
+		return written
+
+	async def close(self):
+		''' stop the flush task and flush what is queued '''
+		if self._task is None:
+			return
+		# 不取消任务, 以免中断正在提交的批次
+		self._closing = True
+		self._wakeup.set()
+		await self._task
+		self._task = None
+		self._closing = False
+		await self.flush()
+		if self.pending:
+			logging.error('write-behind of %s: %s rows not written%s' % (self.model.__name__, len(self.pending),
+				', kept in the journal' if self._file is not None else ''))
+		if self._file is not None:
+			async with self._journal_lock:
+				self._file.close()
+				self._file = None
+
+	def stats(self):
+		return dict(pending=len(self.pending), flushed=self.flushed, dropped=self.dropped, batches=self.batches,
+			failures=self.failures, waits=self.waits, journal=self.journal)
+
+	def _path(self):
+		return '%s.%d' % (self.journal, os.getpid())
+
+	async def _replay(self):
+		loop = asyncio.get_event_loop()
+		claimed, rows = await loop.run_in_executor(None, self._claim)
+		self.pending.extend(rows)
+		await self._rewrite()
+		await loop.run_in_executor(None, lambda: [os.remove(claim) for claim in claimed])
+		if self.pending:
+			logging.info('write-behind of %s: replaying %s journaled rows' % (self.model.__name__, len(self.pending)))
+			self._wakeup.set()
+
+	def _claim(self):
+		# 接管已退出进程的日志文件: 重命名成功的进程负责写入其中的行
+		claimed, rows = [], []
+		for name in glob.glob(glob.escape(self.journal) + '.*'):
+			suffix = name[len(self.journal) + 1:]
+			if not suffix.isdigit() or (int(suffix) != os.getpid() and _alive(int(suffix))):
+				continue
+			claim = '%s.%d.claim%d' % (self.journal, os.getpid(), len(claimed))
+			try:
+				os.rename(name, claim)
+			except FileNotFoundError:
+				continue
+			claimed.append(claim)
+			with open(claim) as f:
+				for line in f:
+					try:
+						rows.append(json.loads(line))
+					except ValueError:
+						# 写到一半的最后一行
+						pass
+		return claimed, rows
+
+	async def _rewrite(self):
+		# 日志只保留仍在队列中的行; 等待追加的行都在队列中, 这一组随重写一起完成
+		async with self._journal_lock:
+			done = self._journal_done
+			self._journal_rows, self._journal_done = [], None
+			rows = list(self.pending)
+			try:
+				await asyncio.get_event_loop().run_in_executor(None, self._replace, rows)
+			except Exception as e:
+				logging.error('write-behind journal of %s: %s' % (self.model.__name__, e))
+				if done is not None:
+					done.set_exception(e)
+					done.exception()
+				return
+			if done is not None:
+				done.set_result(None)
+
+	def _replace(self, rows):
+		path = self._path()
+		tmp = path + '.tmp'
+		with open(tmp, 'w') as f:
+			for row in rows:
+				f.write(json.dumps(row) + '\n')
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, path)
+		# 替换完成前self._file一直可用
+		old, self._file = self._file, open(path, 'a')
+		if old is not None:
+			old.close()
+
 # orm中column -> Field构建
 class Field(object):
+	# 列式结果(numpy)使用的dtype
+	dtype = object
+
 	# 列名， 数据类型， 是否主键， 默认值
 	def __init__(self, name, column_type, primary_key, default):
 		self.name = name
@@ -96,16 +899,22 @@ class StringField(Field):
 
 class BooleanField(Field):
 	"""docstring for BooleanField"""
+	dtype = 'bool'
+
 	def __init__(self, name=None, default=False):
 		super(BooleanField, self).__init__(name, 'boolean', False, default)
 		
 class IntegerField(Field):
 
+    dtype = 'int64'
+
     def __init__(self, name=None, primary_key=False, default=0):
         super().__init__(name, 'bigint', primary_key, default)
 
 class FloatField(Field):
 
+    dtype = 'float64'
+
     def __init__(self, name=None, primary_key=False, default=0.0):
         super().__init__(name, 'real', primary_key, default)
 
@@ -152,16 +961,37 @@ class ModelMetaclass(type):
         attrs['__table__'] = tableName
         attrs['__primary_key__'] = primaryKey # 主键属性名
         attrs['__fields__'] = fields # 除主键外的属性名
+        #声明了__cache__的model, find走进程内(或redis)缓存, __loading__保存正在查询的主键, 合并并发的未命中
+        cache = attrs.get('__cache__', None)
+        if isinstance(cache, dict):
+            cache = dict(cache)
+            cache.setdefault('prefix', '%s:' % tableName)
+            attrs['__cache_options__'] = cache
+            attrs['__cache__'] = create_cache(**cache)
+            attrs['__loading__'] = dict()
         #以下四种方法保存了默认了增删改查操作,其中添加的反引号``,是为了避免与sql关键字冲突的,否则sql语句会执行出错
         attrs['__select__'] = 'select `%s`, %s from `%s`' % (primaryKey, ', '.join(escaped_fields), tableName)
         attrs['__insert__'] = 'insert into `%s` (%s, `%s`) values (%s)' % (tableName, ', '.join(escaped_fields), primaryKey, create_args_string(len(escaped_fields) + 1))
         attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (tableName, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primaryKey)
         attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (tableName, primaryKey)
-        return type.__new__(cls, name, bases, attrs)
+        #紧凑行类型, 列顺序与__select__一致; __rows__ = 'compact'时findAll默认返回该类型
+        attrs['__row__'] = make_row_class('%sRow' % name, [primaryKey] + fields)
+        model = type.__new__(cls, name, bases, attrs)
+        #声明了__write_behind__的model, save()在事务外写入缓冲, 由后台任务批量insert
+        write_behind = attrs.get('__write_behind__', None)
+        if isinstance(write_behind, dict):
+            model.__write_behind__ = WriteBehind(model, **write_behind)
+        return model
 
 
 class Model(dict, metaclass=ModelMetaclass):
 	"""docstring for Model"""
+	__cache__ = None
+	__rows__ = 'dict'
+	# 读操作使用的连接池名, None按read_pool()自动路由
+	__pool__ = None
+	__write_behind__ = None
+
 	def __init__(self, **kw):
 		super(Model, self).__init__(**kw)
 
@@ -189,73 +1019,592 @@ class Model(dict, metaclass=ModelMetaclass):
 		return value
     
 	@classmethod
-	async def findAll(cls, where=None, args=None, **kw):
+	def _findAllSQL(cls, where, orderBy, form):
 		sql = [cls.__select__]
 		if where:
 			sql.append('where')
 			sql.append(where)
-		if args is None:
-			args = []
-
-		orderBy = kw.get('orderBy', None)
 		if orderBy:
 			sql.append('order by')
 			sql.append(orderBy)
+		if form == 1:
+			sql.append('limit ?')
+		elif form == 2:
+			sql.append('limit ?, ?')
+		return ' '.join(sql)
+
+	@classmethod
+	def _findAllQuery(cls, where, args, kw):
+		if args is None:
+			args = []
+		else:
+			args = list(args)
+		orderBy = kw.get('orderBy', None)
 		limit = kw.get('limit', None)
+		# limit只影响sql的形状(无、一个或两个占位符)，具体的值作为参数传入
+		form = 0
 		if limit is not None:
-			sql.append('limit')
 			if isinstance(limit, int):
-				sql.append('?')
+				form = 1
 				args.append(limit)
 			elif isinstance(limit, tuple) and len(limit) == 2:
-				sql.append('?, ?')
+				form = 2
 				args.extend(limit)
 			else:
 				raise ValueError('Invalid limit value: %s' % str(limit))
-		rs = await select(' '.join(sql), args)
-		all = [cls(**r) for r in rs]
-		logging.info('findAll first: ', all[0])
+		return _sql_cache.get((cls, 'findAll', where, orderBy, form), lambda: cls._findAllSQL(where, orderBy, form)), args
+
+	@classmethod
+	async def findAll(cls, where=None, args=None, **kw):
+		sql, args = cls._findAllQuery(where, args, kw)
+		# rows='compact'返回__row__对象(__slots__), rows='columns'返回列名->numpy数组, 默认返回Model(dict)
+		rows = kw.get('rows', cls.__rows__)
+		if rows == 'columns':
+			return await select_columns(sql, args, cls.dtypes(kw.get('strings', 'object')), kw.get('chunk_size', 10000), kw.get('pool', cls.__pool__))
+		if rows == 'compact':
+			Row = cls.__row__
+			rs = await select(sql, args, cursor=aiomysql.Cursor, pool=kw.get('pool', cls.__pool__))
+			all = [Row(*r) for r in rs]
+		else:
+			rs = await select(sql, args, pool=kw.get('pool', cls.__pool__))
+			all = [cls(**r) for r in rs]
+		logging.debug('findAll rows: %s', len(all))
 		return all
 
 	@classmethod
-	async def findNumber(cls, selectField, where=None, args=None):
-		' find number by select and where. '
-		sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
+	def dtypes(cls, strings='object'):
+		'''
+		numpy dtype of each column from its Field: FloatField -> float64, IntegerField -> int64,
+		BooleanField -> bool, strings as object or, with strings='fixed', unicode of the varchar width.
+		'''
+		dtypes = dict()
+		for k, f in cls.__mappings__.items():
+			dtype = f.dtype
+			if dtype is object and strings == 'fixed':
+				m = re.match(r'^(?:var)?char\((\d+)\)$', f.column_type)
+				if m:
+					dtype = 'U%s' % m.group(1)
+			dtypes[k] = dtype
+		return dtypes
+
+	@classmethod
+	async def iter_columns(cls, where=None, args=None, chunk_size=10000, strings='object', **kw):
+		' async generator yields dicts of numpy arrays, chunk_size rows each. '
+		sql, args = cls._findAllQuery(where, args, kw)
+		async for part in iter_columns(sql, args, cls.dtypes(strings), chunk_size, kw.get('pool', cls.__pool__)):
+			yield part
+
+	@classmethod
+	def _keysetSQL(cls, where, key, first):
+		pk = cls.__primary_key__
+		sql = [cls.__select__]
+		cond = []
 		if where:
+			cond.append('(%s)' % where)
+		if not first:
+			if key == pk:
+				cond.append('`%s` > ?' % pk)
+			else:
+				cond.append('(`%s` > ? or (`%s` = ? and `%s` > ?))' % (key, key, pk))
+		if cond:
 			sql.append('where')
-			sql.append(where)
-			
-		rs = await select(' '.join(sql), args, 1)
+			sql.append(' and '.join(cond))
+		sql.append('order by')
+		sql.append('`%s`' % pk if key == pk else '`%s`, `%s`' % (key, pk))
+		sql.append('limit ?')
+		return ' '.join(sql)
+
+	@classmethod
+	async def iter_all(cls, where=None, args=None, batch_size=500, keyset=None, rows=None, pool=None):
+		'''
+		async generator yields model instances incrementally:
+			async for blog in Blog.iter_all('user_id=?', [uid]):
+		default mode streams one unbuffered cursor and holds one pooled connection until exhausted.
+		keyset=True (primary key) or keyset='created_at' pages by the key column instead,
+		each batch is an independent query so no connection is pinned between batches.
+		rows='compact' yields __row__ objects instead of model instances.
+		'''
+		args = list(args or [])
+		compact = (rows or cls.__rows__) == 'compact'
+		pool = pool or cls.__pool__
+		if not keyset:
+			sql = _sql_cache.get((cls, 'findAll', where, None, 0), lambda: cls._findAllSQL(where, None, 0))
+			if compact:
+				Row = cls.__row__
+				async for r in select_iter(sql, args, batch_size, cursor=aiomysql.SSCursor, pool=pool):
+					yield Row(*r)
+			else:
+				async for r in select_iter(sql, args, batch_size, pool=pool):
+					yield cls(**r)
+			return
+		pk = cls.__primary_key__
+		key = pk if keyset is True else keyset
+		last = None
+		while True:
+			first = last is None
+			sql = _sql_cache.get((cls, 'keyset', where, key, first), lambda: cls._keysetSQL(where, key, first))
+			if first:
+				params = args + [batch_size]
+			elif key == pk:
+				params = args + [last[pk], batch_size]
+			else:
+				params = args + [last[key], last[key], last[pk], batch_size]
+			rs = await select(sql, params, pool=pool)
+			for r in rs:
+				yield cls.__row__(**r) if compact else cls(**r)
+			if len(rs) < batch_size:
+				break
+			last = rs[-1]
+
+	@classmethod
+	def _pageSQL(cls, where, key, desc, direction):
+		pk = cls.__primary_key__
+		# 向前翻页时反向排序, 取到的行再倒过来
+		backward = direction == 'p'
+		less = desc != backward
+		op = '<' if less else '>'
+		order = 'desc' if less else 'asc'
+		sql = [cls.__select__]
+		cond = []
+		if where:
+			cond.append('(%s)' % where)
+		if direction is not None:
+			if key == pk:
+				cond.append('`%s` %s ?' % (pk, op))
+			else:
+				cond.append('(`%s` %s ? or (`%s` = ? and `%s` %s ?))' % (key, op, key, pk, op))
+		if cond:
+			sql.append('where')
+			sql.append(' and '.join(cond))
+		sql.append('order by')
+		sql.append('`%s` %s' % (pk, order) if key == pk else '`%s` %s, `%s` %s' % (key, order, pk, order))
+		sql.append('limit ?')
+		return ' '.join(sql)
+
+	@classmethod
+	async def paginate(cls, where=None, args=None, cursor=None, limit=20, key='created_at', desc=True, total=True, rows=None, pool=None):
+		'''
+		keyset (seek) pagination ordered by key, with the primary key as tie breaker:
+			page = await Blog.paginate(limit=10)
+			page = await Blog.paginate(limit=10, cursor=page.next)
+		every page, however deep, is one indexed seek from the cursor row plus limit + 1 rows
+		(an index on key, or on the where columns followed by key, makes it cheap).
+		cursor is page.next or page.prev of an earlier page with the same arguments; a cursor
+		that can not be decoded raises ValueError. total comes from Model.count, total=False skips it.
+		'''
+		args = list(args or [])
+		pk = cls.__primary_key__
+		direction, values = None, []
+		if cursor:
+			direction, values = decode_cursor(cursor)
+			if len(values) != (1 if key == pk else 2):
+				raise ValueError('invalid cursor: %s' % cursor)
+		sql = _sql_cache.get((cls, 'page', where, key, desc, direction), lambda: cls._pageSQL(where, key, desc, direction))
+		if direction is None:
+			params = args + [limit + 1]
+		elif key == pk:
+			params = args + [values[0], limit + 1]
+		else:
+			params = args + [values[0], values[0], values[1], limit + 1]
+		rs = await select(sql, params, pool=pool or cls.__pool__)
+		# 多取一行判断这个方向上是否还有下一页
+		more = len(rs) > limit
+		rs = rs[:limit]
+		if direction == 'p':
+			rs.reverse()
+		def seek(r):
+			return [r[pk]] if key == pk else [r[key], r[pk]]
+		if direction == 'p':
+			prev = encode_cursor('p', seek(rs[0])) if more else None
+			next = encode_cursor('n', seek(rs[-1])) if rs else None
+		else:
+			next = encode_cursor('n', seek(rs[-1])) if more else None
+			prev = encode_cursor('p', seek(rs[0])) if direction is not None and rs else None
+		compact = (rows or cls.__rows__) == 'compact'
+		items = [cls.__row__(**r) if compact else cls(**r) for r in rs]
+		n, exact = (await cls._count(where, args, False, pool)) if total else (None, False)
+		return Page(items, next, prev, n, exact, limit)
+
+	@classmethod
+	async def estimate(cls):
+		' InnoDB estimate of the number of rows in the table (information_schema table_rows), None if unknown. '
+		rs = await select('select table_rows _num_ from information_schema.tables where table_schema = database() and table_name = ?', [cls.__table__], 1, pool=cls.__pool__)
+		if len(rs) == 0 or rs[0]['_num_'] is None:
+			return None
+		return int(rs[0]['_num_'])
+
+	@classmethod
+	async def count(cls, where=None, args=None, exact=False, pool=None):
+		'''
+		number of rows matching where, cached per process for count_ttl seconds; save and
+		remove adjust the cached numbers, update drops the filtered ones. the unfiltered count
+		of a table whose InnoDB estimate exceeds count_estimate_above is that estimate, unless exact=True.
+		writes only adjust the counts of the process making them: with several server.py
+		workers, the others see the change once their entry expires, up to count_ttl seconds later.
+		'''
+		n, is_exact = await cls._count(where, args, exact, pool)
+		return n
+
+	@classmethod
+	async def _count(cls, where, args, exact, pool):
+		args = list(args or [])
+		# 事务内可能有未提交的写入, 不读也不写缓存
+		if _tx.get() is not None:
+			return await cls.findNumber('count(*)', where, args, pool=pool), True
+		counts = _counts[cls.__table__]
+		key = (where, tuple(args))
+		now = time.time()
+		entry = counts.get(key, None)
+		if entry is not None and entry[2] > now and (entry[1] or not exact):
+			return entry[0], entry[1]
+		n, is_exact = None, True
+		if not where and not exact and _count_options['estimate_above']:
+			estimate = await cls.estimate()
+			if estimate is not None and estimate > _count_options['estimate_above']:
+				n, is_exact = estimate, False
+		if n is None:
+			n = await cls.findNumber('count(*)', where, args, pool=pool)
+		counts[key] = [n, is_exact, now + _count_options['ttl']]
+		return n, is_exact
+
+	@classmethod
+	async def _countChanged(cls, row, delta):
+		'''
+		keep the cached counts in step with a write: delta rows like row were inserted or removed.
+		row None drops the filtered counts, delta None drops the unfiltered ones too.
+		'''
+		tx = _tx.get()
+		if tx is not None:
+			# 事务提交后才生效, 回滚则不变
+			tx.on_commit(cls._countChanged, row, delta)
+			return
+		counts = _counts.get(cls.__table__, None)
+		if not counts:
+			return
+		for key, entry in list(counts.items()):
+			where, args = key
+			if not where:
+				if delta is None:
+					del counts[key]
+				else:
+					entry[0] = max(0, entry[0] + delta)
+				continue
+			m = _COUNT_EQ_RE.match(where)
+			if row is None or delta is None or m is None or len(args) != 1 or m.group(1) not in cls.__mappings__:
+				del counts[key]
+			elif row.get(m.group(1)) == args[0]:
+				entry[0] = max(0, entry[0] + delta)
+
+	@classmethod
+	async def _notify(cls, action, rows):
+		if not _listeners:
+			return
+		tx = _tx.get()
+		if tx is not None:
+			tx.on_commit(cls._notify, action, rows)
+			return
+		for fn in _listeners:
+			for row in rows:
+				# 写入已经完成, 监听出错只记录日志
+				try:
+					fn(cls, action, row)
+				except Exception:
+					logging.exception('write listener %r failed on %s %s' % (fn, action, cls.__name__))
+
+	@classmethod
+	async def findNumber(cls, selectField, where=None, args=None, pool=None):
+		' find number by select and where. '
+		def build():
+			sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
+			if where:
+				sql.append('where')
+				sql.append(where)
+			return ' '.join(sql)
+		rs = await select(_sql_cache.get((cls, 'findNumber', selectField, where), build), args, 1, pool=pool or cls.__pool__)
 		if len(rs) == 0:
 			return None
 		return rs[0]['_num_']
 
 	@classmethod
-	async def find(cls, pk):
-		' find object by primary key. '
-		rs = await select('%s where `%s`=?' % (cls.__select__, cls.__primary_key__), [pk], 1)
+	async def _findRow(cls, pk):
+		sql = _sql_cache.get((cls, 'find'), lambda: '%s where `%s`=?' % (cls.__select__, cls.__primary_key__))
+		rs = await select(sql, [pk], 1, pool=cls.__pool__)
 		if len(rs) == 0:
 			return None
-		r = cls(**rs[0])
-		logging.info('find: %s' % rows)
+		return rs[0]
+
+	@classmethod
+	async def _loadCached(cls, pk):
+		r = await cls._findRow(pk)
+		# 查询期间若被save/update/remove失效, 不再回填旧数据
+		if r is not None and cls.__loading__.get(pk) is asyncio.current_task():
+			await cls.__cache__.set(str(pk), r)
 		return r
 
+	@classmethod
+	async def find(cls, pk):
+		' find object by primary key. '
+		# 事务内直接查询事务连接, 不经过DataLoader和缓存, 以读到本事务未提交的修改
+		if _tx.get() is not None:
+			r = await cls._findRow(pk)
+			return None if r is None else cls(**r)
+		scope = _request.get()
+		if scope is not None and scope.loader is not None:
+			r = await scope.loader.load(cls, pk)
+			# 同一tick里相同主键的调用共享一次查询结果, 各自返回独立的对象
+			return None if r is None else cls(**r)
+		cache = cls.__cache__
+		if cache is None:
+			r = await cls._findRow(pk)
+		else:
+			r = await cache.get(str(pk))
+			if r is None:
+				# 同一主键的并发未命中只发一次查询
+				task = cls.__loading__.get(pk)
+				if task is None:
+					task = asyncio.ensure_future(cls._loadCached(pk))
+					cls.__loading__[pk] = task
+					def done(t):
+						if cls.__loading__.get(pk) is t:
+							del cls.__loading__[pk]
+					task.add_done_callback(done)
+				r = await asyncio.shield(task)
+		if r is None:
+			return None
+		logging.debug('find: %s', pk)
+		return cls(**r)
+
+	@classmethod
+	async def find_many(cls, pks, chunk_size=500, pool=None):
+		'''
+		find objects by primary keys with 'where pk in (...)', chunked for long lists.
+		returns a list in the order of pks, None for keys not found.
+		'''
+		pks = list(pks)
+		found = dict()
+		cache = None if _tx.get() is not None else cls.__cache__
+		missing = []
+		for pk in dict.fromkeys(pks):
+			r = None if cache is None else await cache.get(str(pk))
+			if r is None:
+				missing.append(pk)
+			else:
+				found[pk] = r
+		# 与find相同, 在__loading__登记正在查询的主键, 查询期间被失效的不回填缓存;
+		# 并发的find等待这里的结果
+		loading = dict()
+		if cache is not None:
+			loop = asyncio.get_event_loop()
+			for pk in missing:
+				if pk not in cls.__loading__:
+					loading[pk] = cls.__loading__[pk] = loop.create_future()
+		try:
+			for i in range(0, len(missing), chunk_size):
+				chunk = missing[i:i + chunk_size]
+				# in列表长度补齐到2的幂, 限制sql形状的数量
+				n = 1
+				while n < len(chunk):
+					n = n * 2
+				n = min(n, chunk_size)
+				sql = _sql_cache.get((cls, 'findMany', n), lambda: '%s where `%s` in (%s)' % (cls.__select__, cls.__primary_key__, create_args_string(n)))
+				rs = await select(sql, chunk + chunk[-1:] * (n - len(chunk)), pool=pool or cls.__pool__)
+				for r in rs:
+					pk = r[cls.__primary_key__]
+					found[pk] = r
+					fut = loading.get(pk, None)
+					if fut is not None and cls.__loading__.get(pk) is fut:
+						await cache.set(str(pk), r)
+		except BaseException as e:
+			for fut in loading.values():
+				if not fut.done():
+					if isinstance(e, Exception):
+						fut.set_exception(e)
+						# 没有并发的find等待时不必报告未取回的异常
+						fut.exception()
+					else:
+						fut.cancel()
+			raise
+		finally:
+			for pk, fut in loading.items():
+				if cls.__loading__.get(pk) is fut:
+					del cls.__loading__[pk]
+				if not fut.done():
+					fut.set_result(found.get(pk, None))
+		logging.debug('find_many: %s of %s', len(found), len(pks))
+		return [cls(**found[pk]) if pk in found else None for pk in pks]
+
+	@classmethod
+	async def invalidate(cls, pk):
+		' drop cached row of primary key. '
+		if cls.__cache__ is not None:
+			cls.__loading__.pop(pk, None)
+			await cls.__cache__.delete(str(pk))
+			# 事务提交前其他请求可能又把旧数据读进缓存, 提交后再失效一次
+			tx = _tx.get()
+			if tx is not None:
+				tx.on_commit(cls.invalidate, pk)
+
+	@classmethod
+	def cache_stats(cls):
+		' hit rate and eviction stats of model cache, None if model has no __cache__. '
+		if cls.__cache__ is None:
+			return None
+		return cls.__cache__.stats()
+
 	async def save(self):
 		args = list(map(self.getValueOrDefault, self.__fields__))
 		args.append(self.getValueOrDefault(self.__primary_key__))
+		if self.__write_behind__ is not None and _tx.get() is None:
+			# 写入缓冲后返回, 计数和监听在真正写入时更新
+			await self.__write_behind__.add(args)
+			return
 		rows = await execute(self.__insert__, args)
+		await self.invalidate(args[-1])
+		row = dict(zip(self.__fields__ + [self.__primary_key__], args))
+		await self._countChanged(row, rows)
+		await self._notify('save', [row])
 		if rows != 1:
 			logging.warn('failed to insert record: affected rows: %s' % rows)
-			
+
+	@classmethod
+	def _insertManySQL(cls, n, upsert):
+		# 多行insert: values (?, ...), (?, ...)，列顺序与__insert__一致
+		escaped_fields = list(map(lambda f: '`%s`' % f, cls.__fields__))
+		row = '(%s)' % create_args_string(len(escaped_fields) + 1)
+		sql = 'insert into `%s` (%s, `%s`) values %s' % (cls.__table__, ', '.join(escaped_fields), cls.__primary_key__, ', '.join([row] * n))
+		if upsert:
+			sql = '%s on duplicate key update %s' % (sql, ', '.join(map(lambda f: '%s=values(%s)' % (f, f), escaped_fields)))
+		return sql
+
+	@classmethod
+	async def _insertChunk(cls, chunk, upsert):
+		n = len(chunk)
+		sql = _sql_cache.get((cls, 'insertMany', n, upsert), lambda: cls._insertManySQL(n, upsert))
+		args = [v for row in chunk for v in row]
+		# 每个chunk在一个事务里提交
+		rows = await execute(sql, args, autocommit=False)
+		if upsert:
+			for row in chunk:
+				await cls.invalidate(row[-1])
+		if _listeners:
+			columns = cls.__fields__ + [cls.__primary_key__]
+			await cls._notify('update' if upsert else 'save', [dict(zip(columns, row)) for row in chunk])
+		return rows
+
+	@classmethod
+	async def _flushRows(cls, chunk, handled):
+		'''
+		multi-row insert of queued write-behind rows. handled gets, in order, True for every
+		row inserted and False for every row dropped because its key exists; on an error the
+		rows not handled yet are missing from it.
+		'''
+		n = len(chunk)
+		sql = _sql_cache.get((cls, 'insertMany', n, False), lambda: cls._insertManySQL(n, False))
+		inserted = []
+		try:
+			try:
+				await execute(sql, [v for row in chunk for v in row], autocommit=False)
+			except Exception as e:
+				if not is_duplicate_key(e):
+					raise
+				# 整批已回滚, 逐行insert, 丢弃主键已存在的行(如重试已提交的批次)
+				for args in chunk:
+					try:
+						await execute(cls.__insert__, args)
+					except Exception as e:
+						if not is_duplicate_key(e):
+							raise
+						logging.warning('write-behind of %s: dropped row with existing key %s' % (cls.__name__, args[-1]))
+						handled.append(False)
+					else:
+						inserted.append(args)
+						handled.append(True)
+			else:
+				inserted = chunk
+				handled.extend([True] * n)
+		finally:
+			# 中途失败时已写入的行同样更新缓存、计数和监听
+			columns = cls.__fields__ + [cls.__primary_key__]
+			rows = [dict(zip(columns, row)) for row in inserted]
+			for row in rows:
+				await cls.invalidate(row[cls.__primary_key__])
+				await cls._countChanged(row, 1)
+			if rows:
+				await cls._notify('save', rows)
+
+	@classmethod
+	async def _writeMany(cls, rows, chunk_size, upsert):
+		total = 0
+		chunk = []
+		for row in rows:
+			if not isinstance(row, cls):
+				row = cls(**row)
+			# 每行都要走getValueOrDefault，next_id、time.time等默认值逐行生成
+			args = list(map(row.getValueOrDefault, cls.__fields__))
+			args.append(row.getValueOrDefault(cls.__primary_key__))
+			chunk.append(args)
+			if len(chunk) >= chunk_size:
+				total += await cls._insertChunk(chunk, upsert)
+				chunk = []
+		if chunk:
+			total += await cls._insertChunk(chunk, upsert)
+		await cls._countChanged(None, None)
+		return total
+
+	@classmethod
+	async def save_many(cls, rows, chunk_size=500):
+		' insert model instances (or dicts) with multi-row insert, returns affected rows. '
+		return await cls._writeMany(rows, chunk_size, False)
+
+	@classmethod
+	async def upsert_many(cls, rows, chunk_size=500):
+		'''
+		insert or update by primary key (on duplicate key update all non-primary fields).
+		note mysql counts 1 affected row per inserted row and 2 per updated row.
+		'''
+		return await cls._writeMany(rows, chunk_size, True)
+
 	async def update(self):
+		# 声明了updated_at的model记录最后修改时间
+		if 'updated_at' in self.__mappings__:
+			self.updated_at = time.time()
 		args = list(map(self.getValue, self.__fields__))
 		args.append(self.getValue(self.__primary_key__))
 		rows = await execute(self.__update__, args)
+		await self.invalidate(args[-1])
+		await self._countChanged(None, 0)
+		await self._notify('update', [self])
 		if rows != 1:
 			logging.warn('failed to update by primary key: affected rows: %s' % rows)
 
 	async def remove(self):
 		args = [self.getValue(self.__primary_key__)]
 		rows = await execute(self.__delete__, args)
+		await self.invalidate(args[0])
+		await self._countChanged(self, -rows)
+		await self._notify('remove', [self])
 		if rows != 1:
 			logging.warn('failed to remove by primary key: affected rows: %s' % rows)
+
+def models():
+	''' every Model subclass defined so far '''
+	result = []
+	todo = list(Model.__subclasses__())
+	while todo:
+		cls = todo.pop(0)
+		result.append(cls)
+		todo.extend(cls.__subclasses__())
+	return result
+
+def configure_cache(backend, **kw):
+	'''
+	recreate the cache of every model declaring __cache__ with another backend, kw (e.g. the
+	redis host and port) added to its __cache__ options. call before serving requests.
+	'''
+	for cls in models():
+		options = cls.__dict__.get('__cache_options__', None)
+		if options is not None:
+			options = dict(options, backend=backend, **kw)
+			cls.__cache__ = create_cache(**options)
+			cls.__loading__ = dict()
+			logging.info('model cache of %s: %s' % (cls.__name__, backend))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Full-page response cache.
+
+Routes opt in through the decorator: @get('/', cache=60), or with a dict
+@get('/', cache=dict(ttl=60, stale=300, vary=['Cookie'])). GET responses of such
+routes are kept in a byte-bounded LRU keyed by method, path, query string and the
+vary headers, and served without calling the view (no orm, no template) while fresh.
+After ttl an entry is still served for `stale` seconds while one background request
+renders a new copy. Every cached response carries ETag and Last-Modified, matching
+If-None-Match / If-Modified-Since requests get 304.
+
+Fragments (parts of a page shared by several views) can be cached on the same store
+with `await PageCache.fragment(key, ttl, build)`.
+'''
+
+import asyncio, collections, hashlib, inspect, logging, time
+from email.utils import formatdate
+from aiohttp import web
+
+# 不随缓存保存的响应头，由服务端按每次响应重新生成
+_SKIP_HEADERS = ('Content-Length', 'Transfer-Encoding', 'Date', 'Server', 'Connection',
+	'ETag', 'Last-Modified', 'Age', 'Cache-Control', 'X-Cache')
+
+class Entry(object):
+	__slots__ = ('status', 'headers', 'body', 'etag', 'last_modified', 'created', 'ttl', 'stale')
+
+	def __init__(self, status, headers, body, ttl, stale):
+		self.status = status
+		self.headers = headers
+		self.body = body
+		self.etag = '"%s"' % hashlib.md5(body).hexdigest()
+		self.created = time.time()
+		# Last-Modified只有秒精度
+		self.last_modified = int(self.created)
+		self.ttl = ttl
+		self.stale = stale
+
+	@property
+	def size(self):
+		return len(self.body) + sum(len(k) + len(v) for k, v in self.headers) + 128
+
+	def age(self, now=None):
+		return (now or time.time()) - self.created
+
+class PageCache(object):
+	'''
+	LRU of rendered responses (and fragments) bounded by total size in bytes.
+	responses larger than max_entry_bytes are never stored.
+	'''
+	def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=1024 * 1024, vary=(), stale=0, **kw):
+		self.max_bytes = max_bytes
+		self.max_entry_bytes = max_entry_bytes
+		self.vary = tuple(vary)
+		self.stale = stale
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.stale_hits = 0
+		self.not_modified = 0
+		self.evictions = 0
+		self._data = collections.OrderedDict()
+		# 正在后台刷新的key => task，同一个key只刷新一次
+		self._refreshing = dict()
+
+	def get(self, key):
+		entry = self._data.get(key, None)
+		if entry is None:
+			return None
+		if entry.age() >= entry.ttl + entry.stale:
+			self.delete(key)
+			return None
+		self._data.move_to_end(key)
+		return entry
+
+	def set(self, key, entry):
+		size = entry.size
+		if size > self.max_entry_bytes:
+			return False
+		self.delete(key)
+		self._data[key] = entry
+		self.bytes += size
+		while self.bytes > self.max_bytes and self._data:
+			k, old = self._data.popitem(last=False)
+			self.bytes -= old.size
+			self.evictions += 1
+		return True
+
+	def delete(self, key):
+		entry = self._data.pop(key, None)
+		if entry is not None:
+			self.bytes -= entry.size
+
+	def invalidate(self, path):
+		''' drop every cached variant of path '''
+		for key in [k for k in self._data if k[1] == path]:
+			self.delete(key)
+
+	def clear(self):
+		self._data.clear()
+		self.bytes = 0
+
+	def stats(self):
+		total = self.hits + self.stale_hits + self.misses
+		return dict(hits=self.hits, stale_hits=self.stale_hits, misses=self.misses,
+			not_modified=self.not_modified, evictions=self.evictions, size=len(self._data),
+			bytes=self.bytes, max_bytes=self.max_bytes,
+			hit_rate=((self.hits + self.stale_hits) / total if total else 0.0))
+
+	async def fragment(self, key, ttl, build):
+		''' return the cached str for key, else build() (a function or coroutine function) and keep it ttl seconds '''
+		key = ('FRAGMENT', key)
+		entry = self.get(key)
+		if entry is not None and entry.age() < entry.ttl:
+			self.hits += 1
+			return entry.body.decode('utf-8')
+		self.misses += 1
+		s = build()
+		if inspect.isawaitable(s):
+			s = await s
+		self.set(key, Entry(200, (), s.encode('utf-8'), ttl, 0))
+		return s
+
+def route_options(request, default_vary=(), default_stale=0):
+	''' cache options of the route matched by request, None if it is not cached '''
+	handler = getattr(request.match_info, 'handler', None)
+	fn = getattr(handler, '_func', None)
+	opts = getattr(fn, '__cache__', None)
+	if not opts:
+		return None
+	if isinstance(opts, (int, float)):
+		opts = dict(ttl=opts)
+	return dict(ttl=opts['ttl'], stale=opts.get('stale', default_stale),
+		vary=tuple(default_vary) + tuple(opts.get('vary', ())))
+
+def make_key(request, vary):
+	return (request.method, request.path, request.query_string) + tuple(request.headers.get(h, '') for h in vary)
+
+def make_entry(resp, opts):
+	''' Entry for a cacheable response, None otherwise '''
+	if type(resp) is not web.Response or resp.prepared or resp.status != 200:
+		return None
+	if resp.cookies or 'Set-Cookie' in resp.headers:
+		return None
+	cc = resp.headers.get('Cache-Control', '')
+	if 'no-store' in cc or 'private' in cc:
+		return None
+	body = resp.body
+	if not isinstance(body, bytes):
+		return None
+	headers = tuple((k, v) for k, v in resp.headers.items() if k not in _SKIP_HEADERS)
+	return Entry(resp.status, headers, body, opts['ttl'], opts['stale'])
+
+def is_not_modified(request, entry):
+	inm = request.headers.get('If-None-Match', None)
+	if inm is not None:
+		# compress_factory给压缩后的响应加上编码后缀，如"<md5>-gzip"
+		for t in inm.split(','):
+			t = t.strip()
+			if t == '*' or t.replace('W/', '').split('-')[0].rstrip('"') + '"' == entry.etag:
+				return True
+		return False
+	ims = request.if_modified_since
+	return ims is not None and entry.last_modified <= ims.timestamp()
+
+def respond(request, entry, state):
+	now = time.time()
+	headers = dict(entry.headers)
+	headers['ETag'] = entry.etag
+	headers['Last-Modified'] = formatdate(entry.last_modified, usegmt=True)
+	headers['Cache-Control'] = 'public, max-age=%d' % max(0, entry.ttl - entry.age(now))
+	headers['Age'] = str(int(entry.age(now)))
+	headers['X-Cache'] = state
+	if is_not_modified(request, entry):
+		for h in ('Content-Type', 'Content-Encoding'):
+			headers.pop(h, None)
+		return web.Response(status=304, headers=headers)
+	return web.Response(status=entry.status, body=entry.body, headers=headers)
+
+async def render(handler, request):
+	# 要求下游中间件返回完整的web.Response，而不是边渲染边发送的StreamResponse
+	request['__buffered__'] = True
+	return await handler(request)
+
+async def refresh(cache, key, handler, request, opts):
+	try:
+		entry = make_entry(await render(handler, request), opts)
+		if entry is not None:
+			cache.set(key, entry)
+		else:
+			cache.delete(key)
+	except Exception as e:
+		logging.exception('refresh %s failed: %s' % (request.path_qs, e))
+	finally:
+		cache._refreshing.pop(key, None)
+
+def init_page_cache(app, **kw):
+	''' create the PageCache used by cache_factory, kw is configs.page_cache '''
+	cache = PageCache(**kw)
+	app['__page_cache__'] = cache
+	return cache
+
+# 页面缓存中间件：放在orm_factory、response_factory之前，命中时不再调用视图函数
+async def cache_factory(app, handler):
+	cache = app.get('__page_cache__', None) or init_page_cache(app)
+	async def page_cache(request):
+		if request.method != 'GET':
+			return await handler(request)
+		opts = route_options(request, cache.vary, cache.stale)
+		if opts is None:
+			return await handler(request)
+		key = make_key(request, opts['vary'])
+		entry = cache.get(key)
+		if entry is not None:
+			if entry.age() < entry.ttl:
+				cache.hits += 1
+				resp = respond(request, entry, 'HIT')
+			else:
+				# 过期但仍在stale窗口内：先返回旧页面，后台重新渲染一次
+				cache.stale_hits += 1
+				if key not in cache._refreshing:
+					cache._refreshing[key] = asyncio.ensure_future(
+						refresh(cache, key, handler, request.clone(), opts))
+				resp = respond(request, entry, 'STALE')
+			if resp.status == 304:
+				cache.not_modified += 1
+			return resp
+		cache.misses += 1
+		resp = await render(handler, request)
+		entry = make_entry(resp, opts)
+		if entry is None or not cache.set(key, entry):
+			return resp
+		resp = respond(request, entry, 'MISS')
+		if resp.status == 304:
+			cache.not_modified += 1
+		return resp
+	return page_cache
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Query analysis. Every statement run through orm.select / orm.execute is timed and
+aggregated by its shape, the sql with literals, placeholders and in-lists folded:
+
+	select `id`, ... from `comments` where `blog_id`=? order by created_at desc
+
+For every shape the aggregate keeps calls, total and max seconds, and rows returned or
+affected. A statement slower than slow_threshold seconds is logged. A select, update or
+delete also gets an EXPLAIN, run in the background at most once per explain_interval.
+The plan gives the rows examined per call. When the plan scans the whole table, sorts
+without an index or groups through a temporary table, the where / group by / order by
+columns that are declared in the model __mappings__ of that table become an index
+suggestion.
+
+Each process keeps its own aggregate. /__queries__ (debug only) returns it, and the
+report command prints it from a running server or from a saved json file:
+
+	python querylog.py http://127.0.0.1:9000
+	python querylog.py queries.json --sort max --limit 10
+'''
+
+import asyncio, logging, re, time
+
+_options = dict(enabled=True, slow_threshold=0.1, explain=True, explain_interval=600, max_shapes=500)
+
+# 规范化后的sql => Shape
+_shapes = dict()
+# 原始sql => 规范化后的sql, sql文本由orm缓存生成, 数量有限
+_normalized = dict()
+
+def configure(enabled=True, slow_threshold=0.1, explain=True, explain_interval=600, max_shapes=500):
+	'''
+	slow_threshold: seconds after which a statement is logged and explained;
+	explain_interval: seconds before the same shape is explained again;
+	max_shapes: shapes kept, the one with the least total time is dropped first.
+	'''
+	_options.update(enabled=enabled, slow_threshold=slow_threshold, explain=explain,
+		explain_interval=explain_interval, max_shapes=max_shapes)
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w`.])-?\d+(?:\.\d+)?\b')
+_IN_RE = re.compile(r'\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.I)
+_VALUES_RE = re.compile(r'\bvalues\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))*', re.I)
+_SPACE_RE = re.compile(r'\s+')
+
+def normalize(sql):
+	''' the shape of a statement: literals and placeholders as ?, in (?, ?, ...) as in (...) '''
+	shape = _normalized.get(sql, None)
+	if shape is not None:
+		return shape
+	shape = sql.replace('%s', '?')
+	shape = _STRING_RE.sub('?', shape)
+	shape = _NUMBER_RE.sub('?', shape)
+	shape = _IN_RE.sub('in (...)', shape)
+	# 多行insert只保留第一组values
+	shape = _VALUES_RE.sub(r'values \1', shape)
+	shape = _SPACE_RE.sub(' ', shape).strip()
+	if len(_normalized) >= 4096:
+		_normalized.clear()
+	_normalized[sql] = shape
+	return shape
+
+_TABLE_RE = re.compile(r'^(?:select\b.*?\bfrom|update|delete\s+from|insert\s+into|replace\s+into)\s+`?(\w+)`?', re.I | re.S)
+
+class Shape(object):
+	__slots__ = ('sql', 'kind', 'table', 'count', 'total', 'max', 'rows', 'slow',
+		'sample', 'explained', 'plan', 'examined', 'advice')
+
+	def __init__(self, sql):
+		self.sql = sql
+		self.kind = sql.split(' ', 1)[0].lower()
+		m = _TABLE_RE.match(sql)
+		self.table = m.group(1) if m else None
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.rows = 0
+		self.slow = 0
+		# 最近一次慢查询的 (sql, args)
+		self.sample = None
+		self.explained = 0.0
+		self.plan = None
+		self.examined = None
+		self.advice = []
+
+	def to_dict(self):
+		return dict(sql=self.sql, table=self.table, count=self.count, total=self.total,
+			mean=self.total / self.count if self.count else 0.0, max=self.max, rows=self.rows,
+			slow=self.slow, examined=self.examined, plan=self.plan, advice=self.advice)
+
+def record(sql, args, duration, rows, pool=None):
+	''' called by orm after every select / execute '''
+	if not _options['enabled']:
+		return
+	key = normalize(sql)
+	s = _shapes.get(key, None)
+	if s is None:
+		if len(_shapes) >= _options['max_shapes']:
+			del _shapes[min(_shapes.values(), key=lambda s: s.total).sql]
+		s = _shapes[key] = Shape(key)
+	s.count += 1
+	s.total += duration
+	s.rows += rows or 0
+	if duration > s.max:
+		s.max = duration
+	if duration < _options['slow_threshold']:
+		return
+	s.slow += 1
+	s.sample = (sql, list(args or ()))
+	now = time.time()
+	if now - s.explained < _options['explain_interval']:
+		logging.debug('slow query %.1fms: %s', duration * 1000, key)
+		return
+	s.explained = now
+	logging.warning('slow query %.1fms: %s', duration * 1000, key)
+	if _options['explain'] and s.kind in ('select', 'update', 'delete'):
+		asyncio.ensure_future(capture(s, sql, args, pool))
+
+async def capture(shape, sql, args, pool=None):
+	''' EXPLAIN the statement and derive index advice for its shape '''
+	import orm
+	try:
+		plan = await orm.explain(sql, args, pool)
+	except Exception as e:
+		logging.warning('explain failed for %s: %s', shape.sql, e)
+		return
+	shape.plan = [dict(r) for r in plan]
+	# 嵌套循环连接近似为各表rows的乘积
+	examined = 1
+	for r in shape.plan:
+		examined *= int(r.get('rows') or 1)
+	shape.examined = examined
+	shape.advice = advise(shape.sql, shape.plan)
+	for a in shape.advice:
+		logging.warning('index advice for %s: %s (%s)', shape.sql, a['ddl'], a['reason'])
+
+_WHERE_RE = re.compile(r'\bwhere\b(?P<where>.*?)(?:\border\s+by\b(?P<order>.*?))?(?:\blimit\b.*)?$', re.I | re.S)
+_ORDER_RE = re.compile(r'\border\s+by\b(?P<order>.*?)(?:\blimit\b.*)?$', re.I | re.S)
+_COND_RE = re.compile(r'`?(\w+)`?\s*(=|<=|>=|<>|!=|<|>|\bin\b|\blike\b|\bbetween\b|\bis\b)', re.I)
+_GROUP_RE = re.compile(r'\bgroup\s+by\b(?P<group>.*?)(?:\bhaving\b.*?)?(?:\border\s+by\b.*?)?(?:\blimit\b.*)?$', re.I | re.S)
+_ORDER_COL_RE = re.compile(r'`?(\w+)`?(?:\s+(?:asc|desc))?\s*(?:,|$)', re.I)
+
+def columns_used(sql):
+	''' (equality columns, range columns, order by columns) of a shape, in order of appearance '''
+	eq, ranged, order = [], [], []
+	m = _WHERE_RE.search(sql)
+	if m is not None:
+		where, order_part = m.group('where'), m.group('order')
+	else:
+		where = ''
+		m = _ORDER_RE.search(sql)
+		order_part = m.group('order') if m else None
+	# group by不属于where条件
+	where = _GROUP_RE.sub('', where)
+	for name, op in _COND_RE.findall(where):
+		target = eq if op.lower() in ('=', 'in', 'is') else ranged
+		if name not in eq and name not in ranged:
+			target.append(name)
+	if order_part:
+		order = [c for c in _ORDER_COL_RE.findall(order_part.strip())]
+	return eq, ranged, order
+
+def columns_grouped(sql):
+	''' group by columns of a shape '''
+	m = _GROUP_RE.search(sql)
+	if m is None:
+		return []
+	return _ORDER_COL_RE.findall(m.group('group').strip())
+
+def advise(sql, plan, tables=None):
+	'''
+	index suggestions for a shape whose plan scans a whole table (type ALL, no key), sorts
+	with a filesort or groups through a temporary table: equality columns first, then one
+	range column, then the group by (or else order by) columns, restricted to indexable
+	columns in the model __mappings__.
+	'''
+	m = _TABLE_RE.match(sql)
+	if m is None or not plan:
+		return []
+	table = m.group(1)
+	rows = [r for r in plan if r.get('table') in (table, None)] or plan[:1]
+	scan = any((r.get('type') or '').upper() == 'ALL' or r.get('key') is None for r in rows)
+	filesort = any('filesort' in (r.get('Extra') or '') for r in rows)
+	temporary = any('temporary' in (r.get('Extra') or '') for r in rows)
+	if not scan and not filesort and not temporary:
+		return []
+	if tables is None:
+		import orm
+		tables = dict((cls.__table__, cls) for cls in orm.models())
+	model = tables.get(table, None)
+	if model is None:
+		return []
+	columns = dict()
+	for k, f in model.__mappings__.items():
+		# text列不能直接建索引
+		if 'text' not in f.column_type and 'blob' not in f.column_type:
+			columns[k] = f.name or k
+	eq, ranged, order = columns_used(sql)
+	if model.__primary_key__ in eq:
+		return []
+	key = [c for c in eq if c in columns]
+	key.extend([c for c in ranged if c in columns][:1])
+	if not ranged:
+		# 按索引顺序读取可以分组或排序, 不需要临时表和filesort
+		group = columns_grouped(sql)
+		key.extend(c for c in (group or order) if c in columns and c not in key)
+	if not key:
+		return []
+	names = [columns[c] for c in key]
+	index = 'idx_%s' % '_'.join(names)
+	reason = 'full scan' if scan else 'filesort' if filesort else 'temporary table'
+	if rows[0].get('rows'):
+		reason = '%s of ~%s rows' % (reason, rows[0]['rows'])
+	return [dict(table=table, columns=names, reason=reason,
+		ddl='alter table `%s` add key `%s` (%s)' % (table, index, ', '.join('`%s`' % c for c in names)))]
+
+def snapshot(sort='total'):
+	''' shapes as dicts, most expensive first '''
+	shapes = sorted(_shapes.values(), key=lambda s: getattr(s, sort), reverse=True)
+	return dict(options=dict(_options), shapes=[s.to_dict() for s in shapes])
+
+def reset():
+	_shapes.clear()
+
+def report(data, sort='total', limit=20):
+	''' text report of a snapshot() '''
+	shapes = sorted(data['shapes'], key=lambda s: s[sort], reverse=True)[:limit]
+	lines = ['%7s %10s %9s %9s %9s %10s  %s' % ('calls', 'total ms', 'mean ms', 'max ms', 'rows/call', 'examined', 'sql')]
+	for s in shapes:
+		lines.append('%7d %10.1f %9.2f %9.2f %9.1f %10s  %s' % (s['count'], s['total'] * 1000, s['mean'] * 1000,
+			s['max'] * 1000, s['rows'] / s['count'] if s['count'] else 0, '' if s['examined'] is None else s['examined'], s['sql']))
+		for r in s['plan'] or ():
+			lines.append('%58s plan: table=%s type=%s key=%s rows=%s %s' % ('', r.get('table'), r.get('type'),
+				r.get('key'), r.get('rows'), r.get('Extra') or ''))
+		for a in s['advice']:
+			lines.append('%58s advice: %s; -- %s' % ('', a['ddl'], a['reason']))
+	advice = set(a['ddl'] for s in data['shapes'] for a in s['advice'])
+	if advice:
+		lines.append('')
+		lines.append('suggested indexes:')
+		lines.extend('\t%s;' % ddl for ddl in sorted(advice))
+	return '\n'.join(lines)
+
+if __name__ == '__main__':
+	import argparse, json, urllib.request
+	parser = argparse.ArgumentParser(description='print the query report of a running server or a saved snapshot')
+	parser.add_argument('source', nargs='?', default='http://127.0.0.1:9000', help='server url or json file')
+	parser.add_argument('--sort', default='total', choices=('total', 'count', 'max', 'mean', 'slow'))
+	parser.add_argument('--limit', type=int, default=20)
+	opts = parser.parse_args()
+	if opts.source.startswith(('http://', 'https://')):
+		with urllib.request.urlopen(opts.source.rstrip('/') + '/__queries__') as resp:
+			data = json.loads(resp.read().decode('utf-8'))
+	else:
+		with open(opts.source) as f:
+			data = json.load(f)
+	print(report(data, opts.sort, opts.limit))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Radix tree router.
+
+RadixRouter is an aiohttp UrlDispatcher that also compiles every route into a prefix
+tree of path segments, so resolving a url costs one dict lookup per segment instead of
+trying the route regexes one after another. Enable it with configs.router.radix.
+
+Segments are literal (/api/blogs), variables (/blog/{id}) or mixed (/feed-{name}.xml).
+Variables may be typed:
+
+	{name}  or {name:str}   one non-empty segment
+	{id:int}                digits
+	{uid:uuid}              a uuid
+	{file:path}             the rest of the path, slashes included
+
+any other {name:regex} matches within one segment, except as the last segment where it
+may span slashes like in aiohttp. Literal segments are tried before variables; urls the
+tree can not answer (404, 405, resources added without add_route) fall back to the
+UrlDispatcher.
+
+Variable segments of one node are tried in registration order, like the UrlDispatcher
+tries its routes; literal paths win over variables in both (aiohttp looks them up by
+path first), so /blog/new goes to the /blog/new view even with /blog/{id} registered
+before it. It is on by default (configs.router.radix); bench/router.py compares it with
+the UrlDispatcher on the routes of this app.
+'''
+
+import collections, logging, re
+from aiohttp import web
+from aiohttp.web_urldispatcher import UrlMappingMatchInfo
+
+TYPES = {
+	'str': r'[^/]+',
+	'int': r'\d+',
+	'uuid': r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}',
+	'path': r'.+'
+}
+
+_VAR_RE = re.compile(r'\{(?P<name>[_a-zA-Z][_a-zA-Z0-9]*)(?::(?P<spec>(?:\{[^}]*\}|[^{}])+))?\}')
+
+def split_path(path):
+	''' split path on '/' outside of {...} '''
+	parts = []
+	depth = 0
+	buf = []
+	for c in path[1:]:
+		if c == '{':
+			depth += 1
+		elif c == '}':
+			depth -= 1
+		if c == '/' and depth == 0:
+			parts.append(''.join(buf))
+			buf = []
+		else:
+			buf.append(c)
+	parts.append(''.join(buf))
+	return parts
+
+def to_aiohttp(path):
+	''' replace typed variables with the regex aiohttp understands '''
+	def repl(m):
+		spec = m.group('spec')
+		if spec in TYPES:
+			return '{%s:%s}' % (m.group('name'), TYPES[spec])
+		return m.group(0)
+	return _VAR_RE.sub(repl, path)
+
+class Matcher(object):
+	'''
+	matches one segment (or the rest of the path for tail matchers) and returns the
+	variables, None if it does not match.
+	'''
+	__slots__ = ('key', 'kind', 'names', 'regex', 'node')
+
+	def __init__(self, key, kind, names, regex):
+		self.key = key
+		self.kind = kind
+		self.names = names
+		self.regex = regex
+		self.node = Node()
+
+	def match(self, s):
+		if self.kind == 'str':
+			return {self.names[0]: s} if s else None
+		if self.kind == 'int':
+			return {self.names[0]: s} if s.isdigit() else None
+		m = self.regex.fullmatch(s)
+		return m.groupdict() if m else None
+
+def compile_segment(segment, last):
+	''' Matcher (without node) for a segment with variables, and whether it is a tail matcher '''
+	names = []
+	pattern = []
+	pos = 0
+	tail = False
+	for m in _VAR_RE.finditer(segment):
+		pattern.append(re.escape(segment[pos:m.start()]))
+		name, spec = m.group('name'), m.group('spec') or 'str'
+		if spec == 'path' or (last and spec not in TYPES):
+			tail = True
+		names.append(name)
+		pattern.append('(?P<%s>%s)' % (name, TYPES.get(spec, spec)))
+		pos = m.end()
+	pattern.append(re.escape(segment[pos:]))
+	if len(names) == 1 and not tail and pattern[0] == '' and pattern[-1] == '':
+		# 整段只有一个str/int变量：不用正则
+		spec = _VAR_RE.fullmatch(segment).group('spec') or 'str'
+		if spec in ('str', 'int'):
+			return Matcher(segment, spec, names, None), False
+	return Matcher(segment, 'regex', names, re.compile(''.join(pattern))), tail
+
+class Node(object):
+	__slots__ = ('static', 'dynamic', 'tails', 'routes')
+
+	def __init__(self):
+		# 字面量段 => Node
+		self.static = dict()
+		# 变量段按注册顺序尝试：int、uuid等更严格的类型应先注册
+		self.dynamic = []
+		# 匹配剩余整个路径的变量
+		self.tails = []
+		# method => route
+		self.routes = dict()
+
+class RadixTree(object):
+
+	def __init__(self):
+		self.root = Node()
+
+	def insert(self, method, path, route):
+		node = self.root
+		parts = split_path(path)
+		for i, segment in enumerate(parts):
+			if '{' not in segment:
+				node = node.static.setdefault(segment, Node())
+				continue
+			matcher, tail = compile_segment(segment, i == len(parts) - 1)
+			if tail and i != len(parts) - 1:
+				raise ValueError('path variable must be the last segment: %s' % path)
+			matchers = node.tails if tail else node.dynamic
+			for m in matchers:
+				if m.key == segment:
+					matcher = m
+					break
+			else:
+				matchers.append(matcher)
+			node = matcher.node
+		if method in node.routes:
+			logging.warn('route %s %s already registered' % (method, path))
+			return
+		node.routes[method] = route
+
+	def lookup(self, path):
+		''' (node, match_dict) of path, (None, None) if not found '''
+		parts = path.split('/')[1:]
+		return self._match(self.root, parts, 0)
+
+	def _match(self, node, parts, i):
+		if i == len(parts):
+			return (node, dict()) if node.routes else (None, None)
+		segment = parts[i]
+		child = node.static.get(segment, None)
+		if child is not None:
+			found, params = self._match(child, parts, i + 1)
+			if found is not None:
+				return found, params
+		for m in node.dynamic:
+			values = m.match(segment)
+			if values is not None:
+				found, params = self._match(m.node, parts, i + 1)
+				if found is not None:
+					params.update(values)
+					return found, params
+		if node.tails:
+			rest = '/'.join(parts[i:])
+			for m in node.tails:
+				values = m.match(rest)
+				if values is not None and m.node.routes:
+					return m.node, values
+		return None, None
+
+class RadixRouter(web.UrlDispatcher):
+	'''
+	UrlDispatcher resolving registered routes through a RadixTree.
+	'''
+	def __init__(self, *args, **kw):
+		super(RadixRouter, self).__init__(*args, **kw)
+		self.tree = RadixTree()
+		self.lookups = 0
+		self.fallbacks = 0
+		self.hits = collections.Counter()
+		self._paths = dict()
+
+	def add_route(self, method, path, handler, **kw):
+		route = super(RadixRouter, self).add_route(method, to_aiohttp(path), handler, **kw)
+		self.tree.insert(method.upper(), path, route)
+		self._paths[route] = path
+		return route
+
+	async def resolve(self, request):
+		self.lookups += 1
+		node, params = self.tree.lookup(request.rel_url.path)
+		if node is not None:
+			route = node.routes.get(request.method, None) or node.routes.get('*', None)
+			if route is not None:
+				self.hits[route] += 1
+				return UrlMappingMatchInfo(params, route)
+		# 静态文件、404、405等交给aiohttp
+		self.fallbacks += 1
+		return await super(RadixRouter, self).resolve(request)
+
+	def describe(self):
+		''' registered routes with their hit counts '''
+		routes = []
+		for route, path in self._paths.items():
+			handler = getattr(route.handler, '_func', route.handler)
+			routes.append(dict(method=route.method, path=path,
+				handler='%s.%s' % (getattr(handler, '__module__', ''), getattr(handler, '__name__', repr(handler))),
+				hits=self.hits[route]))
+		return routes
+
+	def stats(self):
+		return dict(routes=len(self._paths), lookups=self.lookups, tree_hits=sum(self.hits.values()),
+			fallbacks=self.fallbacks)
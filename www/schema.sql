@@ -29,7 +29,9 @@ create table blogs (
 	`summary` varchar(200) not null,
 	`content` mediumtext not null,
 	`created_at` real not null,
+	`updated_at` real not null,
 	key `idx_created_at` (`created_at`),
+	key `idx_updated_at` (`updated_at`),
 	primary key (`id`)
 ) engine=innodb default charset=utf8;
 
@@ -41,6 +43,9 @@ create table comments (
 	`user_image` varchar(500) not null,
 	`content` mediumtext not null,
 	`created_at` real not null,
+	`updated_at` real not null,
+	key `idx_blog_id_created_at` (`blog_id`, `created_at`),
 	key `idx_created_at` (`created_at`),
+	key `idx_updated_at` (`updated_at`),
 	primary key (`id`)
 ) engine=innodb default charset=utf8;
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+In-process full-text search over models that declare the fields to index and their
+weights:
+
+	class Blog(Model):
+		__search__ = {'name': 3, 'summary': 2, 'content': 1}
+
+Text is tokenized into lowercase latin words and CJK bigrams (a single CJK character
+stays a unigram), so Chinese needs no dictionary. Each term has one posting list: an
+array('I') of (doc gap, weighted tf) pairs, doc numbers increasing, so lists only grow at
+the end. Updated and removed rows leave tombstones that are skipped at query time and
+dropped by compact(). Queries are ranked with BM25.
+
+init_search (called by app.create_app) loads each index from its snapshot file, or
+builds it from the table. It then follows changed rows by updated_at (created_at for
+models without it) in the background and saves the snapshot every snapshot_interval
+seconds and on shutdown. Model writes in this process reach the index through
+orm.add_listener. Rows inserted or updated by other worker processes are reindexed with
+the next refresh; rows they remove are dropped from results when search() loads them.
+
+A snapshot is one file: a json header, then the raw arrays. It is loaded with mmap, and
+posting lists stay views of the mapped file until they change, so a worker starts
+without parsing or copying the postings. Workers share the file: a save holds a lock
+and keeps the snapshot on disk if its refresh position is ahead of the worker's.
+'''
+
+import asyncio, heapq, itertools, json, logging, math, mmap, os, re, sys, tempfile, time
+from array import array
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+import orm
+
+_options = dict(enabled=True, path='', refresh_interval=60, snapshot_interval=300, batch_size=500)
+
+# 表名 => Index
+indexes = dict()
+
+# 中日韩文字: 扩展A、基本汉字、兼容汉字、假名、谚文
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af'
+_TOKEN_RE = re.compile(r'[%s]+|[^\W_%s]+' % (_CJK, _CJK))
+_CJK_RE = re.compile(r'[%s]' % _CJK)
+
+def tokenize(text):
+	''' lowercase words, and bigrams of CJK runs '''
+	tokens = []
+	for run in _TOKEN_RE.findall(text.lower()):
+		if _CJK_RE.match(run):
+			if len(run) == 1:
+				tokens.append(run)
+			else:
+				tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+		else:
+			tokens.append(run)
+	return tokens
+
+class Posting(object):
+	''' posting list of one term: data holds (doc gap, tf) pairs, last is the last doc number '''
+	__slots__ = ('data', 'last')
+
+	def __init__(self, data=None, last=0):
+		self.data = array('I') if data is None else data
+		self.last = last
+
+	def append(self, doc, tf):
+		data = self.data
+		if not isinstance(data, array):
+			# 快照里的只读内存视图, 第一次修改时复制
+			data = self.data = array('I', data)
+		data.append(doc - self.last)
+		data.append(tf)
+		self.last = doc
+
+	def decode(self):
+		''' (doc numbers, tfs) '''
+		return itertools.accumulate(self.data[0::2]), self.data[1::2]
+
+class Index(object):
+	'''
+	Inverted index of one model. Doc numbers start at 1; keys[doc] is the primary key,
+	None for tombstones, lengths[doc] the weighted number of tokens.
+	'''
+	MAGIC = b'SRCHIDX1'
+
+	def __init__(self, name, fields, k1=1.2, b=0.75):
+		self.name = name
+		self.fields = fields
+		self.k1 = k1
+		self.b = b
+		self.keys = [None]
+		self.lengths = array('I', [0])
+		self.postings = dict()
+		self.docs = dict()
+		self.total_length = 0
+		# 后台刷新的位置: 已索引的最后一行的 [updated_at或created_at, 主键]
+		self.position = None
+		self.changed = False
+		self._mmap = None
+
+	def __len__(self):
+		return len(self.docs)
+
+	def add(self, key, row):
+		''' index row under key, replacing an earlier version '''
+		self.remove(key)
+		counts = dict()
+		for field, weight in self.fields.items():
+			value = row.get(field, None)
+			if value:
+				for token in tokenize(str(value)):
+					counts[token] = counts.get(token, 0) + weight
+		doc = len(self.keys)
+		self.keys.append(key)
+		length = sum(counts.values())
+		self.lengths.append(length)
+		self.docs[key] = doc
+		self.total_length += length
+		for token, tf in counts.items():
+			posting = self.postings.get(token, None)
+			if posting is None:
+				posting = self.postings[token] = Posting()
+			posting.append(doc, tf)
+		self.changed = True
+
+	def remove(self, key):
+		doc = self.docs.pop(key, None)
+		if doc is None:
+			return False
+		self.keys[doc] = None
+		self.total_length -= self.lengths[doc]
+		self.changed = True
+		return True
+
+	def search(self, query, limit=10):
+		''' [(key, score)] of the best BM25 matches of any query term '''
+		n = len(self.docs)
+		if n == 0:
+			return []
+		avgdl = self.total_length / n or 1.0
+		keys, lengths, k1, b = self.keys, self.lengths, self.k1, self.b
+		scores = dict()
+		for token in dict.fromkeys(tokenize(query)):
+			posting = self.postings.get(token, None)
+			if posting is None:
+				continue
+			docs, tfs = posting.decode()
+			live = [(doc, tf) for doc, tf in zip(docs, tfs) if keys[doc] is not None]
+			if not live:
+				continue
+			df = len(live)
+			idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+			for doc, tf in live:
+				norm = k1 * (1 - b + b * lengths[doc] / avgdl)
+				scores[doc] = scores.get(doc, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+		best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+		return [(keys[doc], score) for doc, score in best]
+
+	def tombstones(self):
+		return len(self.keys) - 1 - len(self.docs)
+
+	def compact(self):
+		''' renumber the live docs and rewrite the posting lists without tombstones '''
+		renumber = array('I', [0]) * len(self.keys)
+		keys, lengths = [None], array('I', [0])
+		for doc, key in enumerate(self.keys):
+			if key is not None:
+				renumber[doc] = len(keys)
+				keys.append(key)
+				lengths.append(self.lengths[doc])
+		postings = dict()
+		for token, posting in self.postings.items():
+			p = Posting()
+			docs, tfs = posting.decode()
+			for doc, tf in zip(docs, tfs):
+				if renumber[doc]:
+					p.append(renumber[doc], tf)
+			if p.data:
+				postings[token] = p
+		self.keys, self.lengths, self.postings = keys, lengths, postings
+		self.docs = dict((key, doc) for doc, key in enumerate(keys) if key is not None)
+		self.changed = True
+		self._close()
+
+	def stats(self):
+		return dict(docs=len(self.docs), tombstones=self.tombstones(), terms=len(self.postings),
+			postings=sum(len(p.data) // 2 for p in self.postings.values()),
+			avgdl=self.total_length / len(self.docs) if self.docs else 0.0,
+			mapped=self._mmap is not None, position=self.position)
+
+	def save(self, path):
+		'''
+		write the snapshot: magic, header length, json header, lengths, posting data.
+		returns False, leaving the file alone, when the snapshot there is further along.
+		'''
+		lock = open(path + '.lock', 'a')
+		try:
+			if fcntl is not None:
+				fcntl.flock(lock, fcntl.LOCK_EX)
+			header = self.header(path)
+			# 其他worker刚保存了刷新得更靠后的快照, 不用本进程较旧的索引覆盖
+			if header is not None and header.get('position') is not None and \
+				(self.position is None or header['position'] > self.position):
+				return False
+			self._write(path)
+			return True
+		finally:
+			lock.close()
+
+	def _write(self, path):
+		if self.tombstones() > len(self.docs) // 4:
+			self.compact()
+		terms = []
+		offset = len(self.lengths) * 4
+		for token, p in self.postings.items():
+			terms.append([token, offset, len(p.data), p.last])
+			offset += len(p.data) * 4
+		header = json.dumps(dict(name=self.name, fields=self.fields, byteorder=sys.byteorder,
+			keys=self.keys, position=self.position, terms=terms), ensure_ascii=False).encode('utf-8')
+		tmp = '%s.%s.tmp' % (path, os.getpid())
+		with open(tmp, 'wb') as f:
+			f.write(self.MAGIC)
+			f.write(len(header).to_bytes(8, 'little'))
+			f.write(header)
+			f.write(self.lengths.tobytes())
+			for p in self.postings.values():
+				f.write(p.data.tobytes() if isinstance(p.data, array) else bytes(p.data))
+		# 读取快照的worker不需要加锁, 原子替换
+		os.replace(tmp, path)
+		self.changed = False
+
+	@classmethod
+	def header(cls, path):
+		''' the json header of a snapshot, None if missing or unreadable '''
+		try:
+			with open(path, 'rb') as f:
+				if f.read(8) != cls.MAGIC:
+					return None
+				size = int.from_bytes(f.read(8), 'little')
+				return json.loads(f.read(size).decode('utf-8'))
+		except (OSError, ValueError):
+			return None
+
+	@classmethod
+	def load(cls, path, fields):
+		''' the index of a snapshot, None if missing, unreadable or indexing other fields '''
+		try:
+			f = open(path, 'rb')
+		except FileNotFoundError:
+			return None
+		with f:
+			try:
+				mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:
+				return None
+		try:
+			if mm[:8] != cls.MAGIC:
+				raise ValueError('bad magic')
+			size = int.from_bytes(mm[8:16], 'little')
+			header = json.loads(mm[16:16 + size].decode('utf-8'))
+			if header['byteorder'] != sys.byteorder or header['fields'] != fields:
+				raise ValueError('snapshot of other fields or byte order')
+		except ValueError as e:
+			logging.warning('ignoring search snapshot %s: %s' % (path, e))
+			mm.close()
+			return None
+		index = cls(header['name'], fields)
+		base = 16 + size
+		view = memoryview(mm)
+		index.keys = header['keys']
+		index.lengths = array('I', view[base:base + len(index.keys) * 4].cast('I'))
+		for token, offset, n, last in header['terms']:
+			start = base + offset
+			index.postings[token] = Posting(view[start:start + n * 4].cast('I'), last)
+		index.docs = dict((key, doc) for doc, key in enumerate(index.keys) if key is not None)
+		index.total_length = sum(index.lengths[doc] for doc in index.docs.values())
+		index.position = header['position']
+		index._mmap = mm
+		return index
+
+	def _close(self):
+		# compact后不再引用快照的内存, 可以关闭映射
+		if self._mmap is not None and all(isinstance(p.data, array) for p in self.postings.values()):
+			self._mmap = None
+
+def snapshot_path(name):
+	return os.path.join(_options['path'] or tempfile.gettempdir(), 'search-%s.idx' % name)
+
+def on_write(cls, action, row):
+	''' orm write listener '''
+	index = indexes.get(cls.__table__, None)
+	if index is None:
+		return
+	key = row[cls.__primary_key__]
+	if action == 'remove':
+		index.remove(key)
+	else:
+		index.add(key, row)
+
+def _refresh_key(cls):
+	for key in ('updated_at', 'created_at'):
+		if key in cls.__mappings__:
+			return key
+	return cls.__primary_key__
+
+async def refresh(cls):
+	''' index the rows changed since the last refresh (all rows on the first run) '''
+	index = indexes[cls.__table__]
+	pk = cls.__primary_key__
+	key = _refresh_key(cls)
+	cursor = None
+	if index.position is not None:
+		values = list(index.position)
+		if key != pk:
+			# 其他进程写入的行可能稍晚才提交, 往回多读一段
+			values = [values[0] - 10, '']
+		cursor = orm.encode_cursor('n', values)
+	count = 0
+	while True:
+		page = await cls.paginate(cursor=cursor, limit=_options['batch_size'], key=key, desc=False, total=False)
+		for item in page.items:
+			# 按updated_at刷新时重新索引修改过的行; 只按created_at时本进程的写入已经由on_write索引过
+			if key == 'updated_at' or item[pk] not in index.docs:
+				index.add(item[pk], item)
+				count += 1
+		if page.items:
+			last = page.items[-1]
+			index.position = [last[pk]] if key == pk else [last[key], last[pk]]
+		if page.next is None or page.next == cursor:
+			break
+		cursor = page.next
+		# 每批之间让出事件循环
+		await asyncio.sleep(0)
+	return count
+
+async def _maintain(models):
+	saved = time.time()
+	while True:
+		await asyncio.sleep(_options['refresh_interval'])
+		for cls in models:
+			try:
+				await refresh(cls)
+			except Exception as e:
+				logging.warning('search refresh of %s failed: %s' % (cls.__name__, e))
+		if time.time() - saved >= _options['snapshot_interval']:
+			save_all()
+			saved = time.time()
+
+def save_all():
+	for name, index in indexes.items():
+		if index.changed:
+			try:
+				index.save(snapshot_path(name))
+			except OSError as e:
+				logging.warning('saving search snapshot %s failed: %s' % (name, e))
+
+async def _start(models):
+	for cls in models:
+		try:
+			n = await refresh(cls)
+		except Exception as e:
+			logging.warning('search indexing of %s failed: %s' % (cls.__name__, e))
+			continue
+		logging.info('search index %s: %s new rows, %s docs' % (cls.__table__, n, len(indexes[cls.__table__])))
+	save_all()
+	await _maintain(models)
+
+async def init_search(app, enabled=True, path='', refresh_interval=60, snapshot_interval=300, batch_size=500):
+	'''
+	create an index for every model with __search__, loaded from its snapshot under path
+	('' for the system temp directory); indexing new rows runs in the background.
+	'''
+	_options.update(enabled=enabled, path=path, refresh_interval=refresh_interval,
+		snapshot_interval=snapshot_interval, batch_size=batch_size)
+	if not enabled:
+		return
+	models = [cls for cls in orm.models() if getattr(cls, '__search__', None)]
+	for cls in models:
+		fields = dict(cls.__search__)
+		index = Index.load(snapshot_path(cls.__table__), fields)
+		if index is None:
+			index = Index(cls.__table__, fields)
+		else:
+			logging.info('search index %s: %s docs from snapshot' % (cls.__table__, len(index)))
+		indexes[cls.__table__] = index
+	if models:
+		orm.add_listener(on_write)
+		task = asyncio.ensure_future(_start(models))
+		async def stop(app):
+			task.cancel()
+			orm.remove_listener(on_write)
+			save_all()
+		app.on_cleanup.append(stop)
+
+async def search(query, models, limit=10):
+	'''
+	[(model instance, score)] of the best matches of query among models, best first.
+	rows found in the index but no longer in the table are dropped from the index.
+	'''
+	hits = []
+	for cls in models:
+		index = indexes.get(cls.__table__, None)
+		if index is not None:
+			hits.extend((score, cls, key) for key, score in index.search(query, limit))
+	hits.sort(key=lambda hit: hit[0], reverse=True)
+	hits = hits[:limit]
+	results = []
+	for cls in models:
+		keys = [key for score, c, key in hits if c is cls]
+		if keys:
+			found = dict(zip(keys, await cls.find_many(keys)))
+			for key, item in found.items():
+				if item is None:
+					indexes[cls.__table__].remove(key)
+			results.extend((found[key], score) for score, c, key in hits if c is cls and found[key] is not None)
+	results.sort(key=lambda r: r[1], reverse=True)
+	return results
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+JSON serialization of view results, straight to utf-8 bytes.
+
+Uses orjson or ujson when installed, falls back to the json module. Model rows (dict),
+compact orm rows, datetimes, Decimal and sets are encoded natively; more types can be
+added with register_encoder().
+'''
+
+import json, logging
+from datetime import date, datetime, time
+from decimal import Decimal
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+try:
+	import ujson
+except ImportError:
+	ujson = None
+
+_encoders = dict()
+
+def register_encoder(cls, fn):
+	''' encode instances of cls (and subclasses) as fn(obj) '''
+	_encoders[cls] = fn
+
+register_encoder(datetime, lambda obj: obj.isoformat())
+register_encoder(date, lambda obj: obj.isoformat())
+register_encoder(time, lambda obj: obj.isoformat())
+register_encoder(Decimal, float)
+register_encoder(set, list)
+register_encoder(frozenset, list)
+register_encoder(bytes, lambda obj: obj.decode('utf-8'))
+
+def default(obj):
+	for cls in type(obj).__mro__:
+		fn = _encoders.get(cls, None)
+		if fn is not None:
+			return fn(obj)
+	# orm.Row等紧凑行对象
+	if hasattr(obj, '_asdict'):
+		return obj._asdict()
+	# 兼容旧的行为：其他对象按属性序列化
+	if hasattr(obj, '__dict__'):
+		return obj.__dict__
+	raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+def _orjson_dumps(obj):
+	return orjson.dumps(obj, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+def _ujson_dumps(obj):
+	return ujson.dumps(obj, ensure_ascii=False, default=default).encode('utf-8')
+
+def _json_dumps(obj):
+	return json.dumps(obj, ensure_ascii=False, default=default).encode('utf-8')
+
+backends = dict(json=_json_dumps)
+if ujson is not None:
+	backends['ujson'] = _ujson_dumps
+if orjson is not None:
+	backends['orjson'] = _orjson_dumps
+
+# 当前使用的编码函数和流式输出的阈值
+dumps = backends.get('orjson', None) or backends.get('ujson', None) or _json_dumps
+_options = dict(stream_threshold=5000, chunk_size=1000)
+
+def configure(backend='auto', stream_threshold=5000, chunk_size=1000):
+	'''
+	backend: 'auto' (orjson > ujson > json), 'orjson', 'ujson' or 'json'.
+	lists longer than stream_threshold are written chunk_size items at a time by iter_dumps.
+	'''
+	global dumps
+	if backend == 'auto':
+		dumps = backends.get('orjson', None) or backends.get('ujson', None) or _json_dumps
+	else:
+		try:
+			dumps = backends[backend]
+		except KeyError:
+			raise ValueError('JSON backend not available: %s' % backend)
+	_options['stream_threshold'] = stream_threshold
+	_options['chunk_size'] = chunk_size
+	logging.info('json backend: %s' % dumps.__name__)
+
+def should_stream(obj):
+	''' True if obj (a dict or list) holds a list longer than stream_threshold '''
+	threshold = _options['stream_threshold']
+	if isinstance(obj, (list, tuple)):
+		return len(obj) > threshold
+	if isinstance(obj, dict):
+		for v in obj.values():
+			if isinstance(v, (list, tuple)) and len(v) > threshold:
+				return True
+	return False
+
+def _iter_list(items):
+	chunk_size = _options['chunk_size']
+	yield b'['
+	for i in range(0, len(items), chunk_size):
+		part = dumps(list(items[i:i + chunk_size]))
+		# 去掉每段的方括号后用逗号拼接
+		yield part[1:-1] if i == 0 else b',' + part[1:-1]
+	yield b']'
+
+def iter_dumps(obj):
+	'''
+	yield the json of obj as a sequence of bytes chunks. long lists (top level, or values
+	of a top level dict) are encoded chunk_size items at a time, so a large payload never
+	has to exist as one string.
+	'''
+	if isinstance(obj, (list, tuple)):
+		for chunk in _iter_list(obj):
+			yield chunk
+		return
+	if not isinstance(obj, dict):
+		yield dumps(obj)
+		return
+	threshold = _options['stream_threshold']
+	yield b'{'
+	first = True
+	for k, v in obj.items():
+		key = dumps(str(k)) + b':'
+		if not first:
+			key = b',' + key
+		first = False
+		if isinstance(v, (list, tuple)) and len(v) > threshold:
+			yield key
+			for chunk in _iter_list(v):
+				yield chunk
+		else:
+			yield key + dumps(v)
+	yield b'}'
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Multi-process server, run from www:
+
+	python server.py
+
+The master process forks configs.server.workers workers (0: one per cpu core). Each
+worker imports app.py after the fork, so it has its own event loop and orm pool, and
+serves the port either through the socket bound by the master or, with reuse_port,
+through its own SO_REUSEPORT socket.
+
+Signals to the master:
+
+	SIGHUP            rolling reload: reload configs, start a new worker, wait until it
+	                  serves, stop one old worker; repeat for every worker
+	SIGTERM / SIGINT  graceful stop: workers finish the requests in flight
+
+Workers that exit unexpectedly are restarted, with a growing delay if they keep crashing.
+'''
+
+import logging; logging.basicConfig(level=logging.INFO)
+import asyncio, os, select, signal, socket, sys, time
+
+import config
+
+def load_configs():
+	''' configs read again from config_default.py / config_override.py '''
+	for name in ('config', 'config_default', 'config_override'):
+		sys.modules.pop(name, None)
+	global config
+	import config
+	return config.configs
+
+def bind_socket(host, port, backlog, reuse_port=False):
+	sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	if reuse_port:
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+	sock.bind((host, port))
+	sock.listen(backlog)
+	sock.set_inheritable(True)
+	return sock
+
+def use_uvloop():
+	try:
+		import uvloop
+	except ImportError:
+		return False
+	asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+	return True
+
+def run_worker(sock, ready_fd):
+	''' body of a worker process, never returns '''
+	for sig in (signal.SIGINT, signal.SIGHUP):
+		# Ctrl-C和重载由master统一处理
+		signal.signal(sig, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+	code = 0
+	try:
+		configs = load_configs()
+		opts = configs.server
+		if opts.uvloop and use_uvloop():
+			logging.info('worker %s: using uvloop' % os.getpid())
+		if sock is None:
+			sock = bind_socket(opts.host, opts.port, opts.backlog, reuse_port=True)
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		loop.run_until_complete(serve(loop, sock, ready_fd, opts.shutdown_timeout, opts.workers or os.cpu_count() or 1))
+	except Exception as e:
+		logging.exception('worker %s failed: %s' % (os.getpid(), e))
+		code = 1
+	finally:
+		logging.shutdown()
+		os._exit(code)
+
+async def serve(loop, sock, ready_fd, shutdown_timeout, workers):
+	# 在fork之后导入，重载时新worker使用磁盘上的最新代码
+	import app as app_module
+	import executor, orm
+	app = await app_module.create_app(loop, workers)
+	handler = app.make_handler()
+	srv = await loop.create_server(handler, sock=sock)
+	stopping = asyncio.Event()
+	loop.add_signal_handler(signal.SIGTERM, stopping.set)
+	logging.info('worker %s serving' % os.getpid())
+	os.write(ready_fd, b'1')
+	os.close(ready_fd)
+	await stopping.wait()
+	logging.info('worker %s stopping' % os.getpid())
+	# 停止接受新连接，等待进行中的请求完成
+	srv.close()
+	await srv.wait_closed()
+	await handler.shutdown(shutdown_timeout)
+	await app.cleanup()
+	executor.shutdown()
+	await orm.close_pool()
+
+class Master(object):
+	'''
+	Forks and supervises the workers.
+	'''
+	def __init__(self, configs):
+		self.configs = configs
+		self.sock = None
+		# pid => 启动时间
+		self.workers = dict()
+		# 正在被停止的worker，退出时不重启
+		self.retiring = set()
+		self.crashes = 0
+		self.running = True
+		self.reload_requested = False
+
+	def worker_count(self):
+		return self.configs.server.workers or os.cpu_count() or 1
+
+	def spawn(self):
+		''' fork a worker; returns (pid, fd that becomes readable when it serves) '''
+		r, w = os.pipe()
+		pid = os.fork()
+		if pid == 0:
+			os.close(r)
+			run_worker(self.sock, w)
+		os.close(w)
+		self.workers[pid] = time.time()
+		logging.info('started worker %s' % pid)
+		return pid, r
+
+	def wait_ready(self, pid, fd, timeout=30):
+		try:
+			readable, _, _ = select.select([fd], [], [], timeout)
+			return bool(readable) and os.read(fd, 1) == b'1'
+		finally:
+			os.close(fd)
+
+	def stop_worker(self, pid, timeout=None):
+		''' SIGTERM pid and wait for it, SIGKILL after shutdown_timeout + 5 seconds '''
+		timeout = timeout or self.configs.server.shutdown_timeout + 5
+		self.retiring.add(pid)
+		try:
+			os.kill(pid, signal.SIGTERM)
+		except ProcessLookupError:
+			pass
+		deadline = time.time() + timeout
+		while pid in self.workers and time.time() < deadline:
+			self.reap()
+			time.sleep(0.05)
+		if pid in self.workers:
+			logging.warn('worker %s did not stop in %ss, killing' % (pid, timeout))
+			os.kill(pid, signal.SIGKILL)
+			os.waitpid(pid, 0)
+			self.workers.pop(pid, None)
+			self.retiring.discard(pid)
+
+	def reap(self):
+		''' collect exited workers, restart the ones that were not stopped on purpose '''
+		while True:
+			try:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+			except ChildProcessError:
+				return
+			if pid == 0:
+				return
+			started = self.workers.pop(pid, None)
+			if started is None:
+				continue
+			if pid in self.retiring:
+				self.retiring.discard(pid)
+				logging.info('worker %s stopped' % pid)
+				continue
+			logging.warn('worker %s exited unexpectedly (status %s)' % (pid, status))
+			if not self.running:
+				continue
+			# 启动后很快退出的worker逐渐延长重启间隔，避免空转
+			self.crashes = self.crashes + 1 if time.time() - started < 5 else 0
+			if self.crashes:
+				time.sleep(min(0.5 * 2 ** self.crashes, 30))
+			pid, fd = self.spawn()
+			self.wait_ready(pid, fd)
+
+	def reload(self):
+		''' rolling reload: one new worker up, then one old worker down '''
+		self.configs = load_configs()
+		logging.info('reloading %s workers' % len(self.workers))
+		old = list(self.workers)
+		target = self.worker_count()
+		for i in range(max(target, len(old))):
+			if i < target:
+				pid, fd = self.spawn()
+				if not self.wait_ready(pid, fd):
+					logging.error('new worker %s failed to start, keeping the old workers' % pid)
+					self.stop_worker(pid)
+					return
+			if i < len(old):
+				self.stop_worker(old[i])
+		logging.info('reload done')
+
+	def stop(self):
+		logging.info('stopping %s workers' % len(self.workers))
+		pids = list(self.workers)
+		self.retiring.update(pids)
+		for pid in pids:
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+		for pid in pids:
+			self.stop_worker(pid)
+
+	def run(self):
+		opts = self.configs.server
+		if not opts.reuse_port:
+			self.sock = bind_socket(opts.host, opts.port, opts.backlog)
+		def on_stop(sig, frame):
+			self.running = False
+		def on_reload(sig, frame):
+			self.reload_requested = True
+		signal.signal(signal.SIGTERM, on_stop)
+		signal.signal(signal.SIGINT, on_stop)
+		signal.signal(signal.SIGHUP, on_reload)
+		for i in range(self.worker_count()):
+			pid, fd = self.spawn()
+			self.wait_ready(pid, fd)
+		logging.info('master %s: %s workers at http://%s:%s' % (os.getpid(), len(self.workers), opts.host, opts.port))
+		while self.running:
+			if self.reload_requested:
+				self.reload_requested = False
+				self.reload()
+			self.reap()
+			time.sleep(0.2)
+		self.stop()
+		if self.sock is not None:
+			self.sock.close()
+
+if __name__ == '__main__':
+	Master(config.configs).run()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Static files under www/static.
+
+At startup every file is hashed and gets a fingerprinted url, css/site.css =>
+/static/css/site.3f2a9c1b0d.css. Templates build urls with the `static_url` global or
+the `static` filter: {{ static_url('css/site.css') }}, {{ 'css/site.css'|static }}.
+Fingerprinted urls never change content, they are sent with a one year immutable
+Cache-Control; plain urls keep working and are revalidated with ETag/Last-Modified.
+
+Small files are kept in a memory cache bounded by total bytes, large ones are sent with
+FileResponse (sendfile). The .br/.gz files written by `python compress.py` are sent to
+clients accepting them, except for Range requests: those get 206 partial content of the
+original file.
+'''
+
+import asyncio, collections, hashlib, logging, mimetypes, os, stat
+from email.utils import formatdate
+from aiohttp import web
+
+from compress import choose_encoding, encoders, extensions, is_compressible, strip_encoding
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+def fingerprint(path, size=10):
+	md5 = hashlib.md5()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(65536), b''):
+			md5.update(block)
+	return md5.hexdigest()[:size]
+
+def fingerprinted_name(name, digest):
+	base, ext = os.path.splitext(name)
+	return '%s.%s%s' % (base, digest, ext)
+
+def _read(path):
+	with open(path, 'rb') as f:
+		return f.read()
+
+class FileResponse(web.FileResponse):
+	'''
+	FileResponse sending exactly the file it was given. aiohttp's picks a .br/.gz sibling
+	by the Accept-Encoding of the request on its own, also for Range requests; here
+	StaticFiles.handle chooses the variant and sets Content-Encoding itself.
+	'''
+	def _get_file_path_stat_encoding(self, accept_encoding):
+		st = self._path.stat()
+		return self._path if stat.S_ISREG(st.st_mode) else None, st, None
+
+class StaticFiles(object):
+	'''
+	root: static directory, prefix: url prefix.
+	files up to memory_file_max bytes are cached in memory, memory_max_bytes in total.
+	'''
+	def __init__(self, root, prefix='/static/', memory_max_bytes=16 * 1024 * 1024, memory_file_max=256 * 1024, **kw):
+		self.root = os.path.abspath(root)
+		self.prefix = prefix
+		self.memory_max_bytes = memory_max_bytes
+		self.memory_file_max = memory_file_max
+		# 逻辑路径 => 带指纹的路径，及其反向映射
+		self.manifest = dict()
+		self._reverse = dict()
+		# (文件路径, 编码) => (mtime, body)
+		self._memory = collections.OrderedDict()
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def scan(self):
+		''' fingerprint every file under root, returns the manifest '''
+		manifest = dict()
+		for dirpath, dirnames, filenames in os.walk(self.root):
+			for name in filenames:
+				path = os.path.join(dirpath, name)
+				# 预压缩文件跟随原文件
+				base, ext = os.path.splitext(path)
+				if ext in extensions.values() and os.path.exists(base):
+					continue
+				rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+				manifest[rel] = fingerprinted_name(rel, fingerprint(path))
+		self.manifest = manifest
+		self._reverse = dict((v, k) for k, v in manifest.items())
+		self._memory.clear()
+		self.bytes = 0
+		logging.info('fingerprinted %s static files' % len(manifest))
+		return manifest
+
+	def url(self, name):
+		''' url of static file name (relative to root), fingerprinted when known '''
+		name = name.lstrip('/')
+		return self.prefix + self.manifest.get(name, name)
+
+	def resolve(self, filename):
+		''' (path on disk, immutable) for a request filename, path None if not found '''
+		name = self._reverse.get(filename, None)
+		immutable = name is not None
+		path = os.path.abspath(os.path.join(self.root, name or filename))
+		if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+			return None, False
+		return path, immutable
+
+	def stats(self):
+		total = self.hits + self.misses
+		return dict(files=len(self.manifest), cached=len(self._memory), bytes=self.bytes,
+			max_bytes=self.memory_max_bytes, hits=self.hits, misses=self.misses,
+			evictions=self.evictions, hit_rate=(self.hits / total if total else 0.0))
+
+	async def _load(self, path, encoding, st):
+		key = (path, encoding)
+		item = self._memory.get(key, None)
+		if item is not None and item[0] == st.st_mtime:
+			self._memory.move_to_end(key)
+			self.hits += 1
+			return item[1]
+		self.misses += 1
+		body = await asyncio.get_event_loop().run_in_executor(None, _read, path)
+		if item is not None:
+			self.bytes -= len(item[1])
+		self._memory[key] = (st.st_mtime, body)
+		self.bytes += len(body)
+		while self.bytes > self.memory_max_bytes and self._memory:
+			k, (mtime, old) = self._memory.popitem(last=False)
+			self.bytes -= len(old)
+			self.evictions += 1
+		return body
+
+	async def handle(self, request):
+		path, immutable = self.resolve(request.match_info['filename'])
+		if path is None:
+			raise web.HTTPNotFound()
+		content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+		if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+			content_type += '; charset=utf-8'
+		headers = {'Content-Type': content_type, 'Cache-Control': IMMUTABLE if immutable else REVALIDATE}
+		available = [e for e in encoders if os.path.exists(path + extensions[e])]
+		if is_compressible(content_type) or available:
+			headers['Vary'] = 'Accept-Encoding'
+		st = os.stat(path)
+		# Range按原始字节计算，不返回压缩版本(大文件也一样，见FileResponse)
+		if 'Range' not in request.headers:
+			encoding = choose_encoding(request.headers.get('Accept-Encoding', ''), available)
+			if encoding is not None:
+				variant = os.stat(path + extensions[encoding])
+				if variant.st_mtime >= st.st_mtime:
+					path, st = path + extensions[encoding], variant
+					headers['Content-Encoding'] = encoding
+		if st.st_size > self.memory_file_max:
+			# 大文件交给FileResponse：sendfile零拷贝，自带Range和条件请求处理
+			return FileResponse(path, headers=headers)
+		etag = '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+		headers['ETag'] = etag
+		headers['Last-Modified'] = formatdate(st.st_mtime, usegmt=True)
+		inm = request.headers.get('If-None-Match', None)
+		ims = request.if_modified_since
+		# compress_factory压缩未预压缩的文件时给ETag加上编码后缀
+		if (inm is not None and (inm.strip() == '*' or etag in [strip_encoding(t.strip()) for t in inm.split(',')])) or \
+			(inm is None and ims is not None and int(st.st_mtime) <= ims.timestamp()):
+			headers.pop('Content-Type')
+			return web.Response(status=304, headers=headers)
+		body = await self._load(path, headers.get('Content-Encoding', None), st)
+		headers['Accept-Ranges'] = 'bytes'
+		if 'Range' in request.headers:
+			return self._range(request, body, headers)
+		return web.Response(body=body, headers=headers)
+
+	def _range(self, request, body, headers):
+		size = len(body)
+		try:
+			rng = request.http_range
+			start, stop = rng.start, rng.stop
+		except ValueError:
+			start = stop = None
+			rng = None
+		if rng is None or rng.step not in (None, 1):
+			raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': 'bytes */%d' % size})
+		if start is None and stop is None:
+			return web.Response(body=body, headers=headers)
+		if start is None:
+			start = 0
+		elif start < 0:
+			# bytes=-N：最后N个字节
+			start, stop = max(0, size + start), size
+		stop = size if stop is None else min(stop, size)
+		if start >= size or start >= stop:
+			raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': 'bytes */%d' % size})
+		headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, size)
+		return web.Response(status=206, body=body[start:stop], headers=headers)
+
+def init_static(app, path, prefix='/static/', **kw):
+	''' fingerprint path, register the handler under prefix and the jinja helpers '''
+	files = StaticFiles(path, prefix, **kw)
+	files.scan()
+	app.router.add_route('GET', prefix + '{filename:.+}', files.handle)
+	app['__static__'] = files
+	env = app.get('__template__', None)
+	if env is not None:
+		env.globals['static_url'] = files.url
+		env.filters['static'] = files.url
+	return files
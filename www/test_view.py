@@ -6,7 +6,11 @@ from coroweb import get
 import asyncio
 from aiohttp import web
 
-@get('/')
+import search
+from apis import APIValueError
+from models import Blog, Comment
+
+@get('/', cache=60)
 async def index(request):
 	logging.info('index(request) ...')
 	# resp = web.Response(body=u'<h1>Test index</h1>'.encode('utf-8'))
@@ -24,4 +28,17 @@ async def index(request):
 @get('/hello/{name}')
 async def hello(name, request):
 	logging.info('hello(request) ... %s ' % name)
-	return '<h1>hello %s!</h1>' % name
\ No newline at end of file
+	return '<h1>hello %s!</h1>' % name
+
+@get('/api/search')
+async def api_search(*, q='', type='', limit: int = 10):
+	''' full-text search of blogs and comments, ?type=blog or comment searches one of them '''
+	kinds = dict(blog=Blog, comment=Comment)
+	if not q.strip():
+		raise APIValueError('q', 'query is empty')
+	if type and type not in kinds:
+		raise APIValueError('type', 'type must be blog or comment')
+	models = [kinds[type]] if type else list(kinds.values())
+	results = await search.search(q, models, min(max(limit, 1), 50))
+	names = dict((cls, name) for name, cls in kinds.items())
+	return dict(q=q, results=[dict(type=names[item.__class__], score=round(score, 4), item=item) for item, score in results])
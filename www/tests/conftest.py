@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+'''
+orm tests against bench/fakedb.py, no mysql needed. Run from www:
+
+	python -m pytest
+'''
+
+import asyncio, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import orm
+from bench import fakedb
+
+@pytest.fixture
+def db(monkeypatch):
+	''' fakedb in place of aiomysql; returns the list of (sql, args) it executed '''
+	statements = []
+	respond = fakedb.respond
+	def recording(sql, args, as_dict):
+		statements.append((sql, list(args or ())))
+		return respond(sql, args, as_dict)
+	monkeypatch.setattr(orm, 'aiomysql', fakedb)
+	monkeypatch.setattr(fakedb, 'respond', recording)
+	fakedb.configure(latency=0, rows=20, table_rows=10000)
+	orm._counts.clear()
+	yield statements
+	orm._counts.clear()
+	for buffer in list(orm._write_behind):
+		orm._write_behind.remove(buffer)
+		buffer.model.__write_behind__ = None
+
+@pytest.fixture
+def run(db):
+	''' run(fn): await fn() with the orm pool open, like a request '''
+	def run(fn, **kw):
+		async def main():
+			await orm.create_pool(None, user='www-data', password='www-data', db='awesome', **kw)
+			try:
+				return await fn()
+			finally:
+				await orm.close_pool()
+		return asyncio.run(main())
+	return run
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from coroweb import get, make_binder, RequestHandler
+
+@get('/api/items')
+async def items(*, page: int = 1, ratio: float = 1.0, draft: bool = False, q=''):
+	return dict(page=page, ratio=ratio, draft=draft, q=q)
+
+@get('/blog/{id}')
+async def blog(id: int):
+	return dict(id=id)
+
+def bind(fn, path, match_info={}):
+	request = make_mocked_request('GET', path, match_info=match_info)
+	return asyncio.run(make_binder(fn, 'GET')(request))
+
+@pytest.mark.parametrize('query, expected', [
+	('', {}),
+	('page=2', {'page': 2}),
+	('ratio=0.5', {'ratio': 0.5}),
+	('page=3&ratio=2&q=py', {'page': 3, 'ratio': 2.0, 'q': 'py'}),
+	# 没有注解的参数保持字符串
+	('q=7', {'q': '7'}),
+])
+def test_int_and_float_coercion(query, expected):
+	assert bind(items, '/api/items?' + query) == expected
+
+@pytest.mark.parametrize('value, expected', [
+	('1', True), ('true', True), ('Yes', True), ('on', True),
+	('', False), ('0', False), ('false', False), ('no', False), ('OFF', False),
+])
+def test_bool_coercion(value, expected):
+	assert bind(items, '/api/items?draft=' + value) == {'draft': expected}
+
+def test_path_args_are_coerced():
+	assert bind(blog, '/blog/42', {'id': '42'}) == {'id': 42}
+
+@pytest.mark.parametrize('query, name', [
+	('page=two', 'page'),
+	('page=1.5', 'page'),
+	('ratio=x', 'ratio'),
+	('draft=maybe', 'draft'),
+])
+def test_invalid_argument_is_a_bad_request(query, name):
+	with pytest.raises(web.HTTPBadRequest) as e:
+		bind(items, '/api/items?' + query)
+	assert e.value.text == 'Invalid argument: %s ' % name
+
+def test_handler_returns_400_for_invalid_argument():
+	handler = RequestHandler(None, blog)
+	request = make_mocked_request('GET', '/blog/x', match_info={'id': 'x'})
+	r = asyncio.run(handler(request))
+	assert isinstance(r, web.HTTPBadRequest) and r.status == 400
+	assert r.text == 'Invalid argument: id '
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import orm
+from models import Blog
+
+def blog(**kw):
+	return dict(dict(user_id='u', user_name='n', user_image='i', name='b', summary='s', content='c'), **kw)
+
+def inserts(db):
+	return [(sql, args) for sql, args in db if sql.startswith('insert')]
+
+def test_save_many_in_chunks(run, db):
+	rows = run(lambda: Blog.save_many([blog() for i in range(5)], chunk_size=2))
+	assert rows == 5
+	statements = inserts(db)
+	assert [sql.count('(%s') for sql, args in statements] == [2, 2, 1]
+	assert all('on duplicate key' not in sql for sql, args in statements)
+	# 主键等默认值逐行生成
+	ids = [args[i] for sql, args in statements for i in range(len(Blog.__fields__), len(args), len(Blog.__fields__) + 1)]
+	assert len(set(ids)) == 5
+
+def test_save_many_accepts_instances(run, db):
+	assert run(lambda: Blog.save_many([Blog(id='b1', **blog()), blog(id='b2')])) == 2
+	(sql, args), = inserts(db)
+	assert args[len(Blog.__fields__)] == 'b1' and args[-1] == 'b2'
+
+def test_upsert_many_invalidates_cache(run, db):
+	async def main():
+		await Blog.__cache__.set('b1', dict(id='b1', name='old'))
+		await Blog.upsert_many([blog(id='b1', name='new')])
+		return await Blog.__cache__.get('b1')
+	assert run(main) is None
+	(sql, args), = inserts(db)
+	assert 'on duplicate key update' in sql and '`name`=values(`name`)' in sql
+
+def test_bulk_writes_drop_cached_counts(run, db):
+	async def main():
+		await Blog.count()
+		await Blog.save_many([blog()])
+		await Blog.count()
+	run(main, count_estimate_above=0)
+	# 不知道插入了哪些行, 计数重新查询
+	assert len([sql for sql, args in db if 'count(' in sql]) == 2
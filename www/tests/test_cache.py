@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, socket, time
+
+import pytest
+
+import cache
+from bench import fakedb
+from models import User
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+	User.__cache__._data.clear()
+	User.__loading__.clear()
+
+def test_find_many_fills_cache(run, db):
+	async def main():
+		await User.find_many(['u1', 'u2'])
+		return [await User.__cache__.get(k) for k in ('u1', 'u2')]
+	assert [r['id'] for r in run(main)] == ['u1', 'u2']
+
+def test_find_many_skips_rows_invalidated_while_loading(run, db):
+	fakedb.configure(latency=0.02)
+	async def main():
+		task = asyncio.ensure_future(User.find_many(['u1', 'u2']))
+		await asyncio.sleep(0.005)
+		# 并发的find等待find_many的结果, 不再查询
+		found = asyncio.ensure_future(User.find('u2'))
+		await User.invalidate('u1')
+		users = await task
+		return [u.id for u in users], (await found).id, await User.__cache__.get('u1'), await User.__cache__.get('u2')
+	ids, found, u1, u2 = run(main)
+	assert ids == ['u1', 'u2'] and found == 'u2'
+	assert u1 is None and u2['id'] == 'u2'
+	assert len(db) == 1 and User.__loading__ == {}
+
+def user(id):
+	return User(id=id, email='e', passwd='p', admin=False, name='n', image='i')
+
+def test_concurrent_finds_share_one_query(run, db):
+	fakedb.configure(latency=0.01)
+	async def main():
+		users = await asyncio.gather(*[User.find('u1') for i in range(5)])
+		# 各自返回独立的对象
+		assert len(set(map(id, users))) == 5
+		await User.find('u1')
+		return [u.id for u in users]
+	assert run(main) == ['u1'] * 5
+	assert len(db) == 1 and User.__loading__ == {}
+
+@pytest.mark.parametrize('write', ['save', 'update', 'remove'])
+def test_writes_invalidate(run, db, write):
+	async def main():
+		await User.find('u1')
+		assert await User.__cache__.get('u1') is not None
+		await getattr(user('u1'), write)()
+		return await User.__cache__.get('u1')
+	assert run(main) is None
+
+def test_memory_cache_ttl(monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+	c = cache.MemoryCache(maxsize=10, ttl=60)
+	async def main():
+		await c.set('a', 1)
+		await c.set('b', 2, ttl=5)
+		now[0] += 10
+		return await c.get('a'), await c.get('b')
+	assert asyncio.run(main()) == (1, None)
+	assert c.stats()['hits'] == 1 and c.stats()['misses'] == 1 and c.stats()['size'] == 1
+
+def test_memory_cache_maxsize_evicts_least_recently_used():
+	c = cache.MemoryCache(maxsize=2, ttl=60)
+	async def main():
+		await c.set('a', 1)
+		await c.set('b', 2)
+		await c.get('a')
+		await c.set('c', 3)
+		return [await c.get(k) for k in 'abc']
+	assert asyncio.run(main()) == [1, None, 3]
+	assert c.stats()['evictions'] == 1 and c.stats()['size'] == 2
+
+def free_port():
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+def test_redis_backs_off_when_unreachable(monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+	c = cache.RedisCache(port=free_port(), retry_delay=1.0, max_retry_delay=4.0)
+	connects = []
+	open_connection = asyncio.open_connection
+	async def counting(*args, **kw):
+		connects.append(args)
+		return await open_connection(*args, **kw)
+	monkeypatch.setattr(asyncio, 'open_connection', counting)
+	async def main():
+		with pytest.raises(ConnectionError):
+			await c.check()
+		assert await c.get('a') is None and len(connects) == 2
+		# 重试之前不再连接
+		assert await c.get('a') is None and len(connects) == 2
+		now[0] += 1.5
+		await c.get('a')
+		assert len(connects) == 3 and c._retry_at == now[0] + 2.0
+		now[0] += 2.5
+		await c.get('a')
+		now[0] += 10
+		await c.get('a')
+		assert c._retry_at == now[0] + 4.0
+	asyncio.run(main())
+	assert c.stats()['errors'] == 4 and c.stats()['skipped'] == 1
+
+async def redis_stand_in(delay):
+	''' RESP server answering GET with nil after delay seconds, SET with OK and PING with PONG '''
+	async def handle(reader, writer):
+		while True:
+			line = await reader.readline()
+			if not line:
+				break
+			args = []
+			for i in range(int(line[1:-2])):
+				n = int((await reader.readline())[1:-2])
+				args.append((await reader.readexactly(n + 2))[:-2])
+			command = args[0].upper()
+			if command == b'GET':
+				await asyncio.sleep(delay)
+				writer.write(b'$-1\r\n')
+			elif command == b'PING':
+				writer.write(b'+PONG\r\n')
+			else:
+				writer.write(b'+OK\r\n')
+	return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+def test_redis_commands_run_concurrently():
+	async def main():
+		server = await redis_stand_in(0.05)
+		c = cache.RedisCache(port=server.sockets[0].getsockname()[1], maxconn=4)
+		await c.check()
+		start = time.time()
+		await asyncio.gather(*[c.get('k%d' % i) for i in range(4)])
+		elapsed = time.time() - start
+		await c.get('k')
+		stats = c.stats()
+		c._close_idle()
+		server.close()
+		return elapsed, stats
+	elapsed, stats = asyncio.run(main())
+	# 4个连接同时等待, 而不是依次等待0.05秒
+	assert elapsed < 0.15
+	assert stats['misses'] == 5 and stats['errors'] == 0 and stats['connections'] == 4
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from models import Blog
+
+def test_columns(run, db):
+	columns = run(lambda: Blog.findAll(limit=3, rows='columns'))
+	assert list(columns) == ['id'] + Blog.__fields__
+	assert columns['created_at'].dtype == numpy.float64 and len(columns['id']) == 3
+
+def test_empty_result_has_typed_columns(run, db):
+	columns = run(lambda: Blog.findAll(limit=(0, 0), rows='columns'))
+	assert list(columns) == ['id'] + Blog.__fields__
+	assert all(len(a) == 0 for a in columns.values())
+	assert columns['created_at'].dtype == numpy.float64 and columns['name'].dtype == object
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import orm
+from models import Blog, Comment
+
+def comment(id, blog_id):
+	return Comment(id=id, blog_id=blog_id, user_id='u', user_name='n', user_image='i', content='c')
+
+def count_queries(db):
+	return len([sql for sql, args in db if 'count(' in sql])
+
+def test_count_is_cached(run, db):
+	async def main():
+		return [await Blog.count(), await Blog.count()]
+	assert run(main, count_estimate_above=0) == [10000, 10000]
+	assert count_queries(db) == 1
+
+def test_save_and_remove_adjust_counts(run, db):
+	async def main():
+		counts = [await Comment.count(), await Comment.count('blog_id=?', ['b1']), await Comment.count('blog_id=?', ['b2'])]
+		await comment('c1', 'b1').save()
+		await comment('c2', 'b1').save()
+		await comment('c3', 'b1').remove()
+		return counts, [await Comment.count(), await Comment.count('blog_id=?', ['b1']), await Comment.count('blog_id=?', ['b2'])]
+	before, after = run(main, count_estimate_above=0)
+	assert before == [10000, 10000, 10000]
+	assert after == [10001, 10001, 10000]
+	# 按写入调整, 没有重新计数
+	assert count_queries(db) == 3
+
+def test_update_drops_filtered_counts(run, db):
+	async def main():
+		await Comment.count()
+		await Comment.count('blog_id=?', ['b1'])
+		await comment('c1', 'b1').update()
+		await Comment.count()
+		await Comment.count('blog_id=?', ['b1'])
+	run(main, count_estimate_above=0)
+	# 条件计数重新查询, 总数不变
+	assert count_queries(db) == 3
+
+def test_counts_change_on_commit_only(run, db):
+	async def main():
+		await Comment.count()
+		with pytest.raises(ValueError):
+			async with orm.transaction():
+				await comment('c1', 'b1').save()
+				raise ValueError()
+		rolled_back = await Comment.count()
+		async with orm.transaction():
+			await comment('c2', 'b1').save()
+		return rolled_back, await Comment.count()
+	assert run(main, count_estimate_above=0) == (10000, 10001)
+
+def test_count_estimate(run, db):
+	async def main():
+		return await Blog._count(None, None, False, None), await Blog._count(None, None, True, None)
+	estimate, exact = run(main, count_estimate_above=1000)
+	assert estimate == (10000, False)
+	# exact=True不使用估算值
+	assert exact == (10000, True)
+	assert len([sql for sql, args in db if 'information_schema' in sql]) == 1
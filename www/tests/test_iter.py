@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from bench import fakedb
+from models import Blog
+
+def test_iter_all_streams_one_query(run, db):
+	async def main():
+		return [b async for b in Blog.iter_all('user_id=?', ['u'], batch_size=7)]
+	blogs = run(main)
+	assert [b.id for b in blogs] == ['blogs-%d' % i for i in range(20)]
+	assert isinstance(blogs[0], Blog)
+	(sql, args), = db
+	assert sql.endswith('where user_id=%s') and args == ['u']
+
+def test_iter_all_compact_rows(run, db):
+	async def main():
+		return [r async for r in Blog.iter_all(rows='compact')]
+	rows = run(main)
+	assert len(rows) == 20 and rows[3].id == 'blogs-3' and rows[3].created_at == 1500000003.0
+	assert not isinstance(rows[0], dict)
+
+def test_iter_all_keyset_pages(run, db):
+	async def main():
+		blogs = []
+		async for b in Blog.iter_all(batch_size=3, keyset='created_at'):
+			blogs.append(b)
+			if len(blogs) == 3:
+				# 第二批不足batch_size行, 迭代结束
+				fakedb.configure(latency=0, rows=1)
+		return blogs
+	blogs = run(main)
+	assert len(blogs) == 4
+	(first, first_args), (second, second_args) = db
+	assert first.endswith('order by `created_at`, `id` limit %s') and first_args == [3]
+	assert 'where (`created_at` > %s or (`created_at` = %s and `id` > %s))' in second
+	assert second_args == [1500000002.0, 1500000002.0, 'blogs-2', 3]
+
+def test_iter_all_primary_key_pages(run, db):
+	async def main():
+		fakedb.configure(latency=0, rows=2)
+		return [b.id async for b in Blog.iter_all(batch_size=3, keyset=True)]
+	assert run(main) == ['blogs-0', 'blogs-1']
+	(sql, args), = db
+	assert sql.endswith('order by `id` limit %s')
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from email.utils import formatdate
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from coroweb import get, add_route
+from pagecache import PageCache, Entry, cache_factory, init_page_cache
+
+renders = []
+
+@get('/page', cache=dict(ttl=60, stale=300))
+async def page(request, **kw):
+	renders.append(request.path_qs)
+	return web.Response(text='page %d' % len(renders))
+
+@get('/nocache')
+async def nocache(request, **kw):
+	renders.append(request.path_qs)
+	return web.Response(text='nocache %d' % len(renders))
+
+def serve(main, **kw):
+	''' run main(client, cache) against an app with the page cache and the routes above '''
+	del renders[:]
+	async def run():
+		app = web.Application(middlewares=[cache_factory])
+		cache = init_page_cache(app, **kw)
+		add_route(app, page)
+		add_route(app, nocache)
+		async with TestClient(TestServer(app)) as client:
+			return await main(client, cache)
+	return asyncio.run(run())
+
+async def fetch(client, path, **headers):
+	async with client.get(path, headers=headers) as r:
+		return r.status, r.headers.get('X-Cache'), await r.text(), r.headers
+
+def test_hit_after_miss():
+	async def main(client, cache):
+		return [(await fetch(client, '/page'))[:3] for i in range(2)], (await fetch(client, '/page?x=1'))[:3]
+	pages, other = serve(main)
+	assert pages == [(200, 'MISS', 'page 1'), (200, 'HIT', 'page 1')]
+	# 查询串不同的是另一个缓存项
+	assert other == (200, 'MISS', 'page 2')
+
+def test_uncached_route_calls_the_view():
+	async def main(client, cache):
+		return [(await fetch(client, '/nocache'))[:3] for i in range(2)]
+	assert serve(main) == [(200, None, 'nocache 1'), (200, None, 'nocache 2')]
+
+def test_not_modified_by_etag():
+	async def main(client, cache):
+		status, state, text, headers = await fetch(client, '/page')
+		etag = headers['ETag']
+		return [(await fetch(client, '/page', **{'If-None-Match': value}))[:3]
+			for value in (etag, 'W/' + etag, etag[:-1] + '-gzip"', '"other"')], cache.stats()['not_modified']
+	results, not_modified = serve(main)
+	assert results == [(304, 'HIT', ''), (304, 'HIT', ''), (304, 'HIT', ''), (200, 'HIT', 'page 1')]
+	assert not_modified == 3 and renders == ['/page']
+
+def test_not_modified_since():
+	async def main(client, cache):
+		status, state, text, headers = await fetch(client, '/page')
+		modified = headers['Last-Modified']
+		earlier = formatdate(0, usegmt=True)
+		return [(await fetch(client, '/page', **{'If-Modified-Since': value}))[:2] for value in (modified, earlier)]
+	assert serve(main) == [(304, 'HIT'), (200, 'HIT')]
+
+def test_stale_while_revalidate():
+	async def main(client, cache):
+		await fetch(client, '/page')
+		entry, = cache._data.values()
+		# 超过ttl, 仍在stale窗口内
+		entry.created -= 61
+		stale = (await fetch(client, '/page'))[:3]
+		# 后台刷新用request.clone()重新渲染
+		await asyncio.gather(*cache._refreshing.values())
+		return stale, (await fetch(client, '/page'))[:3], cache.stats()
+	stale, fresh, stats = serve(main)
+	assert stale == (200, 'STALE', 'page 1')
+	assert fresh == (200, 'HIT', 'page 2')
+	assert renders == ['/page', '/page'] and stats['stale_hits'] == 1 and stats['hits'] == 1
+
+def test_expired_past_stale_is_rendered_again():
+	async def main(client, cache):
+		await fetch(client, '/page')
+		entry, = cache._data.values()
+		entry.created -= 60 + 300
+		return (await fetch(client, '/page'))[:3]
+	assert serve(main) == (200, 'MISS', 'page 2')
+
+def entry(body):
+	return Entry(200, (), body, 60, 0)
+
+def test_lru_bounded_by_bytes():
+	size = entry(b'x' * 1000).size
+	cache = PageCache(max_bytes=size * 3, max_entry_bytes=size * 2)
+	for key in 'abc':
+		assert cache.set(key, entry(b'x' * 1000))
+	# 访问过的a移到最近使用的一端
+	assert cache.get('a') is not None
+	cache.set('d', entry(b'x' * 1000))
+	assert list(cache._data) == ['c', 'a', 'd']
+	assert cache.get('b') is None and cache.evictions == 1 and cache.bytes == size * 3
+	# 一个更大的项挤出多个旧项
+	cache.set('e', entry(b'x' * 1500))
+	assert list(cache._data) == ['d', 'e'] and cache.evictions == 3
+	assert cache.bytes == size + entry(b'x' * 1500).size
+	# 超过max_entry_bytes的项不保存
+	assert not cache.set('f', entry(b'x' * size * 2))
+	assert 'f' not in cache._data
+
+def test_fragment():
+	cache = PageCache()
+	built = []
+	def build():
+		built.append(1)
+		return 'sidebar %d' % len(built)
+	async def abuild():
+		return build()
+	async def main():
+		first = [await cache.fragment('sidebar', 60, build) for i in range(2)]
+		cache._data[('FRAGMENT', 'sidebar')].created -= 61
+		# 过期后重新生成, build也可以是协程函数
+		return first, await cache.fragment('sidebar', 60, abuild), await cache.fragment('sidebar', 60, abuild)
+	first, rebuilt, cached = asyncio.run(main())
+	assert first == ['sidebar 1', 'sidebar 1']
+	assert rebuilt == cached == 'sidebar 2'
+	assert (cache.hits, cache.misses) == (2, 2)
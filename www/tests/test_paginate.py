@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import orm
+from bench import fakedb
+from models import Blog
+
+def test_cursor_round_trip():
+	cursor = orm.encode_cursor('n', [1500000000.5, 'blog-1'])
+	assert orm.decode_cursor(cursor) == ('n', [1500000000.5, 'blog-1'])
+	# url安全, 没有填充
+	assert '=' not in cursor and '/' not in cursor and '+' not in cursor
+
+@pytest.mark.parametrize('cursor', ['', 'not a cursor', orm.encode_cursor('x', [1]), orm.encode_cursor('n', [])])
+def test_invalid_cursor(cursor):
+	with pytest.raises(ValueError):
+		orm.decode_cursor(cursor)
+
+def test_first_page(run, db):
+	page = run(lambda: Blog.paginate(limit=5, total=False))
+	assert [b.id for b in page.items] == ['blogs-%d' % i for i in range(5)]
+	last = page.items[-1]
+	assert orm.decode_cursor(page.next) == ('n', [last.created_at, last.id])
+	assert page.prev is None and page.total is None
+	sql, args = db[-1]
+	assert 'where' not in sql and sql.endswith('order by `created_at` desc, `id` desc limit %s')
+	# 多取一行判断是否还有下一页
+	assert args == [6]
+
+def test_next_page_seeks_from_cursor(run, db):
+	cursor = orm.encode_cursor('n', [1500000004.0, 'blogs-4'])
+	page = run(lambda: Blog.paginate(cursor=cursor, limit=5, total=False))
+	sql, args = db[-1]
+	assert 'where (`created_at` < %s or (`created_at` = %s and `id` < %s))' in sql
+	assert args == [1500000004.0, 1500000004.0, 'blogs-4', 6]
+	assert page.next is not None
+	assert orm.decode_cursor(page.prev) == ('p', [page.items[0].created_at, page.items[0].id])
+
+def test_prev_page_reverses_order(run, db):
+	cursor = orm.encode_cursor('p', [1500000004.0, 'blogs-4'])
+	page = run(lambda: Blog.paginate('user_id=?', ['u'], cursor=cursor, limit=5, total=False))
+	sql, args = db[-1]
+	assert 'where (user_id=%s) and (`created_at` > %s or (`created_at` = %s and `id` > %s))' in sql
+	assert sql.endswith('order by `created_at` asc, `id` asc limit %s')
+	assert args == ['u', 1500000004.0, 1500000004.0, 'blogs-4', 6]
+	# 反向取到的行倒过来返回
+	assert [b.id for b in page.items] == ['blogs-%d' % i for i in reversed(range(5))]
+	assert page.prev is not None and page.next is not None
+
+def test_last_page_has_no_next(run, db):
+	fakedb.configure(latency=0, rows=3)
+	page = run(lambda: Blog.paginate(limit=5, total=False))
+	assert len(page.items) == 3 and page.next is None
+
+def test_primary_key_cursor(run, db):
+	page = run(lambda: Blog.paginate(limit=2, key='id', total=False))
+	assert orm.decode_cursor(page.next) == ('n', ['blogs-1'])
+	with pytest.raises(ValueError):
+		run(lambda: Blog.paginate(cursor=orm.encode_cursor('n', [1.0, 'blogs-1']), key='id'))
+
+def test_total_comes_from_count(run, db):
+	page = run(lambda: Blog.paginate(limit=5), count_estimate_above=0)
+	assert page.total == 10000 and page.exact
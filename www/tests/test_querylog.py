@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import querylog
+from models import Blog, Comment
+
+TABLES = {'blogs': Blog, 'comments': Comment}
+
+@pytest.mark.parametrize('sql, shape', [
+	# 占位符和字面量
+	('select * from `blogs` where `id`=%s', 'select * from `blogs` where `id`=?'),
+	("select * from `users` where `email`='a@b.c' and `admin`=1", 'select * from `users` where `email`=? and `admin`=?'),
+	("select * from t where name='it''s' and note='a\\'b'", 'select * from t where name=? and note=?'),
+	('select * from t where x > -1.5 limit 10, 20', 'select * from t where x > ? limit ?, ?'),
+	# 标识符中的数字不变
+	('select `col1`, t2.c3 from `t2` where `col1`=5', 'select `col1`, t2.c3 from `t2` where `col1`=?'),
+	# in列表
+	('select * from `blogs` where `id` in (%s, %s, %s)', 'select * from `blogs` where `id` in (...)'),
+	('select * from `blogs` where `id` IN (%s,%s)', 'select * from `blogs` where `id` in (...)'),
+	('select * from t where id in (1, 2, 3)', 'select * from t where id in (...)'),
+	# 多行insert
+	('insert into `t` (`a`, `b`) values (%s, %s), (%s, %s), (%s, %s)', 'insert into `t` (`a`, `b`) values (?, ?)'),
+	# 空白
+	('  select *\n\tfrom `blogs`\n  where `id` = %s  ', 'select * from `blogs` where `id` = ?'),
+])
+def test_normalize(sql, shape):
+	assert querylog.normalize(sql) == shape
+
+def test_normalize_folds_variants_to_one_shape():
+	shapes = set(querylog.normalize(sql) for sql in [
+		'select * from `comments` where `blog_id` in (%s)',
+		'select * from `comments` where `blog_id` in (%s, %s)',
+		"select * from `comments`  where `blog_id` in ('a', 'b', 'c')",
+	])
+	assert shapes == {'select * from `comments` where `blog_id` in (...)'}
+
+def advise(sql, *plan):
+	return querylog.advise(querylog.normalize(sql), list(plan), TABLES)
+
+def test_full_scan():
+	advice, = advise('select * from `comments` where `blog_id`=%s and `created_at`>%s order by `created_at` desc',
+		dict(table='comments', type='ALL', key=None, rows=100000, Extra='Using where; Using filesort'))
+	assert advice['columns'] == ['blog_id', 'created_at']
+	assert advice['reason'] == 'full scan of ~100000 rows'
+	assert advice['ddl'] == 'alter table `comments` add key `idx_blog_id_created_at` (`blog_id`, `created_at`)'
+
+def test_filesort():
+	advice, = advise('select * from `comments` where `blog_id`=%s order by `created_at` desc limit %s',
+		dict(table='comments', type='ref', key='idx_blog_id', rows=500, Extra='Using where; Using filesort'))
+	assert advice['columns'] == ['blog_id', 'created_at'] and advice['reason'] == 'filesort of ~500 rows'
+
+def test_using_temporary():
+	advice, = advise('select `user_id`, count(*) from `comments` where `blog_id`=%s group by `user_id` order by `user_id`',
+		dict(table='comments', type='ref', key='idx_blog_id', rows=500, Extra='Using where; Using temporary'))
+	assert advice['columns'] == ['blog_id', 'user_id'] and advice['reason'] == 'temporary table of ~500 rows'
+
+@pytest.mark.parametrize('sql, plan', [
+	# 使用了索引
+	('select * from `comments` where `blog_id`=%s', dict(table='comments', type='ref', key='idx_blog_id', rows=5, Extra='')),
+	# 按主键查找
+	('select * from `blogs` where `id`=%s', dict(table='blogs', type='ALL', key=None, rows=1, Extra='')),
+	# text列不能建索引
+	('select * from `blogs` where `content` like %s', dict(table='blogs', type='ALL', key=None, rows=100, Extra='')),
+	# 没有model的表
+	('select * from `other` where `a`=%s', dict(table='other', type='ALL', key=None, rows=100, Extra='')),
+])
+def test_no_advice(sql, plan):
+	assert advise(sql, plan) == []
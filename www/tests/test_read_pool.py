@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import orm
+from models import Blog, Comment
+
+REPLICAS = [{'name': 'r1'}, {'name': 'r2'}]
+
+def acquired():
+	return dict((name, stats['acquired']) for name, stats in orm._pool_stats.items() if name in orm._pools)
+
+def test_primary_without_replicas(run):
+	async def main():
+		return orm.read_pool()
+	assert run(main) == 'primary'
+
+def test_round_robin(run):
+	async def main():
+		picks = [orm.read_pool() for i in range(6)]
+		# 连接占用不影响轮询
+		async with orm.connection('r1'):
+			picks.extend(orm.read_pool() for i in range(2))
+		return picks
+	picks = run(main, replicas=REPLICAS)
+	assert sorted(picks[:2]) == ['r1', 'r2']
+	assert picks == picks[:2] * 4
+
+def test_least_busy(run):
+	async def main():
+		idle = [orm.read_pool() for i in range(4)]
+		async with orm.connection('r1'):
+			busy = [orm.read_pool() for i in range(4)]
+		return idle, busy
+	idle, busy = run(main, replicas=REPLICAS, balance='least_busy')
+	# 占用相同时轮流分配
+	assert sorted(idle) == ['r1', 'r1', 'r2', 'r2']
+	assert busy == ['r2'] * 4
+
+def test_reads_are_spread_over_replicas(run, db):
+	async def main():
+		before = acquired()
+		for i in range(4):
+			await Blog.findAll(limit=1)
+		after = acquired()
+		return dict((name, after[name] - before.get(name, 0)) for name in after)
+	assert run(main, replicas=REPLICAS) == dict(primary=0, r1=2, r2=2)
+
+def test_reads_stick_to_primary_after_a_write(run, db):
+	async def main():
+		with orm.request_scope():
+			before = [orm.read_pool() for i in range(2)]
+			await Comment(id='c1', blog_id='b1', user_id='u', user_name='n', user_image='i', content='c').save()
+			start = acquired()
+			after = [orm.read_pool() for i in range(2)]
+			await Blog.findAll(limit=1)
+			routed = dict((name, n - start[name]) for name, n in acquired().items())
+		# 另一个请求不受影响
+		with orm.request_scope():
+			other = orm.read_pool()
+		return before, after, routed, other
+	before, after, routed, other = run(main, replicas=REPLICAS)
+	assert sorted(before) == ['r1', 'r2']
+	assert after == ['primary', 'primary'] and routed == dict(primary=1, r1=0, r2=0)
+	assert other in ('r1', 'r2')
+
+def test_writes_outside_a_request_do_not_stick(run, db):
+	async def main():
+		await Comment(id='c1', blog_id='b1', user_id='u', user_name='n', user_image='i', content='c').save()
+		return orm.read_pool()
+	assert run(main, replicas=REPLICAS) in ('r1', 'r2')
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from router import RadixRouter
+
+def view(name):
+	async def handler(request):
+		args = ','.join('%s=%s' % item for item in sorted(request.match_info.items()))
+		return web.Response(text='%s %s' % (name, args))
+	return handler
+
+def fetch(router, routes, requests):
+	''' (status, text) of each (method, path) in requests, with routes added to router '''
+	async def main():
+		app = web.Application(router=router)
+		for method, path, name in routes:
+			app.router.add_route(method, path, view(name))
+		async with TestClient(TestServer(app)) as client:
+			results = []
+			for method, path in requests:
+				async with client.request(method, path) as r:
+					results.append((r.status, await r.text() if r.status == 200 else ''))
+			return results
+	return asyncio.run(main())
+
+def test_static_segment_before_variable():
+	routes = [('GET', '/blog/{id}', 'blog'), ('GET', '/blog/new', 'new')]
+	requests = [('GET', '/blog/new'), ('GET', '/blog/42')]
+	# 与UrlDispatcher一致: 字面路径不受注册顺序影响
+	assert fetch(RadixRouter(), routes, requests) == fetch(None, routes, requests) == [(200, 'new '), (200, 'blog id=42')]
+
+def test_typed_segments():
+	routes = [
+		('GET', '/blog/{id:int}', 'int'),
+		('GET', '/blog/{slug}', 'slug'),
+		('GET', '/user/{uid:uuid}', 'uuid'),
+		('GET', '/files/{file:path}', 'path'),
+		('GET', '/feed-{name}.xml', 'feed'),
+	]
+	uid = '0f8fad5b-d9cb-469f-a165-70867728950e'
+	requests = [('GET', '/blog/42'), ('GET', '/blog/hello'), ('GET', '/user/' + uid), ('GET', '/user/42'),
+		('GET', '/files/a/b.txt'), ('GET', '/feed-rss.xml')]
+	assert fetch(RadixRouter(), routes, requests) == [
+		(200, 'int id=42'), (200, 'slug slug=hello'), (200, 'uuid uid=' + uid), (404, ''),
+		(200, 'path file=a/b.txt'), (200, 'feed name=rss')]
+
+def test_fallback_to_url_dispatcher():
+	router = RadixRouter()
+	async def other(request):
+		return web.Response(text='resource')
+	# 没有经过add_route的资源不在树中
+	router.add_resource('/other').add_route('GET', other)
+	routes = [('GET', '/blog/{id}', 'blog')]
+	assert fetch(router, routes, [('GET', '/other'), ('GET', '/blog/1'), ('GET', '/missing')]) == [
+		(200, 'resource'), (200, 'blog id=1'), (404, '')]
+	assert router.stats() == dict(routes=1, lookups=3, tree_hits=1, fallbacks=2)
+
+def test_method_not_allowed():
+	router = RadixRouter()
+	routes = [('GET', '/api/items', 'list'), ('POST', '/api/items', 'create'), ('GET', '/blog/{id:int}', 'blog')]
+	requests = [('POST', '/api/items'), ('DELETE', '/api/items'), ('PUT', '/blog/1')]
+	assert fetch(router, routes, requests) == [(200, 'create '), (405, ''), (405, '')]
+	# 405由UrlDispatcher给出
+	assert router.stats()['fallbacks'] == 2
+
+def test_any_method_route():
+	routes = [('*', '/ping', 'any')]
+	assert fetch(RadixRouter(), routes, [('GET', '/ping'), ('DELETE', '/ping')]) == [(200, 'any '), (200, 'any ')]
+
+def test_path_variable_must_be_last():
+	with pytest.raises(ValueError):
+		RadixRouter().add_route('GET', '/files/{file:path}/meta', view('meta'))
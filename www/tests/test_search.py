@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import orm, search
+from bench import fakedb
+from models import Blog
+
+FIELDS = {'name': 3, 'summary': 2, 'content': 1}
+
+@pytest.fixture(autouse=True)
+def indexes(monkeypatch, tmp_path):
+	monkeypatch.setattr(search, 'indexes', dict())
+	monkeypatch.setitem(search._options, 'path', str(tmp_path))
+	monkeypatch.setitem(search._options, 'batch_size', 500)
+	return search.indexes
+
+@pytest.mark.parametrize('text, tokens', [
+	('Hello, World!', ['hello', 'world']),
+	('asyncio_loop v2', ['asyncio', 'loop', 'v2']),
+	('数据库索引', ['数据', '据库', '库索', '索引']),
+	('库', ['库']),
+	('Python异步编程', ['python', '异步', '步编', '编程']),
+	('MySQL的索引', ['mysql', '的索', '索引']),
+	('', []),
+])
+def test_tokenize(text, tokens):
+	assert search.tokenize(text) == tokens
+
+def build():
+	index = search.Index('blogs', FIELDS)
+	index.add('b1', dict(name='数据库索引', summary='', content='优化'))
+	index.add('b2', dict(name='天气', summary='索引', content=''))
+	index.add('b3', dict(name='python', summary='asyncio', content='索引'))
+	index.add('b4', dict(name='今天天气很好', summary='', content=''))
+	return index
+
+def test_bm25_ranking():
+	# 同一个词, 权重高的字段排在前面
+	index = search.Index('blogs', FIELDS)
+	index.add('content', dict(name='天气', content='索引'))
+	index.add('name', dict(name='索引', content='天气'))
+	index.add('summary', dict(name='天气', summary='索引'))
+	assert [key for key, score in index.search('索引')] == ['name', 'summary', 'content']
+	assert [key for key, score in index.search('索引', limit=1)] == ['name']
+	index = build()
+	assert index.search('索引')[-1][0] == 'b3'
+	# 多个词的分数相加
+	assert index.search('索引 天气')[0][0] == 'b2'
+	assert index.search('不存在') == []
+
+def test_add_replaces_and_remove_leaves_tombstones():
+	index = build()
+	index.add('b1', dict(name='完全不同'))
+	assert sorted(key for key, score in index.search('索引')) == ['b2', 'b3']
+	assert index.remove('b2') and not index.remove('b2')
+	assert [key for key, score in index.search('索引')] == ['b3']
+	assert index.tombstones() == 2 and len(index) == 3
+	before = index.search('索引 天气 完全')
+	index.compact()
+	assert index.tombstones() == 0 and index.search('索引 天气 完全') == before
+
+def test_snapshot_round_trip(tmp_path):
+	index = build()
+	index.remove('b4')
+	index.position = [1500000000.0, 'b3']
+	path = str(tmp_path / 'blogs.idx')
+	assert index.save(path)
+	loaded = search.Index.load(path, FIELDS)
+	assert loaded.stats()['mapped'] and loaded.position == index.position
+	# 保存时tombstone多于1/4, 先compact
+	assert loaded.tombstones() == 0 and len(loaded) == 3
+	for query in ('索引', '天气', 'python asyncio', '优化'):
+		assert loaded.search(query) == index.search(query)
+	# 修改从映射的只读内存复制
+	loaded.add('b5', dict(name='索引'))
+	assert loaded.search('索引')[0][0] == 'b5'
+	assert search.Index.load(path, dict(name=1)) is None
+	assert search.Index.load(str(tmp_path / 'missing.idx'), FIELDS) is None
+
+def test_save_keeps_a_newer_snapshot(tmp_path):
+	path = str(tmp_path / 'blogs.idx')
+	newer = build()
+	newer.position = [2000.0, 'b4']
+	assert newer.save(path)
+	older = search.Index('blogs', FIELDS)
+	older.position = [1000.0, 'b1']
+	assert not older.save(path)
+	assert search.Index.header(path)['position'] == [2000.0, 'b4']
+
+def test_refresh_follows_updated_at(run, db, indexes, monkeypatch):
+	fakedb.configure(latency=0, rows=5)
+	indexes['blogs'] = search.Index('blogs', FIELDS)
+	respond = fakedb.respond
+	renamed = []
+	def rename(sql, args, as_dict):
+		rows, count, description = respond(sql, args, as_dict)
+		# 其他worker修改过的行
+		for row in rows:
+			if as_dict and row.get('id') in renamed:
+				row['name'] = 'renamed'
+		return rows, count, description
+	monkeypatch.setattr(fakedb, 'respond', rename)
+	async def main():
+		first = await search.refresh(Blog)
+		renamed.append('blogs-2')
+		second = await search.refresh(Blog)
+		return first, second
+	assert run(main) == (5, 5)
+	index = indexes['blogs']
+	assert index.position == [1500000004.0, 'blogs-4']
+	assert [key for key, score in index.search('renamed')] == ['blogs-2']
+	assert len(index) == 5
+	sql, args = [(sql, args) for sql, args in db if 'from `blogs`' in sql][-1]
+	assert 'order by `updated_at` asc, `id` asc' in sql
+	# 往回多读10秒, 等待其他进程较晚提交的行
+	assert args[:3] == [1500000004.0 - 10, 1500000004.0 - 10, '']
+
+def test_search_drops_rows_gone_from_the_table(run, db, indexes, monkeypatch):
+	index = indexes['blogs'] = search.Index('blogs', FIELDS)
+	index.add('blogs-1', dict(name='索引'))
+	index.add('gone', dict(name='索引'))
+	respond = fakedb.respond
+	def without_gone(sql, args, as_dict):
+		rows, count, description = respond(sql, args, as_dict)
+		rows = [r for r in rows if r['id'] != 'gone']
+		return rows, len(rows), description
+	monkeypatch.setattr(fakedb, 'respond', without_gone)
+	Blog.__cache__._data.clear()
+	results = run(lambda: search.search('索引', [Blog]))
+	assert [b.id for b, score in results] == ['blogs-1']
+	assert 'gone' not in index.docs
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, gzip
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from static import init_static
+
+SMALL = b''.join(b'line %04d\n' % i for i in range(100))
+LARGE = b''.join(b'line %06d\n' % i for i in range(10000))
+
+@pytest.fixture
+def root(tmp_path):
+	''' static dir with a small and a large file, each with a .gz variant '''
+	for name, data in (('small.txt', SMALL), ('large.txt', LARGE)):
+		(tmp_path / name).write_bytes(data)
+		(tmp_path / (name + '.gz')).write_bytes(gzip.compress(data))
+	return tmp_path
+
+def fetch(root, requests):
+	''' (status, Content-Encoding, Content-Range, body) of each (path, headers) '''
+	async def main():
+		app = web.Application()
+		init_static(app, str(root), '/static/', memory_file_max=4096)
+		async with TestClient(TestServer(app)) as client:
+			results = []
+			for path, headers in requests:
+				async with client.get(path, headers=headers, auto_decompress=False) as r:
+					results.append((r.status, r.headers.get('Content-Encoding'), r.headers.get('Content-Range'), await r.read()))
+			return results
+	return asyncio.run(main())
+
+@pytest.mark.parametrize('name, data', [('small.txt', SMALL), ('large.txt', LARGE)])
+def test_compressed_variant_without_range(root, name, data):
+	(status, encoding, rng, body), = fetch(root, [('/static/' + name, {'Accept-Encoding': 'gzip'})])
+	assert (status, encoding, rng) == (200, 'gzip', None)
+	assert gzip.decompress(body) == data
+
+@pytest.mark.parametrize('name, data', [('small.txt', SMALL), ('large.txt', LARGE)])
+def test_range_is_served_from_the_original_file(root, name, data):
+	headers = {'Accept-Encoding': 'gzip, br', 'Range': 'bytes=10-29'}
+	tail = {'Accept-Encoding': 'gzip', 'Range': 'bytes=-5'}
+	results = fetch(root, [('/static/' + name, headers), ('/static/' + name, tail)])
+	assert results == [
+		(206, None, 'bytes 10-29/%d' % len(data), data[10:30]),
+		(206, None, 'bytes %d-%d/%d' % (len(data) - 5, len(data) - 1, len(data)), data[-5:]),
+	]
+
+@pytest.mark.parametrize('name, data', [('small.txt', SMALL), ('large.txt', LARGE)])
+def test_unsatisfiable_range(root, name, data):
+	(status, encoding, rng, body), = fetch(root, [('/static/' + name, {'Range': 'bytes=%d-' % len(data)})])
+	assert status == 416 and rng == 'bytes */%d' % len(data)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import orm
+from bench import fakedb
+from models import Blog
+
+def blog(id):
+	return Blog(id=id, user_id='u', user_name='n', user_image='i', name='b', summary='s', content='c')
+
+def test_commit_runs_on_commit(run, db):
+	ran = []
+	async def done(name):
+		ran.append(name)
+	async def main():
+		async with orm.transaction() as tx:
+			await blog('b1').save()
+			tx.on_commit(done, 'b1')
+			assert ran == []
+	run(main)
+	assert ran == ['b1']
+	assert fakedb.stats['begin'] == 1 and fakedb.stats['commit'] == 1
+
+def test_rollback_skips_on_commit(run, db):
+	ran = []
+	async def done(name):
+		ran.append(name)
+	async def main():
+		with pytest.raises(ValueError):
+			async with orm.transaction() as tx:
+				tx.on_commit(done, 'b1')
+				raise ValueError()
+	run(main)
+	assert ran == []
+	assert fakedb.stats['rollback'] == 1 and fakedb.stats['commit'] == 0
+
+def test_savepoint_rollback_discards_its_callbacks(run, db):
+	ran = []
+	async def done(name):
+		ran.append(name)
+	async def main():
+		async with orm.transaction() as tx:
+			tx.on_commit(done, 'outer')
+			with pytest.raises(ValueError):
+				async with orm.transaction() as inner:
+					inner.on_commit(done, 'rolled back')
+					async with orm.transaction() as innermost:
+						innermost.on_commit(done, 'nested in rolled back')
+					raise ValueError()
+			async with orm.transaction() as inner:
+				inner.on_commit(done, 'released')
+	run(main)
+	assert ran == ['outer', 'released']
+	sql = [s for s, args in db if 'savepoint' in s]
+	assert sql == ['savepoint sp_1', 'savepoint sp_2', 'release savepoint sp_2', 'rollback to savepoint sp_1',
+		'savepoint sp_1', 'release savepoint sp_1']
+	assert fakedb.stats['commit'] == 1 and fakedb.stats['rollback'] == 0
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, json, os
+
+import pytest
+
+import orm
+from bench import fakedb
+from models import Comment
+
+def comment(id, blog_id='b1'):
+	return Comment(id=id, blog_id=blog_id, user_id='u', user_name='n', user_image='i', content='c', created_at=1.0, updated_at=1.0)
+
+def inserts(db):
+	return [(sql, args) for sql, args in db if sql.startswith('insert')]
+
+@pytest.fixture
+def buffered(db):
+	''' Comment.save buffered; flushed only by flush() or close_pool() '''
+	def configure(**kw):
+		options = dict(max_rows=100, max_delay=60, max_pending=100, max_wait=1.0)
+		options.update(kw)
+		asyncio.run(orm.configure_write_behind({'comments': options}))
+		return Comment.__write_behind__
+	return configure
+
+@pytest.fixture
+def saved():
+	rows = []
+	listener = lambda cls, action, row: rows.append((action, row['id']))
+	orm.add_listener(listener)
+	yield rows
+	orm.remove_listener(listener)
+
+def test_disabled_by_default():
+	assert Comment.__write_behind__ is None
+
+def test_configured_off(buffered):
+	buffered(enabled=False)
+	assert Comment.__write_behind__ is None and orm._write_behind == []
+
+def test_save_is_buffered_then_inserted_in_one_statement(run, db, buffered, saved):
+	buffer = buffered()
+	async def main():
+		count = await Comment.count('blog_id=?', ['b1'])
+		for i in range(3):
+			await comment('c%d' % i).save()
+		queued = (len(inserts(db)), saved[:], await Comment.count('blog_id=?', ['b1']))
+		written = await buffer.flush()
+		return count, queued, written, await Comment.count('blog_id=?', ['b1'])
+	count, queued, written, after = run(main, count_estimate_above=0)
+	# 写入前没有insert, 计数和监听也不变
+	assert queued == (0, [], count)
+	assert written == 3 and after == count + 3
+	assert saved == [('save', 'c0'), ('save', 'c1'), ('save', 'c2')]
+	(sql, args), = inserts(db)
+	assert 'on duplicate key' not in sql and sql.count('(%s') == 3
+	assert buffer.stats()['flushed'] == 3 and buffer.stats()['pending'] == 0
+
+def test_duplicate_keys_are_dropped(run, db, buffered, saved, monkeypatch):
+	buffer = buffered()
+	respond = fakedb.respond
+	def duplicate(sql, args, as_dict):
+		if sql.startswith('insert') and 'existing' in (args or ()):
+			raise Exception(orm.DUP_ENTRY, "Duplicate entry 'existing' for key 'PRIMARY'")
+		return respond(sql, args, as_dict)
+	monkeypatch.setattr(fakedb, 'respond', duplicate)
+	async def main():
+		count = await Comment.count()
+		for id in ('c1', 'existing', 'c2'):
+			await comment(id).save()
+		written = await buffer.flush()
+		return count, written, await Comment.count()
+	count, written, after = run(main, count_estimate_above=0)
+	assert written == 2 and after == count + 2
+	assert saved == [('save', 'c1'), ('save', 'c2')]
+	assert buffer.stats()['dropped'] == 1 and buffer.stats()['pending'] == 0
+	# 整批insert失败后逐行insert
+	assert fakedb.stats['rollback'] == 1
+
+def test_failed_batch_stays_queued(run, db, buffered, monkeypatch):
+	buffer = buffered()
+	respond = fakedb.respond
+	failures = [1]
+	def flaky(sql, args, as_dict):
+		if sql.startswith('insert') and failures:
+			failures.pop()
+			raise Exception(2013, 'Lost connection to MySQL server during query')
+		return respond(sql, args, as_dict)
+	monkeypatch.setattr(fakedb, 'respond', flaky)
+	async def main():
+		await comment('c1').save()
+		return await buffer.flush(), buffer.stats()['pending'], await buffer.flush()
+	assert run(main) == (0, 1, 1)
+	assert buffer.stats()['failures'] == 1
+
+def test_partial_fallback_requeues_only_the_rest(run, db, buffered, saved, monkeypatch):
+	buffer = buffered()
+	respond = fakedb.respond
+	failures = [1]
+	def failing(sql, args, as_dict):
+		if sql.startswith('insert') and 'existing' in (args or ()):
+			raise Exception(orm.DUP_ENTRY, "Duplicate entry 'existing' for key 'PRIMARY'")
+		if sql.startswith('insert') and args[-1] == 'c2' and failures:
+			failures.pop()
+			raise Exception(2013, 'Lost connection to MySQL server during query')
+		return respond(sql, args, as_dict)
+	monkeypatch.setattr(fakedb, 'respond', failing)
+	async def main():
+		for id in ('c1', 'existing', 'c2', 'c3'):
+			await comment(id).save()
+		written = await buffer.flush()
+		return written, [row[-1] for row in buffer.pending], await buffer.flush()
+	written, pending, retried = run(main)
+	# c1已写入, existing已丢弃, 只有c2和c3留在队列中
+	assert (written, pending, retried) == (1, ['c2', 'c3'], 2)
+	assert saved == [('save', 'c1'), ('save', 'c2'), ('save', 'c3')]
+	stats = buffer.stats()
+	assert (stats['flushed'], stats['dropped'], stats['failures']) == (3, 1, 1)
+
+def test_reconfigure_closes_the_old_buffer(run, db, buffered):
+	old = buffered()
+	async def main():
+		await comment('c1').save()
+		task = old._task
+		await orm.configure_write_behind({'comments': dict(max_rows=100, max_delay=60)})
+		return task.done(), old.stats()['flushed']
+	assert run(main) == (True, 1)
+	assert Comment.__write_behind__ is not old and orm._write_behind == [Comment.__write_behind__]
+
+def test_close_pool_flushes(run, db, buffered):
+	buffer = buffered()
+	async def main():
+		await comment('c1').save()
+		await comment('c2').save()
+	run(main)
+	assert buffer.stats()['flushed'] == 2 and len(inserts(db)) == 1
+
+def test_full_buffer_raises_overload(run, db, buffered):
+	buffer = buffered(max_rows=1000, max_pending=1, max_wait=0.02)
+	fakedb.configure(latency=0, write_latency=0.2)
+	async def main():
+		await comment('c1').save()
+		with pytest.raises(orm.WriteBehindOverloadError):
+			await comment('c2').save()
+		assert buffer.stats()['waits'] == 1
+	run(main)
+
+def dead_pid():
+	pid = 999999
+	while orm._alive(pid):
+		pid -= 1
+	return pid
+
+def test_journal_group_commit(run, db, buffered, tmp_path, monkeypatch):
+	buffer = buffered(journal=str(tmp_path / 'comments'), fsync=True)
+	writes = []
+	append = buffer._append
+	monkeypatch.setattr(buffer, '_append', lambda data: writes.append(data) or append(data))
+	syncs = []
+	fsync = os.fsync
+	monkeypatch.setattr(os, 'fsync', lambda fd: syncs.append(fd) or fsync(fd))
+	async def main():
+		await orm.start_write_behind()
+		del syncs[:]
+		await asyncio.gather(*[comment('c%d' % i).save() for i in range(5)])
+		with open(buffer._path()) as f:
+			return [json.loads(line)[-1] for line in f], len(syncs)
+	journal, synced = run(main)
+	# 同时保存的5行一次写入, 一次fsync
+	assert len(writes) == 1 and synced == 1
+	assert sorted(journal) == ['c%d' % i for i in range(5)]
+
+def test_journal_replay(run, db, buffered, tmp_path):
+	prefix = str(tmp_path / 'comments')
+	columns = Comment.__fields__ + [Comment.__primary_key__]
+	row = comment('journaled')
+	with open('%s.%d' % (prefix, dead_pid()), 'w') as f:
+		f.write(json.dumps([row.getValueOrDefault(c) for c in columns]) + '\n')
+		# 进程退出时写到一半的行
+		f.write('["half')
+	buffer = buffered(journal=prefix)
+	async def main():
+		await orm.start_write_behind()
+		assert buffer.stats()['pending'] == 1
+		await comment('live').save()
+		with open(buffer._path()) as f:
+			journal = [json.loads(line)[-1] for line in f]
+		# 重放的行唤醒了后台任务, 可能已经写入
+		await buffer.flush()
+		return journal, buffer.stats()['flushed']
+	journal, written = run(main)
+	assert journal == ['journaled', 'live'] and written == 2
+	(sql, args), = inserts(db)
+	assert args[len(columns) - 1] == 'journaled' and args[-1] == 'live'
+	# 已写入的行从日志中去掉, 死进程的日志被接管
+	assert os.listdir(str(tmp_path)) == [os.path.basename(buffer._path())]
+	assert os.path.getsize(buffer._path()) == 0
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Request tracing, per-route metrics and a sampling profiler.
+
+trace_factory (the first middleware) records the latency of every request in a histogram
+per route. For a sample of requests (configs.tracing.sample_rate) it also collects spans:
+
+	with tracing.span('orm.query', sql=sql) as s:
+		...
+		s.set(rows=len(rs))
+
+spans opened while no trace is active cost one contextvar lookup. Finished traces are kept
+in a small ring buffer, and traces slower than slow_threshold seconds are logged.
+
+Profiler samples the main thread stack every interval seconds of cpu time (SIGPROF) and
+dumps folded stacks, the input format of flamegraph.pl and speedscope.
+'''
+
+import asyncio, collections, contextvars, logging, random, signal, time
+
+from metrics import Histogram
+
+# 当前请求的Trace和当前span的id
+_trace = contextvars.ContextVar('trace', default=None)
+_parent = contextvars.ContextVar('trace_span', default=0)
+
+_options = dict(enabled=True, sample_rate=0.1, slow_threshold=1.0, keep=100)
+
+# 'GET /blog/{id}' => dict(latency=Histogram, status=Counter)
+route_metrics = dict()
+# span名 => Histogram
+span_metrics = collections.defaultdict(Histogram)
+_recent = collections.deque(maxlen=100)
+
+def configure(enabled=True, sample_rate=0.1, slow_threshold=1.0, keep=100):
+	'''
+	sample_rate: fraction of requests recording spans; slow_threshold: seconds after
+	which a sampled trace is logged as a warning; keep: number of recent traces kept.
+	'''
+	global _recent
+	_options.update(enabled=enabled, sample_rate=sample_rate, slow_threshold=slow_threshold, keep=keep)
+	_recent = collections.deque(_recent, maxlen=keep)
+
+class Span(object):
+	__slots__ = ('trace', 'id', 'parent', 'name', 'start', 'duration', 'attrs', '_token')
+
+	def __init__(self, trace, name, attrs):
+		self.trace = trace
+		self.name = name
+		self.attrs = attrs
+		self.duration = None
+
+	def set(self, **attrs):
+		self.attrs.update(attrs)
+
+	def __enter__(self):
+		trace = self.trace
+		trace._next_id += 1
+		self.id = trace._next_id
+		self.parent = _parent.get()
+		self._token = _parent.set(self.id)
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.duration = time.perf_counter() - self.start
+		_parent.reset(self._token)
+		if exc_type is not None:
+			self.attrs['error'] = exc_type.__name__
+		self.trace.spans.append(self)
+		span_metrics[self.name].observe(self.duration)
+		return False
+
+class _NoopSpan(object):
+	__slots__ = ()
+
+	def set(self, **attrs):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		return False
+
+_NOOP = _NoopSpan()
+
+class Trace(object):
+
+	def __init__(self, method, path):
+		self.method = method
+		self.path = path
+		self.route = None
+		self.status = None
+		self.started = time.time()
+		self.start = time.perf_counter()
+		self.duration = None
+		self.spans = []
+		self._next_id = 0
+
+	def to_dict(self):
+		spans = sorted(self.spans, key=lambda s: s.start)
+		return dict(method=self.method, path=self.path, route=self.route, status=self.status,
+			started=self.started, duration=self.duration,
+			spans=[dict(id=s.id, parent=s.parent, name=s.name, offset=s.start - self.start,
+				duration=s.duration, attrs=s.attrs) for s in spans])
+
+def span(name, **attrs):
+	''' context manager timing a span of the current trace, a no-op when the request is not sampled '''
+	trace = _trace.get()
+	if trace is None:
+		return _NOOP
+	return Span(trace, name, attrs)
+
+def current():
+	return _trace.get()
+
+def recent():
+	return [t.to_dict() for t in _recent]
+
+def route_key(request):
+	route = getattr(request.match_info, 'route', None)
+	resource = getattr(route, 'resource', None)
+	if resource is None:
+		return '%s <unmatched>' % request.method
+	return '%s %s' % (request.method, resource.canonical)
+
+def observe_route(key, duration, status):
+	m = route_metrics.get(key, None)
+	if m is None:
+		m = route_metrics[key] = dict(latency=Histogram(), status=collections.Counter())
+	m['latency'].observe(duration)
+	m['status'][status] += 1
+
+def metrics():
+	routes = dict()
+	for key, m in route_metrics.items():
+		routes[key] = dict(m['latency'].snapshot(), status=dict((str(k), v) for k, v in m['status'].items()))
+	return dict(routes=routes, spans=dict((name, h.snapshot()) for name, h in span_metrics.items()))
+
+def reset():
+	route_metrics.clear()
+	span_metrics.clear()
+	_recent.clear()
+
+# 追踪中间件：应放在最外层，记录整个请求
+async def trace_factory(app, handler):
+	async def trace(request):
+		if not _options['enabled']:
+			return await handler(request)
+		t = None
+		if random.random() < _options['sample_rate']:
+			t = Trace(request.method, request.path)
+		token = _trace.set(t)
+		start = time.perf_counter()
+		status = 500
+		try:
+			resp = await handler(request)
+			status = resp.status
+			return resp
+		except Exception as e:
+			status = getattr(e, 'status', 500)
+			raise
+		finally:
+			duration = time.perf_counter() - start
+			_trace.reset(token)
+			key = route_key(request)
+			observe_route(key, duration, status)
+			if t is not None:
+				t.route = key
+				t.status = status
+				t.duration = duration
+				_recent.append(t)
+				if duration >= _options['slow_threshold']:
+					logging.warn('slow request %s %.3fs: %s' % (key, duration,
+						', '.join('%s=%.1fms' % (s.name, s.duration * 1000) for s in t.spans)))
+	return trace
+
+def traced(factory, name=None):
+	''' wrap a middleware factory so each sampled request gets a span middleware.<name> '''
+	name = 'middleware.' + (name or factory.__name__.replace('_factory', ''))
+	async def traced_factory(app, handler):
+		inner = await factory(app, handler)
+		async def middleware(request):
+			with span(name):
+				return await inner(request)
+		return middleware
+	traced_factory.__name__ = factory.__name__
+	return traced_factory
+
+class Profiler(object):
+	'''
+	Statistical profiler of the main thread: every `interval` seconds of cpu time the
+	current stack is counted. folded() returns one 'outer;...;inner count' line per stack.
+	'''
+	def __init__(self):
+		self.samples = collections.Counter()
+		self.running = False
+		self.started = None
+		self.interval = None
+
+	def _sample(self, signum, frame):
+		stack = []
+		while frame is not None:
+			code = frame.f_code
+			stack.append('%s:%s:%s' % (code.co_filename.rsplit('/', 1)[-1], code.co_name, code.co_firstlineno))
+			frame = frame.f_back
+		self.samples[';'.join(reversed(stack))] += 1
+
+	def start(self, interval=0.005):
+		if self.running:
+			return False
+		self.samples.clear()
+		self.interval = interval
+		self.started = time.time()
+		signal.signal(signal.SIGPROF, self._sample)
+		signal.setitimer(signal.ITIMER_PROF, interval, interval)
+		self.running = True
+		return True
+
+	def stop(self):
+		if self.running:
+			signal.setitimer(signal.ITIMER_PROF, 0, 0)
+			signal.signal(signal.SIGPROF, signal.SIG_DFL)
+			self.running = False
+		return self.folded()
+
+	def folded(self):
+		return '\n'.join('%s %d' % (stack, n) for stack, n in self.samples.most_common())
+
+	async def run(self, seconds, interval=0.005):
+		''' profile for seconds and return the folded stacks '''
+		if not self.start(interval):
+			raise RuntimeError('profiler already running')
+		try:
+			await asyncio.sleep(seconds)
+		finally:
+			result = self.stop()
+		return result
+
+profiler = Profiler()